@@ -0,0 +1,79 @@
+"""Memory held by a chunked corpus for the "copy" and "offsets" chunk storage modes.
+
+Builds a corpus of synthetic documents for every mode, chunks it and reports `Corpus.memory_usage()` together with
+the memory actually held once the input is dropped: Python allocations (tracemalloc) plus Arrow allocations. Pass
+`--object-text` to start from a `document_text` column of Python strings (the pandas < 3 default) instead of an
+Arrow-backed one.
+
+Usage:
+    python benchmarks/chunk_storage.py --num-documents 200 --document-size 40000 --chunk-size 1024
+"""
+import argparse
+import gc
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from info_extract.info_extract import CHUNK_STORAGE_MODES, Corpus
+
+
+def make_documents(num_documents: int, document_size: int, object_text: bool, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    vocabulary = [
+        "".join(rng.choice(list("abcdefghijklmnopqrstuvwxyzé"), size=rng.integers(2, 10))) for _ in range(5000)
+    ]
+    texts = []
+    for _ in range(num_documents):
+        words = rng.choice(vocabulary, size=document_size // 6)
+        texts.append(" ".join(words))
+    documents = pd.DataFrame(
+        {
+            "document_id": list(range(num_documents)),
+            "document_name": [f"document_{i}" for i in range(num_documents)],
+            "document_text": texts,
+        }
+    )
+    if object_text:
+        documents["document_text"] = documents["document_text"].astype(object)
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-documents", type=int, default=200)
+    parser.add_argument("--document-size", type=int, default=40000)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--object-text", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'storage':<8} {'chunks':>8} {'chunk s':>8} {'memory_usage MB':>16} {'held MB':>8}")
+    for storage in CHUNK_STORAGE_MODES:
+        gc.collect()
+        tracemalloc.start()
+        arrow_bytes = pa.total_allocated_bytes()
+
+        corpus = Corpus(
+            make_documents(args.num_documents, args.document_size, args.object_text, args.seed),
+            name="benchmark",
+            llm_endpoint=None,
+        )
+        start_t = perf_counter()
+        corpus.chunk(chunk_size=args.chunk_size, storage=storage)
+        chunk_s = perf_counter() - start_t
+        gc.collect()
+
+        held_bytes = tracemalloc.get_traced_memory()[0] + pa.total_allocated_bytes() - arrow_bytes
+        tracemalloc.stop()
+        print(
+            f"{storage:<8} {len(corpus.chunks.df):>8} {chunk_s:>8.2f} {corpus.memory_usage() / 2**20:>16.1f} "
+            f"{held_bytes / 2**20:>8.1f}"
+        )
+        del corpus
+
+
+if __name__ == "__main__":
+    main()
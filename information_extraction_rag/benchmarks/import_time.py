@@ -0,0 +1,74 @@
+"""Import time of the info_extract modules, and check that provider dependencies are imported lazily.
+
+Every module is imported in a fresh interpreter, `--repeat` times, and the median import time is reported together
+with the heavy modules it loaded. The script exits with status 1 if a module loads a dependency it must not load at
+import time, or if its median import time exceeds `--max-ms`, so it can guard against regressions in CI.
+
+Usage:
+    python benchmarks/import_time.py --repeat 5 --max-ms 2000
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ["numpy", "pandas", "pyarrow", "ludwig", "predibase", "sentence_transformers", "torch"]
+PROVIDER_MODULES = ["ludwig", "predibase", "sentence_transformers", "torch"]
+
+# module -> heavy modules it must not load at import time.
+FORBIDDEN = {
+    "info_extract": HEAVY_MODULES,
+    "info_extract.scheduler": HEAVY_MODULES,
+    "info_extract.endpoints": HEAVY_MODULES,
+    "info_extract.retrieval": PROVIDER_MODULES,
+    "info_extract.info_extract": PROVIDER_MODULES,
+}
+
+PROBE = """
+import json, sys
+from time import perf_counter
+start_t = perf_counter()
+import {module}
+elapsed = perf_counter() - start_t
+print(json.dumps({{"seconds": elapsed, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if a median import time exceeds this")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<28} {'ms':>9}  loaded")
+    for module, forbidden in FORBIDDEN.items():
+        runs = [measure(module) for _ in range(args.repeat)]
+        median_ms = 1000 * statistics.median(run["seconds"] for run in runs)
+        loaded = runs[0]["loaded"]
+        print(f"{module:<28} {median_ms:>9.1f}  {', '.join(loaded) or '-'}")
+
+        unexpected = [name for name in loaded if name in forbidden]
+        if unexpected:
+            failures.append(f"`{module}` imports {', '.join(unexpected)} at import time.")
+        if args.max_ms is not None and median_ms > args.max_ms:
+            failures.append(f"`{module}` takes {median_ms:.1f}ms to import (max {args.max_ms}ms).")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Recall versus latency of the EmbeddingIndex storage options.
+
+Builds an index over synthetic clustered embeddings (768 dimensions, like all-mpnet-base-v2) for every storage option
+and reports recall@k against the exact float32 search, mean search latency per query and searched memory.
+Reduced precision vectors are converted to float32 in cache-sized blocks while scoring. int8 converts fast enough to
+be searched about as fast as float32 with a quarter of the memory. float16 is a memory-only option: numpy's half
+precision conversion is slow, so it is searched several times slower than float32.
+
+Usage:
+    python benchmarks/quantized_index.py --num-items 200000 --num-queries 100 --k 10
+"""
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+from info_extract.retrieval import EmbeddingIndex
+
+CONFIGS = [
+    ("float32", False),
+    ("float16", False),
+    ("float16", True),
+    ("int8", False),
+    ("int8", True),
+]
+
+
+def make_embeddings(num_items: int, num_queries: int, dim: int, num_clusters: int, seed: int):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+    items = centers[rng.integers(num_clusters, size=num_items)] + 0.5 * rng.standard_normal((num_items, dim))
+    queries = centers[rng.integers(num_clusters, size=num_queries)] + 0.5 * rng.standard_normal((num_queries, dim))
+    return items.astype(np.float32), queries.astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-items", type=int, default=200000)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--num-clusters", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    items, queries = make_embeddings(args.num_items, args.num_queries, args.dim, args.num_clusters, args.seed)
+
+    exact = EmbeddingIndex(dtype="float32")
+    exact.build(items)
+    _, ground_truth = exact.search(queries, k=args.k)
+
+    print(f"{'dtype':<8} {'rescore':<8} {'recall@k':>9} {'ms/query':>9} {'MB':>9}")
+    for dtype, rescore in CONFIGS:
+        index = EmbeddingIndex(dtype=dtype, rescore=rescore, rescore_factor=args.rescore_factor)
+        index.build(items)
+
+        # one query at a time, so that the latency is the single-query latency.
+        all_positions = []
+        start_t = perf_counter()
+        for query in queries:
+            _, positions = index.search(query, k=args.k)
+            all_positions.append(positions[0])
+        latency_ms = 1000 * (perf_counter() - start_t) / len(queries)
+
+        recall = np.mean(
+            [len(set(found) & set(expected)) / args.k for found, expected in zip(all_positions, ground_truth)]
+        )
+        print(f"{dtype:<8} {str(rescore):<8} {recall:>9.4f} {latency_ms:>9.2f} {index.nbytes / 2**20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
-import os
 import concurrent.futures
+import os
+from time import perf_counter
 
 import streamlit as st
-from time import perf_counter
 from predibase import PredibaseClient
+
 from info_extract import Corpus
 from info_extract.endpoints import get_llm_endpoint
+from info_extract.info_extract import corpus_version_key
+from info_extract.registry import CorpusRegistry
 from info_extract.retrieval import get_retriever
 
 
@@ -46,13 +49,15 @@ st.header("📖 Predibase Document QA")
 
 
 with st.sidebar:
-    st.markdown("""
+    st.markdown(
+        """
     ## How to use
     0. Enter your Predibase API token.
     1. Connect your dataset in Predibase.
     2. Select the dataset you'd like to query.
     3. Ask questions about your documents.
-        """)
+        """
+    )
 
     api_key_input = st.text_input(
         "Predibase API Token",
@@ -77,27 +82,66 @@ def get_rag_datasets(predibase_api_token):
     return rag_tup, rag_dataset_list
 
 
-@st.cache_data(show_spinner=False)
-def build_corpus(dataset_name, connection_name):
-    predibase_dataset = pc.get_dataset(dataset_name=dataset_name, connection_name=connection_name)
-    print("GETTING DATASET", predibase_dataset.name)
-    corpus_name = predibase_dataset.name
-    chunk_size = 1999
-
-    llm_endpoint = get_llm_endpoint(model_provider="predibase", model_name="llama-2-13b", predibase_client=pc)
+@st.cache_resource
+def get_corpus_registry():
+    # One registry per server process, shared by every session. Least recently used corpora are evicted to disk.
+    return CorpusRegistry(max_bytes=4 * 1024**3)
 
-    # Use Predibase infrastructure for indexing and retrieval
-    retriever = get_retriever(retrieval_provider="predibase", index_name=f"{corpus_name}-{chunk_size}",
-                              predibase_client=pc, model_name="llama-2-13b")
 
-    # Create the corpus of documents and pass in the necessary resources (LLM and retriever)
-    corpus = Corpus(predibase_dataset.to_dataframe(), name=corpus_name, llm_endpoint=llm_endpoint, retriever=retriever)
-    chunks = corpus.chunk(chunk_size)
-
-    with st.spinner("Indexing corpus... This may take a while"):
-        print("INDEXING")
-        corpus.index()
-    return corpus
+def build_corpus(dataset_name, connection_name):
+    corpus_name = dataset_name
+    chunk_size = 1999
+    corpus_key = f"{corpus_name}-{chunk_size}"
+    registry = get_corpus_registry()
+
+    if corpus_key not in registry:
+        # Set INFO_EXTRACT_RECORDING_PATH to record the LLM traffic, e.g. to replay it offline (provider "replay").
+        llm_endpoint = get_llm_endpoint(
+            model_provider="predibase",
+            model_name="llama-2-13b",
+            predibase_client=pc,
+            recording_path=os.environ.get("INFO_EXTRACT_RECORDING_PATH"),
+        )
+
+        # Use Predibase infrastructure for indexing and retrieval
+        retriever = get_retriever(
+            retrieval_provider="predibase", index_name=corpus_key, predibase_client=pc, model_name="llama-2-13b"
+        )
+
+        # Identifies the source dataset in the snapshot key.
+        dataset_identity = f"{connection_name}/{dataset_name}"
+
+        def builder():
+            predibase_dataset = pc.get_dataset(dataset_name=dataset_name, connection_name=connection_name)
+            print("GETTING DATASET", predibase_dataset.name)
+
+            # Create the corpus of documents and pass in the necessary resources (LLM and retriever)
+            corpus = Corpus(
+                predibase_dataset.to_dataframe(),
+                name=corpus_name,
+                llm_endpoint=llm_endpoint,
+                retriever=retriever,
+                dataset_identity=dataset_identity,
+            )
+            corpus.chunk(chunk_size)
+
+            with st.spinner("Indexing corpus... This may take a while"):
+                print("INDEXING")
+                corpus.index()
+            return corpus
+
+        # The registry warm starts from a saved snapshot of the same dataset and chunk size, if any.
+        registry.register(
+            corpus_key,
+            builder=builder,
+            version_key=corpus_version_key(dataset_identity, chunk_size),
+            llm_endpoint=llm_endpoint,
+            retriever=retriever,
+        )
+
+    # load or build the corpus now, rather than on the first query.
+    registry.get(corpus_key)
+    return corpus_key
 
 
 if not predibase_api_token:
@@ -113,7 +157,7 @@ else:
             dataset_name, connection_name = elem
             break
 
-    corpus = build_corpus(dataset_name, connection_name)
+    corpus_key = build_corpus(dataset_name, connection_name)
 
 
 with st.form(key="qa_form"):
@@ -128,7 +172,8 @@ if submit:
     print("JUST BEFORE corpus.query")
     start_t = perf_counter()
 
-    with st.spinner(text=progress_text):
+    # the corpus isn't evicted while it is queried.
+    with st.spinner(text=progress_text), get_corpus_registry().using(corpus_key) as corpus:
         rag_response = corpus.query(query)
 
     print("GOT THE ANSWER", rag_response.answer)
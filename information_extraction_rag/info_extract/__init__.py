@@ -1 +1,15 @@
-from info_extract.info_extract import Corpus
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from info_extract.info_extract import Corpus
+
+__all__ = ["Corpus"]
+
+
+def __getattr__(name):
+    # `Corpus` pulls in pandas and numpy, so it is only imported on first access.
+    if name == "Corpus":
+        from info_extract.info_extract import Corpus
+
+        return Corpus
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,115 @@
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+import pandas as pd
+
+QA_PAIR_PATTERN = re.compile(r"Question:\s*(.+?)\s*\n\s*Answer:\s*(.+?)\s*(?=\n\s*Question:|\Z)", re.DOTALL)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from in is it of on s that the to was were what which who whom "
+    "with".split()
+)
+
+
+@dataclass
+class QAPair:
+    """Dataclass to hold a question-answer pair generated from a chunk."""
+
+    document_id: int
+    chunk_id: int
+    question: str
+    answer: str
+
+
+def parse_qa_pairs(text: str) -> List[Tuple[str, str]]:
+    """Parse the output of AUTOEXTRACT_TEMPLATE into (question, answer) pairs.
+
+    Args:
+        text: LLM output with pairs formatted as "Question: <question>\\nAnswer: <answer>".
+    """
+    pairs = []
+    for question, answer in QA_PAIR_PATTERN.findall(text):
+        answer = answer.strip().replace("\n", ". ")
+        if answer and "undefined" not in answer.lower():
+            pairs.append((question.strip(), answer))
+    return pairs
+
+
+def question_tokens(text: str) -> FrozenSet[str]:
+    """Return the set of lowercased content tokens of a question."""
+    return frozenset(token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS)
+
+
+class AnswerIndex:
+    def __init__(self):
+        """Searchable index of question-answer pairs, matching questions by token overlap (Jaccard similarity)."""
+        self.pairs: List[QAPair] = []
+        self.token_sets: List[FrozenSet[str]] = []
+        # token -> positions in `pairs` of the questions containing the token.
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def add(self, pair: QAPair):
+        position = len(self.pairs)
+        tokens = question_tokens(pair.question)
+        self.pairs.append(pair)
+        self.token_sets.append(tokens)
+        for token in tokens:
+            self.postings[token].append(position)
+
+    def search(
+        self, query: str, min_score: float = 0.8, chunk_keys: Optional[Set[Tuple[int, int]]] = None
+    ) -> List[Tuple[QAPair, float]]:
+        """Return the pairs whose question is close to the query, i.e. with a similarity of at least `min_score`.
+
+        Args:
+            query: question to look up.
+            min_score: minimum Jaccard similarity between the query tokens and the question tokens.
+            chunk_keys: (optional) (document_id, chunk_id) of the chunks to restrict the search to, e.g. the chunks
+                retrieved for the query.
+
+        Returns:
+            List of tuples of a matching QAPair and its score, from the best match down.
+        """
+        tokens = question_tokens(query)
+        if not tokens:
+            return []
+
+        overlaps = defaultdict(int)
+        for token in tokens:
+            for position in self.postings.get(token, []):
+                overlaps[position] += 1
+
+        matches = []
+        for position, overlap in overlaps.items():
+            pair = self.pairs[position]
+            if chunk_keys is not None and (pair.document_id, pair.chunk_id) not in chunk_keys:
+                continue
+            score = overlap / (len(tokens) + len(self.token_sets[position]) - overlap)
+            if score >= min_score:
+                matches.append((pair, score))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
+
+    def to_df(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "document_id": [pair.document_id for pair in self.pairs],
+                "chunk_id": [pair.chunk_id for pair in self.pairs],
+                "question": [pair.question for pair in self.pairs],
+                "answer": [pair.answer for pair in self.pairs],
+            }
+        )
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> "AnswerIndex":
+        answer_index = cls()
+        for document_id, chunk_id, question, answer in zip(
+            df["document_id"].tolist(), df["chunk_id"].tolist(), df["question"].tolist(), df["answer"].tolist()
+        ):
+            answer_index.add(QAPair(document_id=document_id, chunk_id=chunk_id, question=question, answer=answer))
+        return answer_index
@@ -0,0 +1,30 @@
+from time import monotonic
+from typing import Optional
+
+
+class Deadline:
+    def __init__(self, timeout: Optional[float] = None):
+        """Tracks the time left to answer a request. A timeout of None means that there is no deadline.
+
+        Args:
+            timeout: number of seconds from now until the deadline.
+        """
+        self.timeout = timeout
+        self.start = monotonic()
+
+    def remaining(self, reserve: float = 0.0) -> Optional[float]:
+        """Return the number of seconds left, or None if there is no deadline.
+
+        Args:
+            reserve: fraction of the total timeout to keep for later stages.
+        """
+        if self.timeout is None:
+            return None
+        return max(0.0, self.start + self.timeout * (1.0 - reserve) - monotonic())
+
+    def budget(self, fraction: float) -> Optional[float]:
+        """Return the number of seconds a stage allotted `fraction` of the total timeout may use, or None if there
+        is no deadline."""
+        if self.timeout is None:
+            return None
+        return min(self.timeout * fraction, self.remaining())
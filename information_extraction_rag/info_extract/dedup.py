@@ -0,0 +1,101 @@
+import zlib
+from collections import defaultdict
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingles(text: str, shingle_size: int = 5) -> np.ndarray:
+    """Return the 32-bit hashes of the word `shingle_size`-grams of a text, lowercased."""
+    words = text.lower().split()
+    if len(words) <= shingle_size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i : i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    return np.array(sorted({zlib.crc32(gram.encode("utf-8")) for gram in grams}), dtype=np.uint64)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        """MinHash signatures estimating the Jaccard similarity of shingle sets.
+
+        Args:
+            num_perm: number of hash permutations, i.e. signature length.
+            seed: seed of the permutations. Signatures are only comparable for the same seed and `num_perm`.
+        """
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_hashes: np.ndarray) -> np.ndarray:
+        if len(shingle_hashes) == 0:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        # uint64 arithmetic wraps around on overflow, which keeps the permutations well mixed.
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(shingle_hashes, self.a) + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0)
+
+
+def lsh_params(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """Return the (bands, rows) split of a signature whose LSH collision threshold (1 / bands) ** (1 / rows) is the
+    closest to `threshold`."""
+    candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(candidates, key=lambda params: abs((1 / params[0]) ** (1 / params[1]) - threshold))
+
+
+def find_near_duplicates(
+    keys: Sequence[Hashable],
+    texts: Sequence[str],
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+) -> Dict[Hashable, List[Hashable]]:
+    """Cluster near-duplicate texts with MinHash and LSH.
+
+    Texts whose signatures collide in at least one LSH band and whose estimated Jaccard similarity is at least
+    `threshold` end up in the same cluster. The first key of each cluster (in input order) is its canonical key.
+
+    Args:
+        keys: identifier of every text, e.g. (document_id, chunk_id).
+        texts: texts to deduplicate.
+        threshold: minimum estimated Jaccard similarity of shingle sets for two texts to be duplicates.
+        num_perm: MinHash signature length.
+        shingle_size: number of words per shingle.
+
+    Returns:
+        Map from canonical key to the keys of its cluster (the canonical key first), for every text.
+    """
+    hasher = MinHasher(num_perm=num_perm)
+    signatures = [hasher.signature(shingles(text, shingle_size=shingle_size)) for text in texts]
+    bands, rows = lsh_params(num_perm, threshold)
+
+    # union-find over text positions; the root of a cluster is its smallest position.
+    parents = list(range(len(texts)))
+
+    def find(position: int) -> int:
+        while parents[position] != position:
+            parents[position] = parents[parents[position]]
+            position = parents[position]
+        return position
+
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for position, signature in enumerate(signatures):
+            buckets[signature[band * rows : (band + 1) * rows].tobytes()].append(position)
+        for positions in buckets.values():
+            first = positions[0]
+            for position in positions[1:]:
+                root, other_root = find(first), find(position)
+                if root == other_root:
+                    continue
+                if np.mean(signatures[first] == signatures[position]) >= threshold:
+                    parents[max(root, other_root)] = min(root, other_root)
+
+    clusters = defaultdict(list)
+    for position, key in enumerate(keys):
+        clusters[keys[find(position)]].append(key)
+    return dict(clusters)
@@ -1,4 +1,15 @@
-from predibase import PredibaseClient
+import threading
+from collections import Counter
+from time import perf_counter, sleep
+from typing import Any, Dict, Optional, Tuple, TYPE_CHECKING
+
+from info_extract.scheduler import current_request_class, RequestScheduler
+
+if TYPE_CHECKING:
+    from predibase import PredibaseClient
+
+
+DEFAULT_MAX_NEW_TOKENS = 512
 
 
 class LLMEndpoint:
@@ -9,22 +20,147 @@ class LLMEndpoint:
         pass
 
 
+class CallCounter:
+    def __init__(self):
+        """Thread-safe count of LLM calls per pipeline stage (e.g. "extract", "escalate", "synthesize")."""
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, stage: str, count: int = 1):
+        with self._lock:
+            self.counts[stage] += count
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+
+class CountingLLMEndpoint(LLMEndpoint):
+    def __init__(self, llm_endpoint: LLMEndpoint, stage: str, counter: CallCounter):
+        """Wraps an endpoint and counts its calls under `stage` in `counter`."""
+        super().__init__(llm_endpoint=llm_endpoint, stage=stage, counter=counter)
+        self.llm_endpoint = llm_endpoint
+        self.stage = stage
+        self.counter = counter
+
+    def hit(self, input_text):
+        self.counter.increment(self.stage)
+        return self.llm_endpoint.hit(input_text)
+
+
+class CachingLLMEndpoint(LLMEndpoint):
+    def __init__(self, llm_endpoint: LLMEndpoint, replay_latency: bool = False):
+        """Wraps an endpoint and caches its responses by prompt, along with the latency of the calls.
+
+        Args:
+            llm_endpoint: endpoint to cache.
+            replay_latency: sleep for the recorded latency on cache hits, so that timings measured through the cache
+                stay representative of the wrapped endpoint.
+        """
+        super().__init__(llm_endpoint=llm_endpoint, replay_latency=replay_latency)
+        self.llm_endpoint = llm_endpoint
+        self.replay_latency = replay_latency
+        # prompt -> (response, seconds).
+        self.cache: Dict[str, Tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self, input_text):
+        with self._lock:
+            cached = self.cache.get(input_text)
+            if cached is not None:
+                self.hits += 1
+        if cached is not None:
+            response, seconds = cached
+            if self.replay_latency:
+                sleep(seconds)
+            return response
+
+        start_t = perf_counter()
+        response = self.llm_endpoint.hit(input_text)
+        seconds = perf_counter() - start_t
+        with self._lock:
+            self.cache[input_text] = (response, seconds)
+            self.misses += 1
+        return response
+
+
+class ScheduledLLMEndpoint(LLMEndpoint):
+    def __init__(self, llm_endpoint: LLMEndpoint, scheduler: RequestScheduler):
+        """Wraps an endpoint so that its calls are admitted by a (shared) RequestScheduler.
+
+        Each call is queued under the request class of the calling context, see `info_extract.scheduler.request_class`.
+        """
+        super().__init__(llm_endpoint=llm_endpoint, scheduler=scheduler)
+        self.llm_endpoint = llm_endpoint
+        self.scheduler = scheduler
+
+    def hit(self, input_text):
+        with self.scheduler.slot(current_request_class()):
+            return self.llm_endpoint.hit(input_text)
+
+
 class PredibaseLLMEndpoint(LLMEndpoint):
-    def __init__(self, predibase_client: PredibaseClient, model_name: str = "llama-2-13b"):
-        super().__init__(predibase_client=predibase_client, model_name=model_name)
+    def __init__(
+        self,
+        predibase_client: "PredibaseClient",
+        model_name: str = "llama-2-13b",
+        max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS,
+    ):
+        super().__init__(predibase_client=predibase_client, model_name=model_name, max_new_tokens=max_new_tokens)
         self.predibase_client = predibase_client
         self.model_name = model_name
+        self.max_new_tokens = max_new_tokens
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        """Generation options sent with every prompt."""
+        return {"max_new_tokens": self.max_new_tokens, "temperature": 0.0}
 
     def hit(self, input_text):
         input_text = input_text.replace("'", "")
-        options = {"max_new_tokens": 512, "temperature": 0.0}
-        result = self.predibase_client.prompt(input_text, self.model_name, options=options)
+        result = self.predibase_client.prompt(input_text, self.model_name, options=self.options)
         resp = result.response[0].strip()
         return resp
 
 
-def get_llm_endpoint(model_provider, **kwargs):
+def unwrap_attribute(llm_endpoint: LLMEndpoint, name: str, default: Any = None) -> Any:
+    """Return an attribute of an endpoint, looking through wrapping endpoints (counting, caching, ...)."""
+    while not hasattr(llm_endpoint, name) and hasattr(llm_endpoint, "llm_endpoint"):
+        llm_endpoint = llm_endpoint.llm_endpoint
+    return getattr(llm_endpoint, name, default)
+
+
+def max_new_tokens(llm_endpoint: LLMEndpoint) -> int:
+    """Return the response token limit of an endpoint.
+
+    Defaults to DEFAULT_MAX_NEW_TOKENS for endpoints that don't declare one.
+    """
+    return unwrap_attribute(llm_endpoint, "max_new_tokens", DEFAULT_MAX_NEW_TOKENS)
+
+
+def get_llm_endpoint(
+    model_provider, scheduler: Optional[RequestScheduler] = None, recording_path: Optional[str] = None, **kwargs
+):
     if model_provider == "predibase":
-        return PredibaseLLMEndpoint(**kwargs)
+        llm_endpoint = PredibaseLLMEndpoint(**kwargs)
+    elif model_provider == "replay":
+        from info_extract.recording import ReplayLLMEndpoint
+
+        llm_endpoint = ReplayLLMEndpoint(**kwargs)
     else:
         raise ValueError("Invalid LLM provider")
+
+    if recording_path is not None:
+        from info_extract.recording import RecordingLLMEndpoint
+
+        # recorded inside the scheduler, so that the recorded latencies don't include queueing.
+        llm_endpoint = RecordingLLMEndpoint(llm_endpoint, recording_path)
+    if scheduler is not None:
+        llm_endpoint = ScheduledLLMEndpoint(llm_endpoint, scheduler)
+    return llm_endpoint
@@ -1,20 +1,61 @@
 import concurrent.futures
+import hashlib
+import json
+import os
+import re
 import textwrap
-from dataclasses import dataclass
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from itertools import chain, islice, repeat
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import pandas as pd
 
-from info_extract.endpoints import LLMEndpoint
+from info_extract.answer_index import AnswerIndex, parse_qa_pairs, QAPair
+from info_extract.deadline import Deadline
+from info_extract.dedup import find_near_duplicates
+from info_extract.endpoints import CallCounter, CountingLLMEndpoint, LLMEndpoint, max_new_tokens
 from info_extract.retrieval import Retriever
+from info_extract.scheduler import BATCH, INTERACTIVE, request_class, submit_in_context
+from info_extract.storage import chunk_spans, DocumentTextStore, TextSpan
 from info_extract.templates import (
+    AUTOEXTRACT_TEMPLATE,
     EXTRACT_TEMPLATE,
     FINAL_SYNTHESIZE_TEMPLATE,
     MULTIVERIFY_TEMPLATE,
     SYNTHESIZE_TEMPLATE,
 )
 
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_DOCUMENTS_FILE = "documents.arrow"
+SNAPSHOT_CHUNKS_FILE = "chunks.arrow"
+SNAPSHOT_METADATA_FILE = "metadata.json"
+SNAPSHOT_ANSWER_INDEX_FILE = "answer_index.arrow"
+SNAPSHOT_DUPLICATES_FILE = "duplicates.arrow"
+
+CHUNK_STORAGE_MODES = ("copy", "offsets")
+
+# threads of the pool created for the LLM calls of a request when no executor is passed.
+MAX_LEAF_THREADS = 100
+
+# split of a query timeout: retrieval may use up to RETRIEVAL_BUDGET_FRACTION of it, and extraction stops early enough
+# to leave SYNTHESIS_BUDGET_FRACTION of it for synthesis.
+RETRIEVAL_BUDGET_FRACTION = 0.2
+SYNTHESIS_BUDGET_FRACTION = 0.25
+
+# queries are packed into prompts of at most (response token limit / EXPECTED_ANSWER_TOKENS) queries, so that their
+# answers fit in the response. Queries left unanswered (e.g. by a truncated response) are retried one at a time,
+# MAX_ANSWER_RETRIES times.
+EXPECTED_ANSWER_TOKENS = 48
+MAX_ANSWER_RETRIES = 1
+# a response is considered cut off at the response token limit when its length, at CHARS_PER_TOKEN characters per
+# token, reaches TRUNCATION_RATIO of the limit. The ratio is kept low since tokens are often shorter (e.g. numbers).
+CHARS_PER_TOKEN = 4
+TRUNCATION_RATIO = 0.75
+ANSWER_LABEL_PATTERN = re.compile(r"^A(\d+)\s*:\s*(.*)$")
+QUESTION_LABEL_PATTERN = re.compile(r"^Q\d+\s*:")
+
 
 @dataclass
 class ChunkExtractionResult:
@@ -22,7 +63,7 @@ class ChunkExtractionResult:
 
     document_id: int
     chunk_id: int
-    chunk_text: str
+    chunk_text: Union[str, TextSpan]
     query: str
     answer: str
     is_correct: bool
@@ -34,6 +75,8 @@ class RAGResult:
 
     answer: str
     chunk_answers: List[ChunkExtractionResult]
+    # whether the answer was produced from a subset of the extractions because the deadline was reached.
+    is_partial: bool = False
 
 
 def chunk_text(text_input: str, overlap: bool = False, chunk_size: int = 2048):
@@ -56,6 +99,116 @@ def chunk_text(text_input: str, overlap: bool = False, chunk_size: int = 2048):
     return chunks
 
 
+def corpus_version_key(dataset_identity: str, chunk_size: int, overlap: bool = False) -> str:
+    """Build the key identifying a corpus snapshot.
+
+    Args:
+        dataset_identity: string identifying the source dataset (e.g. "<connection name>/<dataset name>").
+        chunk_size: size of a chunk as number of characters.
+        overlap: whether the corpus was chunked with overlapping chunks.
+    """
+    identity = f"{dataset_identity}:{chunk_size}" + (":overlap" if overlap else "")
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+
+
+def write_snapshot_table(df: pd.DataFrame, path: str):
+    """Write a dataframe as an uncompressed Arrow IPC (Feather) file, to be memory mapped by `read_snapshot_table`.
+
+    The file is replaced atomically, so that tables mapped from a previous snapshot stay valid.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), temp_path, compression="uncompressed")
+    os.replace(temp_path, path)
+
+
+def read_snapshot_table(path: str) -> pd.DataFrame:
+    """Read a table written by `write_snapshot_table` through a memory map.
+
+    Columns stay Arrow-backed (`pd.ArrowDtype`), so their data is paged in from the file on access instead of being
+    copied to the heap.
+    """
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+@contextmanager
+def leaf_executor(executor: Optional[concurrent.futures.Executor] = None):
+    """Yield `executor`, or a new thread pool of MAX_LEAF_THREADS threads when it is None. A new pool is shut down
+    without waiting, so that leaving the block doesn't wait for the futures that were given up on.
+
+    A shared executor must only run leaf tasks (retrieval, extraction and synthesis calls), never the calls waiting on
+    them, or it can fill up with waiting calls and deadlock.
+    """
+    if executor is not None:
+        yield executor
+        return
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_LEAF_THREADS)
+    try:
+        yield executor
+    finally:
+        executor.shutdown(wait=False)
+
+
+def is_undefined(answer: str) -> bool:
+    """Whether an extracted answer carries no information (UNDEFINED, or empty)."""
+    return "undefined" in answer.lower() or len(answer.strip()) == 0
+
+
+def normalize_answer(answer: str) -> str:
+    """Lowercase an answer and strip its punctuation and extra whitespace.
+
+    Equivalent answers then compare equal.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", answer.lower()).split())
+
+
+def is_truncated(text: str, max_new_tokens: Optional[int]) -> bool:
+    """Whether a response is long enough to have been cut off at the response token limit `max_new_tokens`."""
+    return max_new_tokens is not None and len(text) / CHARS_PER_TOKEN >= TRUNCATION_RATIO * max_new_tokens
+
+
+def parse_answers(text: str, num_questions: int, max_new_tokens: Optional[int] = None) -> List[Optional[str]]:
+    """Parse the response to EXTRACT_TEMPLATE into one answer per question, or None for the missing answers.
+
+    Answers are matched to questions by their "A<i>:" label. The first answer is unlabeled since the prompt ends with
+    "A1:". When answers are missing at the end of a response that reached the response token limit, the response was
+    cut off, so its last answer is likely incomplete and is considered missing as well.
+
+    Args:
+        text: LLM response.
+        num_questions: number of questions in the prompt.
+        max_new_tokens: (optional) response token limit of the endpoint, used to detect cut off responses.
+    """
+    text = text.strip()
+    answers: List[Optional[str]] = [None] * num_questions
+    if not text:
+        return answers
+    if ANSWER_LABEL_PATTERN.match(text.split("\n", 1)[0]) is None:
+        text = "A1: " + text
+
+    position = 0
+    for line in text.split("\n"):
+        line = line.strip()
+        match = ANSWER_LABEL_PATTERN.match(line)
+        if match is not None and 1 <= int(match.group(1)) <= num_questions:
+            position = int(match.group(1)) - 1
+            answers[position] = match.group(2).strip()
+        elif line and answers[position] is not None and QUESTION_LABEL_PATTERN.match(line) is None:
+            # continuation of a multi-line answer.
+            answers[position] = f"{answers[position]}. {line}" if answers[position] else line
+
+    answered = [i for i, answer in enumerate(answers) if answer is not None]
+    if len(answered) > 0 and answered[-1] < num_questions - 1 and is_truncated(text, max_new_tokens):
+        answers[answered[-1]] = None
+    return answers
+
+
 def trimmer(seq: List[Any], size: int, filler: Any = "UNDEFINED"):
     """Pad list with filler up to a certain size.
 
@@ -68,12 +221,35 @@ def trimmer(seq: List[Any], size: int, filler: Any = "UNDEFINED"):
 
 
 class Chunk:
-    def __init__(self, document_id: int, chunk_id: int, chunk_text: str, llm_endpoint: LLMEndpoint):
-        """Class to store chunk attributes."""
+    def __init__(
+        self,
+        document_id: int,
+        chunk_id: int,
+        chunk_text: Union[str, TextSpan],
+        llm_endpoint: LLMEndpoint,
+        escalation_endpoint: Optional[LLMEndpoint] = None,
+        verification_endpoint: Optional[LLMEndpoint] = None,
+        expected_answer_tokens: int = EXPECTED_ANSWER_TOKENS,
+    ):
+        """Class to store chunk attributes.
+
+        Args:
+            document_id: document ID.
+            chunk_id: chunk ID within the document.
+            chunk_text: text of the chunk, either a string or a TextSpan into the document text.
+            llm_endpoint: LLM endpoint used for extraction.
+            escalation_endpoint: (optional) larger LLM endpoint that queries are retried on when `llm_endpoint`
+                answers UNDEFINED or its answer fails to parse.
+            verification_endpoint: LLM endpoint used for verification. Defaults to `llm_endpoint`.
+            expected_answer_tokens: expected number of response tokens per answer, used to pack queries into prompts.
+        """
         self.document_id = document_id
         self.chunk_id = chunk_id
         self.chunk_text = chunk_text
         self.llm_endpoint = llm_endpoint
+        self.escalation_endpoint = escalation_endpoint
+        self.verification_endpoint = verification_endpoint or llm_endpoint
+        self.expected_answer_tokens = expected_answer_tokens
 
     def extract(self, queries: List[str], do_llm_verify: bool = False) -> List[ChunkExtractionResult]:
         """Extract information from a chunk based on a number of queries.
@@ -102,26 +278,121 @@ class Chunk:
             chunk_extraction_result_list.append(chunk_extraction_result)
         return chunk_extraction_result_list
 
+    def auto_extract(self) -> List[QAPair]:
+        """Generate factoid question-answer pairs from the chunk, without any query.
+
+        Returns:
+            List of QAPair generated from the chunk.
+        """
+        prompt = AUTOEXTRACT_TEMPLATE.format(self.chunk_text)
+        text = self.llm_endpoint.hit(prompt)
+        return [
+            QAPair(document_id=self.document_id, chunk_id=self.chunk_id, question=question, answer=answer)
+            for question, answer in parse_qa_pairs(text)
+        ]
+
     def get_answer_given_chunk(self, queries: List[str]) -> List[str]:
         """Extract information from a chunk based on a number of queries.
 
+        With an escalation endpoint, the queries answered UNDEFINED (or missing from the parsed answer) are retried
+        on the escalation endpoint.
+
         Args:
             queries: list of queries to use for extraction.
         Returns:
             List of answers (strings). Each element corresponds to a query.
         """
+        if self.escalation_endpoint is None:
+            return self.answer_queries(self.llm_endpoint, queries)
+
+        try:
+            answers_list = self.answer_queries(self.llm_endpoint, queries)
+        except Exception as exc:
+            print("ERROR:", exc)
+            answers_list = ["UNDEFINED"] * len(queries)
+
+        escalated_indices = [i for i, answer in enumerate(answers_list) if is_undefined(answer)]
+        if len(escalated_indices) > 0:
+            escalated_queries = [queries[i] for i in escalated_indices]
+            escalated_answers = self.answer_queries(self.escalation_endpoint, escalated_queries)
+            for i, answer in zip(escalated_indices, escalated_answers):
+                answers_list[i] = answer
+
+        return answers_list
+
+    def pack_queries(self, llm_endpoint: LLMEndpoint, num_queries: int) -> List[List[int]]:
+        """Split query positions into contiguous groups of similar size whose answers fit in one response of the
+        endpoint, assuming `expected_answer_tokens` per answer."""
+        queries_per_prompt = max(1, max_new_tokens(llm_endpoint) // self.expected_answer_tokens)
+        num_groups = -(-num_queries // queries_per_prompt)
+        groups, start = [], 0
+        for group in range(num_groups):
+            size = num_queries // num_groups + (1 if group < num_queries % num_groups else 0)
+            groups.append(list(range(start, start + size)))
+            start += size
+        return groups
+
+    def answer_queries(self, llm_endpoint: LLMEndpoint, queries: List[str]) -> List[str]:
+        """Answer queries from the chunk in concurrent prompts whose answers fit the endpoint's token limit.
+
+        Queries whose answer is missing from a response are prompted again, one query per prompt.
+
+        Args:
+            llm_endpoint: LLM endpoint to prompt.
+            queries: list of queries to use for extraction.
+        Returns:
+            List of answers (strings). Each element corresponds to a query, UNDEFINED if it was never answered.
+        """
+        answers: List[Optional[str]] = [None] * len(queries)
+        pending = list(range(len(queries)))
+        for attempt in range(MAX_ANSWER_RETRIES + 1):
+            if len(pending) == 0:
+                break
+            if attempt > 0:
+                print(
+                    f"Retrying {len(pending)} unanswered queries for chunk {self.chunk_id} from document "
+                    f"{self.document_id}."
+                )
+            if attempt == 0:
+                groups = self.pack_queries(llm_endpoint, len(queries))
+            else:
+                groups = [[i] for i in pending]
+            group_queries = [[queries[i] for i in group] for group in groups]
+            if len(groups) == 1:
+                group_answers = [self.prompt_for_answers(llm_endpoint, group_queries[0])]
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                    futures = [
+                        submit_in_context(executor, self.prompt_for_answers, llm_endpoint, group)
+                        for group in group_queries
+                    ]
+                    group_answers = [future.result() for future in futures]
+
+            for group, answers_list in zip(groups, group_answers):
+                for i, answer in zip(group, answers_list):
+                    answers[i] = answer
+            pending = [i for i in pending if answers[i] is None]
+
+        return ["UNDEFINED" if answer is None else answer for answer in answers]
+
+    def prompt_for_answers(self, llm_endpoint: LLMEndpoint, queries: List[str]) -> List[Optional[str]]:
+        """Prompt an LLM endpoint with the chunk and the queries, and parse one answer per query.
+
+        Args:
+            llm_endpoint: LLM endpoint to prompt.
+            queries: list of queries to use for extraction.
+        Returns:
+            List of answers (strings), with None for the answers that couldn't be parsed.
+        """
         # create the formatted string containing all the questions.
         formatted_questions_list = [f"Q{i + 1}: {query}".strip() for i, query in enumerate(queries)]
         formatted_questions = "\n".join(formatted_questions_list)
         num_questions = len(formatted_questions_list)
 
         prompt = EXTRACT_TEMPLATE.format(self.chunk_text, formatted_questions)
-        text = self.llm_endpoint.hit(prompt)
-        text = [item.strip() for item in text.split("\n") if item.strip().startswith("A")]
-        text = "A1: " + "\n".join(text)
-        answers_list = text.split("\nA")
-        answers_list = [ans[ans.find(":") + 1 :].strip().replace("\n", ". ") for ans in answers_list]
-        num_answers = len(answers_list)
+        text = llm_endpoint.hit(prompt)
+        answers_list = parse_answers(text, num_questions, max_new_tokens=max_new_tokens(llm_endpoint))
+        num_answers = sum(answer is not None for answer in answers_list)
 
         if num_answers < num_questions:
             # todo replace with logging.warn
@@ -129,7 +400,6 @@ class Chunk:
                 f"In get_answer_given_chunk. num_answers: {num_answers} and num_questions: {num_questions} "
                 f"for chunk {self.chunk_id} from document {self.document_id}."
             )
-        answers_list = trimmer(answers_list, num_questions)
 
         return answers_list
 
@@ -159,7 +429,7 @@ class Chunk:
         formatted_question_answers = "\n".join(formatted_question_answers_list)
 
         prompt = MULTIVERIFY_TEMPLATE.format(self.chunk_text, formatted_question_answers)
-        text = self.llm_endpoint.hit(prompt)
+        text = self.verification_endpoint.hit(prompt)
         text = "A1 ASSESSMENT: " + text
         verifications_list = text.strip().split("\n")
         verifications_list = [ans[ans.find(":") + 1 :].strip() for ans in verifications_list]
@@ -182,10 +452,27 @@ class Chunk:
 
 
 class ExtractionResult:
-    def __init__(self, extraction_result_df: pd.DataFrame, chunk_list):
+    def __init__(self, extraction_result_df: pd.DataFrame, chunks: "ChunkList"):
+        """Per-document extraction results, with attribution back to the chunks of `chunks`.
+
+        Args:
+            extraction_result_df: dataframe with the following columns (document_id, query, answer, chunk_ids).
+            chunks: ChunkList the extractions were made from. Chunks are resolved from it lazily.
+        """
         self.extraction_result_df = extraction_result_df
-        self.extractions = self.extraction_result_df.drop(columns=["chunk_ids"])
-        self.chunk_list = chunk_list
+        self.extractions = self.extraction_result_df.drop(columns=["chunk_ids"], errors="ignore")
+        self.chunks = chunks
+
+        # (document_id, query) -> chunk_ids, so that attribution lookups don't scan the results.
+        self.chunk_ids_by_result = {}
+        if len(extraction_result_df) > 0:
+            self.chunk_ids_by_result = dict(
+                zip(
+                    zip(extraction_result_df["document_id"].tolist(), extraction_result_df["query"].tolist()),
+                    extraction_result_df["chunk_ids"].tolist(),
+                )
+            )
+        self.document_ids = {document_id for document_id, _ in self.chunk_ids_by_result}
 
     def get_attribution(self, document_id: int, query: str) -> List[Chunk]:
         """Return a list of chunks which the final generated answer came from.
@@ -194,55 +481,195 @@ class ExtractionResult:
             document_id: document ID.
             query: query to get the attributions for.
         """
-        if document_id not in self.extraction_result_df["document_id"].values:
+        if document_id not in self.document_ids:
             raise ValueError(
                 f"document_id `{document_id}` is not part of the relevant chunks. Please select a "
                 f"relevant document_id from the `extractions` table."
             )
+        if (document_id, query) not in self.chunk_ids_by_result:
+            raise ValueError(
+                f"query `{query}` has no extraction for document_id `{document_id}`. Please select a relevant query "
+                f"from the `extractions` table."
+            )
 
-        chunk_ids = self.extraction_result_df[
-            (self.extraction_result_df["query"] == query) & (self.extraction_result_df["document_id"] == document_id)
-        ]["chunk_ids"].item()
-
-        relevant_chunks = []
-        for chunk in self.chunk_list:
-            if chunk.document_id == document_id and chunk.chunk_id in chunk_ids:
-                relevant_chunks.append(chunk)
-        return relevant_chunks
+        chunk_ids = self.chunk_ids_by_result[(document_id, query)]
+        return [self.chunks.get_chunk(document_id, chunk_id) for chunk_id in chunk_ids]
 
 
 class ChunkList:
-    def __init__(self, chunks_df: pd.DataFrame, llm_endpoint: LLMEndpoint, retriever: Retriever):
-        """Initialization method for ChunkList, an interface for working with chunks."""
+    def __init__(
+        self,
+        chunks_df: pd.DataFrame,
+        llm_endpoint: LLMEndpoint,
+        retriever: Retriever,
+        text_store: Optional[DocumentTextStore] = None,
+        extraction_endpoint: Optional[LLMEndpoint] = None,
+        synthesis_endpoint: Optional[LLMEndpoint] = None,
+        escalation_endpoint: Optional[LLMEndpoint] = None,
+        duplicates: Optional[Dict[Tuple[int, int], List[Tuple[int, int]]]] = None,
+    ):
+        """Initialization method for ChunkList, an interface for working with chunks.
+
+        Args:
+            chunks_df: dataframe with the schema (chunk_id, chunk_text, document_id), or (chunk_id, document_id, start,
+                end) when the chunks are stored as offsets into `text_store`.
+            llm_endpoint: default LLM endpoint, used for every stage without a dedicated endpoint.
+            retriever: retriever used for indexing and retrieval.
+            text_store: document text the chunk offsets refer to. Required when `chunks_df` has no `chunk_text`.
+            extraction_endpoint: LLM endpoint used for per-chunk extraction and verification.
+            synthesis_endpoint: LLM endpoint used to synthesize answers from the extractions.
+            escalation_endpoint: LLM endpoint that extractions answered UNDEFINED by `extraction_endpoint` are
+                retried on. Pass a small model as `extraction_endpoint` and a larger one here for a model cascade.
+            duplicates: map from the (document_id, chunk_id) of a chunk in `chunks_df` to the (document_id, chunk_id)
+                of every chunk with the same text it stands for, see `deduplicate`.
+        """
         self.df = chunks_df
+        self.text_store = text_store
+        self.duplicates = duplicates or {}
 
         # Ludwig retriever.
         self.semantic_retrieval = None
         self.llm_endpoint = llm_endpoint
         self.retriever = retriever
 
+        # every stage goes through a counting wrapper, see `call_counts`.
+        self.call_counter = CallCounter()
+        extraction_endpoint = extraction_endpoint or llm_endpoint
+        self.extraction_endpoint = CountingLLMEndpoint(extraction_endpoint, "extract", self.call_counter)
+        self.verification_endpoint = CountingLLMEndpoint(extraction_endpoint, "verify", self.call_counter)
+        synthesis_endpoint = synthesis_endpoint or llm_endpoint
+        self.synthesis_endpoint = CountingLLMEndpoint(synthesis_endpoint, "synthesize", self.call_counter)
+        self.escalation_endpoint = None
+        if escalation_endpoint is not None:
+            self.escalation_endpoint = CountingLLMEndpoint(escalation_endpoint, "escalate", self.call_counter)
+        # (document_id, chunk_id) -> row position in `df`. Built on first lookup.
+        self._chunk_positions = None
+        # question-answer pairs generated offline from the chunks. See `build_answer_index`.
+        self.answer_index: Optional[AnswerIndex] = None
+
+    def make_chunk(self, row: pd.Series) -> Chunk:
+        """Create a Chunk from a row of a chunk dataframe.
+
+        Offset rows reference the document text without copying.
+        """
+        if "chunk_text" in row.index:
+            text = row["chunk_text"]
+        else:
+            text = self.text_store.span(row["document_id"], row["start"], row["end"])
+        return Chunk(
+            document_id=row["document_id"],
+            chunk_id=row["chunk_id"],
+            chunk_text=text,
+            llm_endpoint=self.extraction_endpoint,
+            escalation_endpoint=self.escalation_endpoint,
+            verification_endpoint=self.verification_endpoint,
+        )
+
+    def call_counts(self) -> Dict[str, int]:
+        """Return the number of LLM calls made so far per stage (extract, escalate, verify, synthesize)."""
+        return self.call_counter.snapshot()
+
+    def get_chunk(self, document_id: int, chunk_id: int) -> Chunk:
+        """Return the chunk identified by (document_id, chunk_id).
+
+        Args:
+            document_id: document ID.
+            chunk_id: chunk ID within the document.
+        """
+        if self._chunk_positions is None:
+            keys = zip(self.df["document_id"].tolist(), self.df["chunk_id"].tolist())
+            # duplicates resolve to the row of their canonical chunk.
+            self._chunk_positions = {
+                source: position for position, key in enumerate(keys) for source in self.sources(*key)
+            }
+
+        chunk = self.make_chunk(self.df.iloc[self._chunk_positions[(document_id, chunk_id)]])
+        chunk.document_id, chunk.chunk_id = document_id, chunk_id
+        return chunk
+
+    def sources(self, document_id: int, chunk_id: int) -> List[Tuple[int, int]]:
+        """Return the (document_id, chunk_id) of every chunk the given chunk stands for, itself included."""
+        return self.duplicates.get((document_id, chunk_id), [(document_id, chunk_id)])
+
+    def deduplicate(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        collapse_near_duplicates: bool = False,
+    ):
+        """Deduplicate the chunks, using MinHash and LSH over word shingles to find clusters of near-duplicates.
+
+        By default, only chunks with the exact same text share their answers: all but the first are dropped, are
+        neither indexed nor sent to the LLM, remain resolvable through `get_chunk` and `sources`, and are attributed
+        the per-document extractions of the first. The other members of a cluster may differ in the very values
+        extracted (e.g. the figures of a templated filing), so they are kept, indexed and extracted from separately.
+
+        With `collapse_near_duplicates`, every cluster is collapsed into its first chunk instead, which is the only
+        one indexed and sent to the LLM, and whose extractions are attributed to the whole cluster. This shrinks the
+        index and the LLM fan-out the most, but a member that differs from the first chunk is attributed the values
+        of the first chunk and can't be retrieved by its own values.
+
+        Args:
+            threshold: minimum estimated Jaccard similarity of shingle sets for two chunks to be duplicates.
+            num_perm: MinHash signature length.
+            shingle_size: number of words per shingle.
+            collapse_near_duplicates: keep one chunk per cluster of near-duplicates, rather than per distinct text.
+        """
+        keys = list(zip(self.df["document_id"].tolist(), self.df["chunk_id"].tolist()))
+        texts = [str(chunk.chunk_text) for chunk in self.chunk_list()]
+        clusters = find_near_duplicates(keys, texts, threshold=threshold, num_perm=num_perm, shingle_size=shingle_size)
+
+        if collapse_near_duplicates:
+            duplicates = clusters
+        else:
+            text_hashes = {key: hashlib.sha256(text.encode("utf-8")).digest() for key, text in zip(keys, texts)}
+            duplicates = {}
+            for sources in clusters.values():
+                # first chunk of every distinct text in the cluster -> chunks with that text.
+                exact_duplicates = {}
+                for key in sources:
+                    exact_duplicates.setdefault(text_hashes[key], []).append(key)
+                for exact_sources in exact_duplicates.values():
+                    duplicates[exact_sources[0]] = exact_sources
+
+        num_chunks = len(self.df)
+        self.df = self.df[[key in duplicates for key in keys]]
+        self.duplicates = {key: sources for key, sources in duplicates.items() if len(sources) > 1}
+        self._chunk_positions = None
+        print(
+            f"Deduplicated {num_chunks} chunks into {len(self.df)} chunks, out of {len(clusters)} clusters of "
+            "near-duplicates."
+        )
+
     def chunk_list(self, df: Optional[pd.DataFrame] = None) -> List[Chunk]:
         """Return a list of Chunks."""
         if df is None:
             df = self.df
 
         for _, row in df.iterrows():
-            yield Chunk(
-                document_id=row["document_id"],
-                chunk_id=row["chunk_id"],
-                chunk_text=row["chunk_text"],
-                llm_endpoint=self.llm_endpoint,
-            )
+            yield self.make_chunk(row)
+
+    def text_df(self, df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """Return a chunk dataframe (all the chunks by default) with a materialised `chunk_text` column, e.g. for
+        indexing."""
+        if df is None:
+            df = self.df
+        if "chunk_text" in df.columns:
+            return df
+        chunk_texts = [str(chunk.chunk_text) for chunk in self.chunk_list(df=df)]
+        return df.assign(chunk_text=chunk_texts)
 
-    def extract(self, queries: List[str]):
+    def extract(self, queries: List[str], executor: Optional[concurrent.futures.Executor] = None):
         """Extract information from the chunks based on the queries.
 
         Args:
             queries: list of queries.
+            executor: (optional) executor running the extraction calls, see `leaf_executor`.
         """
         extraction_result_list = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=100) as executor:
-            futures = [executor.submit(chunk.extract, queries) for chunk in self.chunk_list()]
+        with leaf_executor(executor) as executor:
+            futures = [submit_in_context(executor, chunk.extract, queries) for chunk in self.chunk_list()]
             for future in concurrent.futures.as_completed(futures):
                 try:
                     extraction_result_list.extend(future.result())
@@ -265,7 +692,7 @@ class ChunkList:
 
         formatted_answers = "\n".join(valid_answers)[:5000]
         prompt = SYNTHESIZE_TEMPLATE.format(formatted_answers, query)
-        text = self.llm_endpoint.hit(prompt)
+        text = self.synthesis_endpoint.hit(prompt)
 
         return text
 
@@ -286,10 +713,10 @@ class ChunkList:
             filtered_df = extracted_df[extracted_df["document_id"] == document_id]
             query_list = list(set(filtered_df["query"].tolist()))
             for query in query_list:
-                filtered_df = filtered_df[filtered_df["query"] == query]
+                query_df = filtered_df[filtered_df["query"] == query]
                 chunk_tuple_list = [
                     (chunk_id, answer)
-                    for (chunk_id, answer) in zip(filtered_df["chunk_id"].tolist(), filtered_df["answer"].tolist())
+                    for (chunk_id, answer) in zip(query_df["chunk_id"].tolist(), query_df["answer"].tolist())
                     if "undefined" not in answer.lower()
                 ]
                 chunk_id_list = [chunk_id for (chunk_id, _) in chunk_tuple_list]
@@ -305,26 +732,35 @@ class ChunkList:
                     }
                     extraction_result_list.append(entry)
 
-        return ExtractionResult(
-            extraction_result_df=pd.DataFrame(extraction_result_list), chunk_list=list(self.chunk_list())
-        )
+        return ExtractionResult(extraction_result_df=pd.DataFrame(extraction_result_list), chunks=self)
 
-    def document_extract(self, queries: List[str]) -> ExtractionResult:
+    def document_extract(
+        self, queries: List[str], executor: Optional[concurrent.futures.Executor] = None
+    ) -> ExtractionResult:
         """Extracts per-document information based on queries.
 
         Args:
             queries: list of queries to use to extract information.
+            executor: (optional) executor running the extraction calls, see `leaf_executor`.
 
         Returns:
             Pandas dataframe with the following columns (document_id, query, answer, chunk_ids)
         """
-        extraction_result_list: List[ChunkExtractionResult] = self.extract(queries)
+        extraction_result_list: List[ChunkExtractionResult] = self.extract(queries, executor=executor)
+        if len(self.duplicates) > 0:
+            # attribute the extractions of deduplicated chunks to each of their exact duplicates.
+            extraction_result_list = [
+                replace(chunk, document_id=document_id, chunk_id=chunk_id)
+                for chunk in extraction_result_list
+                for document_id, chunk_id in self.sources(chunk.document_id, chunk.chunk_id)
+            ]
         self.most_recent_extracted_df: pd.DataFrame = pd.DataFrame(
             [
                 {
                     "chunk_id": chunk.chunk_id,
                     "document_id": chunk.document_id,
-                    "chunk_text": chunk.chunk_text,
+                    # materialized, so that the frame holds no references into the document buffers.
+                    "chunk_text": str(chunk.chunk_text),
                     "query": chunk.query,
                     "answer": chunk.answer,
                     "is_correct": chunk.is_correct,
@@ -335,11 +771,71 @@ class ChunkList:
         return self.generate_per_document_extractions(self.most_recent_extracted_df)
 
     def index(self):
-        self.retriever.index(df_to_index=self.df)
+        self.retriever.index(df_to_index=self.text_df())
 
     def load_index(self):
         self.retriever.load_index()
 
+    def build_answer_index(self):
+        """Generate question-answer pairs for every indexed chunk, once.
+
+        The pairs are stored in a searchable AnswerIndex.
+        """
+        answer_index = AnswerIndex()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=100) as executor:
+            futures = [submit_in_context(executor, chunk.auto_extract) for chunk in self.chunk_list()]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    for pair in future.result():
+                        answer_index.add(pair)
+                except Exception as exc:
+                    print("ERROR:", exc)
+
+        print(f"Built an answer index of {len(answer_index)} question-answer pairs.")
+        self.answer_index = answer_index
+
+    def answer_from_index(
+        self, query: str, min_score: float = 0.8, retrieved_documents: Optional[pd.DataFrame] = None
+    ) -> Optional[RAGResult]:
+        """Answer a query from the precomputed answer index, if its close questions all have the same answer.
+
+        Args:
+            query: query to answer.
+            min_score: minimum similarity between the query and an indexed question.
+            retrieved_documents: (optional) chunks retrieved for the query. Only the questions generated from these
+                chunks are matched, so that a question asked of many documents isn't answered from an unrelated one.
+
+        Returns:
+            RAGResult attributed to the chunks the answer was generated from, or None if there is no close match or
+            the close matches disagree.
+        """
+        if self.answer_index is None:
+            return None
+        chunk_keys = None
+        if retrieved_documents is not None:
+            chunk_keys = set(zip(retrieved_documents["document_id"].tolist(), retrieved_documents["chunk_id"].tolist()))
+        matches = self.answer_index.search(query, min_score=min_score, chunk_keys=chunk_keys)
+        if len(matches) == 0:
+            return None
+        if len({normalize_answer(pair.answer) for pair, _ in matches}) > 1:
+            print(f"The answer index has conflicting answers for query `{query}`.")
+            return None
+
+        chunk_answers = []
+        for pair, _ in matches:
+            chunk = self.get_chunk(pair.document_id, pair.chunk_id)
+            chunk_answers.append(
+                ChunkExtractionResult(
+                    document_id=chunk.document_id,
+                    chunk_id=chunk.chunk_id,
+                    chunk_text=chunk.chunk_text,
+                    query=query,
+                    answer=pair.answer,
+                    is_correct=True,
+                )
+            )
+        return RAGResult(answer=matches[0][0].answer, chunk_answers=chunk_answers)
+
     def retrieve(self, query: str, topk: int) -> pd.DataFrame:
         """Retrieve topk chunks based on the query.
 
@@ -352,27 +848,212 @@ class ChunkList:
         """
         return self.retriever.retrieve(query=query, k=topk)
 
-    def query(self, query: str, topk: int = 10) -> RAGResult:
+    def retrieve_batch(self, queries: List[str], topk: int) -> List[pd.DataFrame]:
+        """Retrieve topk chunks for each of several queries in one batched call.
+
+        Args:
+            queries: queries to use for retrieval.
+            topk: number of chunks to retrieve per query.
+
+        Returns:
+            List of dataframes of retrieved documents, in the same order as `queries`.
+        """
+        return self.retriever.retrieve_batch(queries=queries, k=topk)
+
+    def query(
+        self,
+        query: str,
+        topk: int = 10,
+        use_answer_index: bool = False,
+        min_answer_score: float = 0.8,
+        timeout: Optional[float] = None,
+        early_exit_answers: Optional[int] = None,
+        max_parallel: Optional[int] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ) -> RAGResult:
         """Retrieve, extract, and synthesize an anwer for a query from the chunks.
 
+        Extraction requests are issued in retrieval order, i.e. from the highest scoring chunk down.
+
         Args:
             query: query to use for retrieval.
             topk: number of chunks to retrieve.
+            use_answer_index: answer from the precomputed answer index when the retrieved chunks have close
+                questions with the same answer, instead of extracting.
+            min_answer_score: minimum similarity between the query and a question of the answer index.
+            timeout: (optional) number of seconds to answer within. The timeout is split across retrieval, extraction
+                and synthesis. Extractions still outstanding when their budget runs out are cancelled and the answer
+                is synthesized from the completed ones, and the result is marked as partial.
+            early_exit_answers: (optional) stop extracting once this many chunks agree on the same non-UNDEFINED
+                answer. Outstanding extractions are cancelled and the remaining chunks are skipped.
+            max_parallel: (optional) maximum number of extraction requests in flight. Defaults to all of them, which
+                leaves nothing to skip with `early_exit_answers`.
+            executor: (optional) executor running the retrieval, extraction and synthesis calls, see `leaf_executor`.
+                Defaults to a new thread pool for the query.
 
         Returns:
             Answer as a string and the relevant list of ChunkExtractionResult.
         """
-        retrieved_documents = self.retrieve(query, topk)
+        deadline = Deadline(timeout)
+        with leaf_executor(executor) as executor:
+            retrieval_future = submit_in_context(executor, self.retrieve, query, topk)
+            try:
+                retrieved_documents = retrieval_future.result(timeout=deadline.budget(RETRIEVAL_BUDGET_FRACTION))
+            except concurrent.futures.TimeoutError:
+                print(f"Retrieval for query `{query}` did not complete before the deadline.")
+                return self.retrieval_timeout_result(query)
+
+            return self.answer(
+                query,
+                retrieved_documents,
+                deadline,
+                executor,
+                use_answer_index=use_answer_index,
+                min_answer_score=min_answer_score,
+                early_exit_answers=early_exit_answers,
+                max_parallel=max_parallel,
+            )
+
+    def query_batch(
+        self,
+        queries: List[str],
+        topk: int = 10,
+        use_answer_index: bool = False,
+        min_answer_score: float = 0.8,
+        timeout: Optional[float] = None,
+        early_exit_answers: Optional[int] = None,
+        max_parallel: Optional[int] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ) -> List[RAGResult]:
+        """Answer several queries, retrieving the chunks of all of them in one `retrieve_batch` call and then
+        extracting and synthesizing their answers concurrently. See `query` for the arguments.
+
+        Returns:
+            List of RAGResult, in the same order as `queries`.
+        """
+        deadline = Deadline(timeout)
+        with leaf_executor(executor) as executor:
+            retrieval_future = submit_in_context(executor, self.retrieve_batch, queries, topk)
+            try:
+                retrieved_documents = retrieval_future.result(timeout=deadline.budget(RETRIEVAL_BUDGET_FRACTION))
+            except concurrent.futures.TimeoutError:
+                print(f"Retrieval for {len(queries)} queries did not complete before the deadline.")
+                return [self.retrieval_timeout_result(query) for query in queries]
+
+            # one thread per query, which only waits on the extractions and synthesis of its query.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(queries), 1)) as query_executor:
+                futures = [
+                    submit_in_context(
+                        query_executor,
+                        self.answer,
+                        query,
+                        documents,
+                        deadline,
+                        executor,
+                        use_answer_index=use_answer_index,
+                        min_answer_score=min_answer_score,
+                        early_exit_answers=early_exit_answers,
+                        max_parallel=max_parallel,
+                    )
+                    for query, documents in zip(queries, retrieved_documents)
+                ]
+                return [future.result() for future in futures]
+
+    @staticmethod
+    def retrieval_timeout_result(query: str) -> RAGResult:
+        return RAGResult(answer=f"No answer found to the following query: {query}", chunk_answers=[], is_partial=True)
+
+    def answer(
+        self,
+        query: str,
+        retrieved_documents: pd.DataFrame,
+        deadline: Deadline,
+        executor: concurrent.futures.Executor,
+        use_answer_index: bool = False,
+        min_answer_score: float = 0.8,
+        early_exit_answers: Optional[int] = None,
+        max_parallel: Optional[int] = None,
+    ) -> RAGResult:
+        """Extract and synthesize an answer for a query from its retrieved chunks. See `query` for the arguments.
+
+        Args:
+            query: query to answer.
+            retrieved_documents: chunks retrieved for the query.
+            deadline: deadline of the query, started before retrieval.
+            executor: executor running the extraction and synthesis calls.
+        """
+        if use_answer_index:
+            result = self.answer_from_index(query, min_score=min_answer_score, retrieved_documents=retrieved_documents)
+            if result is not None:
+                return result
+
+        chunks = list(self.chunk_list(df=retrieved_documents))
+        parallelism = max_parallel or max(len(chunks), 1)
+        next_chunk = 0
+        pending = set()
         extraction_result_list = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=100) as executor:
-            futures = [executor.submit(chunk.extract, [query]) for chunk in self.chunk_list(df=retrieved_documents)]
-            for future in concurrent.futures.as_completed(futures):
+        answer_counts = Counter()
+        stopped_early = False
+        while next_chunk < len(chunks) or len(pending) > 0:
+            while next_chunk < len(chunks) and len(pending) < parallelism:
+                pending.add(submit_in_context(executor, chunks[next_chunk].extract, [query]))
+                next_chunk += 1
+
+            done, pending = concurrent.futures.wait(
+                pending,
+                timeout=deadline.remaining(SYNTHESIS_BUDGET_FRACTION),
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            if len(done) == 0:
+                # the extraction budget ran out.
+                break
+            for future in done:
                 try:
-                    extraction_result_list.extend(future.result())
+                    chunk_extraction_results = future.result()
                 except Exception as exc:
                     print("ERROR:", exc)
+                    continue
+                extraction_result_list.extend(chunk_extraction_results)
+                for chunk_extraction_result in chunk_extraction_results:
+                    if not is_undefined(chunk_extraction_result.answer):
+                        answer_counts[normalize_answer(chunk_extraction_result.answer)] += 1
+
+            if early_exit_answers is not None and max(answer_counts.values(), default=0) >= early_exit_answers:
+                stopped_early = True
+                break
+
+        for future in pending:
+            future.cancel()
+        num_incomplete = len(pending) + len(chunks) - next_chunk
+        if num_incomplete > 0:
+            reason = "after enough agreeing answers" if stopped_early else "at the deadline"
+            print(f"Skipped {num_incomplete} of {len(chunks)} extractions for query `{query}` {reason}.")
+
+        synthesis_future = submit_in_context(executor, self.synthesize_rag, query, extraction_result_list)
+        try:
+            result = synthesis_future.result(timeout=deadline.remaining())
+        except concurrent.futures.TimeoutError:
+            print(f"Synthesis for query `{query}` did not complete before the deadline.")
+            result = self.concatenate_rag(query, extraction_result_list)
+            result.is_partial = True
+
+        result.is_partial = result.is_partial or (num_incomplete > 0 and not stopped_early)
+        return result
+
+    def concatenate_rag(self, query: str, extraction_result_list: List[ChunkExtractionResult]) -> RAGResult:
+        """Best-effort answer for a query without an LLM call, listing the valid answers of the extractions.
 
-        return self.synthesize_rag(query, extraction_result_list)
+        Args:
+            query: query to answer.
+            extraction_result_list: retrieved list of ChunkExtractionResult.
+        """
+        filtered_extraction_result_list = [chunk for chunk in extraction_result_list if not is_undefined(chunk.answer)]
+        if len(filtered_extraction_result_list) == 0:
+            return RAGResult(
+                answer=f"No answer found to the following query: {query}", chunk_answers=extraction_result_list
+            )
+        answer = "\n".join("- " + chunk.answer for chunk in filtered_extraction_result_list)
+        return RAGResult(answer=answer, chunk_answers=filtered_extraction_result_list)
 
     def synthesize_rag(self, query: str, extraction_result_list: List[ChunkExtractionResult]) -> RAGResult:
         """Synthesize an anwer for a query from the retrieved chunks.
@@ -401,7 +1082,7 @@ class ChunkList:
 
         formatted_answers = "\n".join(valid_answers)[:5000]
         prompt = FINAL_SYNTHESIZE_TEMPLATE.format(formatted_answers, query)
-        text = self.llm_endpoint.hit(prompt)
+        text = self.synthesis_endpoint.hit(prompt)
 
         return RAGResult(answer=text, chunk_answers=filtered_extraction_result_list)
 
@@ -413,6 +1094,10 @@ class Corpus:
         name: str,
         llm_endpoint: LLMEndpoint,
         retriever: Optional[Retriever] = None,
+        dataset_identity: Optional[str] = None,
+        extraction_endpoint: Optional[LLMEndpoint] = None,
+        synthesis_endpoint: Optional[LLMEndpoint] = None,
+        escalation_endpoint: Optional[LLMEndpoint] = None,
     ):
         """Initialization method for the Corpus class, which holds documents and enables extraction and RAG.
 
@@ -420,6 +1105,12 @@ class Corpus:
             documents: dataframe with the schema specified above, or base directory containing documents
                 to be transformed (e.g. from PDF to text).
             name: name of the corpus.
+            llm_endpoint: default LLM endpoint, used for every stage without a dedicated endpoint.
+            dataset_identity: string identifying the source dataset, used to key saved snapshots. Defaults to `name`.
+            extraction_endpoint: (optional) LLM endpoint used for per-chunk extraction, e.g. a small, fast model.
+            synthesis_endpoint: (optional) LLM endpoint used to synthesize the final answers.
+            escalation_endpoint: (optional) LLM endpoint that per-chunk extractions answered UNDEFINED (or that fail
+                to parse) are retried on, e.g. a larger model.
             cache_dir: cache directory where the artifacts for the corpus (e.g. index) will be saved. Will override
                 the default cache directory provided in the class constructor.
         """
@@ -429,7 +1120,15 @@ class Corpus:
         self.chunks: Union[ChunkList, None] = None
         self.name = name
         self.llm_endpoint = llm_endpoint
+        self.extraction_endpoint = extraction_endpoint
+        self.synthesis_endpoint = synthesis_endpoint
+        self.escalation_endpoint = escalation_endpoint
         self.retriever = retriever
+        self.dataset_identity = dataset_identity or name
+        self.chunk_size: Optional[int] = None
+        self.chunk_storage = "copy"
+        self.chunk_overlap = False
+        self.is_indexed = False
 
     def create_documents_df(self, documents: Union[str, pd.DataFrame]) -> pd.DataFrame:
         """Create a dataframe storing the documents. The schema of the dataframe is the following: (document_id,
@@ -449,37 +1148,133 @@ class Corpus:
             # todo: read PDFs and turn them into a df.
             return pd.DataFrame({})
 
-    def chunk(self, chunk_size: int = 2048):
+    def create_chunk_list(
+        self,
+        chunks_df: pd.DataFrame,
+        text_store: Optional[DocumentTextStore] = None,
+        duplicates: Optional[Dict[Tuple[int, int], List[Tuple[int, int]]]] = None,
+    ) -> ChunkList:
+        """Create a ChunkList over `chunks_df` that uses the endpoints and retriever of the corpus."""
+        return ChunkList(
+            chunks_df=chunks_df,
+            llm_endpoint=self.llm_endpoint,
+            retriever=self.retriever,
+            text_store=text_store,
+            duplicates=duplicates,
+            extraction_endpoint=self.extraction_endpoint,
+            synthesis_endpoint=self.synthesis_endpoint,
+            escalation_endpoint=self.escalation_endpoint,
+        )
+
+    def create_text_store(self) -> DocumentTextStore:
+        """Create the store of document text that offset chunks refer to.
+
+        The `document_text` column is replaced by the Arrow array of the store, so that the text is held once.
+        """
+        text_store = DocumentTextStore.from_documents(self.documents)
+        self.documents = self.documents.assign(document_text=text_store.document_texts(self.documents.index))
+        return text_store
+
+    def memory_usage(self) -> int:
+        """Return the approximate number of bytes held by the documents, the chunks, the answer index and the index
+        loaded by the retriever, see `Retriever.memory_usage`.
+
+        With offset chunks, the text store shares the buffers of the `document_text` column, so it is counted with the
+        documents.
+        """
+        num_bytes = int(self.documents.memory_usage(deep=True).sum())
+        if self.retriever is not None and hasattr(self.retriever, "memory_usage"):
+            num_bytes += self.retriever.memory_usage()
+        if self.chunks is not None:
+            num_bytes += int(self.chunks.df.memory_usage(deep=True).sum())
+            if self.chunks.answer_index is not None:
+                num_bytes += int(self.chunks.answer_index.to_df().memory_usage(deep=True).sum())
+        return num_bytes
+
+    def call_counts(self) -> Dict[str, int]:
+        """Return the number of LLM calls made so far per stage (extract, escalate, verify, synthesize)."""
+        if self.chunks is None:
+            return {}
+        return self.chunks.call_counts()
+
+    def chunk(
+        self,
+        chunk_size: int = 2048,
+        storage: str = "copy",
+        dedup: bool = False,
+        dedup_threshold: float = 0.8,
+        dedup_collapse: bool = False,
+        overlap: bool = False,
+    ):
         """Create chunks out of the provided documents in the dataframe.
 
         Args:
             todo: make number of tokens.
             chunk_size: size of a chunk as number of characters.
+            storage: "copy" to store the text of every chunk in the chunk table, or "offsets" to store chunks as
+                (document_id, start, end) byte offsets into one shared UTF-8 buffer per document. With "offsets", chunk
+                text is only materialised when a prompt is built or a chunk is displayed.
+            dedup: index and send to the LLM once the chunks repeated across documents (e.g. repeated documents,
+                disclaimers and headers). See `ChunkList.deduplicate`.
+            dedup_threshold: minimum estimated Jaccard similarity for two chunks to be near-duplicates.
+            dedup_collapse: keep one chunk per cluster of near-duplicates rather than per distinct text. Shrinks the
+                index and the LLM fan-out further, at the cost of attributing the values of one chunk to near-duplicates
+                that differ from it.
+            overlap: also create chunks straddling the boundaries of the others, so that passages split across two
+                chunks are retrievable in one piece. Roughly doubles the number of chunks.
 
         Returns:
             ChunkList object containing chunks.
         """
+        if storage not in CHUNK_STORAGE_MODES:
+            raise ValueError(f"Invalid chunk storage `{storage}`. Must be one of {CHUNK_STORAGE_MODES}.")
+
+        text_store = None
         document_chunks_df_list = []
-        for _, row in self.documents.iterrows():
-            document_id, document_name, document_text = row["document_id"], row["document_name"], row["document_text"]
-            document_chunks = chunk_text(document_text, chunk_size=chunk_size, overlap=False)
-            num_chunks = len(document_chunks)
-            document_chunks_df = pd.DataFrame(
-                {
-                    "chunk_id": list(range(num_chunks)),
-                    "chunk_text": document_chunks,
-                    "document_id": num_chunks * [document_id],
-                }
-            )
-            document_chunks_df_list.append(document_chunks_df)
-        self.chunks = ChunkList(
-            chunks_df=pd.concat(document_chunks_df_list), llm_endpoint=self.llm_endpoint, retriever=self.retriever
-        )
+        if storage == "offsets":
+            text_store = self.create_text_store()
+            for document_id, buffer in text_store.buffers.items():
+                spans = chunk_spans(buffer, chunk_size=chunk_size, overlap=overlap)
+                num_chunks = len(spans)
+                if num_chunks == 0:
+                    # an empty frame would turn the offset columns into floats.
+                    continue
+                document_chunks_df = pd.DataFrame(
+                    {
+                        "chunk_id": list(range(num_chunks)),
+                        "document_id": num_chunks * [document_id],
+                        "start": [start for start, _ in spans],
+                        "end": [end for _, end in spans],
+                    }
+                )
+                document_chunks_df_list.append(document_chunks_df)
+        else:
+            for _, row in self.documents.iterrows():
+                document_id, document_name, document_text = (
+                    row["document_id"],
+                    row["document_name"],
+                    row["document_text"],
+                )
+                document_chunks = chunk_text(document_text, chunk_size=chunk_size, overlap=overlap)
+                num_chunks = len(document_chunks)
+                document_chunks_df = pd.DataFrame(
+                    {
+                        "chunk_id": list(range(num_chunks)),
+                        "chunk_text": document_chunks,
+                        "document_id": num_chunks * [document_id],
+                    }
+                )
+                document_chunks_df_list.append(document_chunks_df)
+        self.chunks = self.create_chunk_list(pd.concat(document_chunks_df_list), text_store=text_store)
+        if dedup:
+            self.chunks.deduplicate(threshold=dedup_threshold, collapse_near_duplicates=dedup_collapse)
         self.chunk_size = chunk_size
+        self.chunk_storage = storage
+        self.chunk_overlap = overlap
 
         return self.chunks
 
-    def index(self):
+    def index(self, build_answer_index: bool = False):
         """Create an embeddings index for the chunks created. must call `chunk` before.
 
         Args:
@@ -487,6 +1282,8 @@ class Corpus:
                 provided in the class constructor.
             index_name: index name under which the index will be saved. If not provided, it will default to
                 f"{corpus name}-{chunk size}".
+            build_answer_index: also generate question-answer pairs for every chunk (one LLM call per chunk), so that
+                `query` can answer recurring factoid questions without extraction calls.
         """
         if self.retriever is None:
             raise RuntimeError("No retriever specified. Please pass a Retriever when constructing the `Corpus` object.")
@@ -494,6 +1291,10 @@ class Corpus:
             raise RuntimeError("You must create chunks out of this corpus. Call the method `chunk` first.")
 
         self.chunks.index()
+        self.is_indexed = True
+        if build_answer_index:
+            with request_class(BATCH):
+                self.chunks.build_answer_index()
 
     def load_index(self):
         """Loads embedding index from cache directory.
@@ -514,12 +1315,146 @@ class Corpus:
             )
 
         self.chunks.load_index()
+        self.is_indexed = True
+
+    @property
+    def version_key(self) -> Optional[str]:
+        """Key identifying snapshots of this corpus.
+
+        None until `chunk` has been called.
+        """
+        if self.chunk_size is None:
+            return None
+        return corpus_version_key(self.dataset_identity, self.chunk_size, overlap=self.chunk_overlap)
+
+    def save(self, path: str):
+        """Save the documents, the chunk table and the index metadata of the corpus as a snapshot.
+
+        The tables are written as uncompressed Arrow IPC files next to a `metadata.json` file, so that `Corpus.load`
+        can restore the corpus without downloading and chunking the dataset again.
+
+        Args:
+            path: directory where the snapshot will be written.
+        """
+        if self.chunks is None:
+            raise RuntimeError("You must create chunks out of this corpus before saving it. Call `chunk` first.")
 
-    def extract(self, queries: List[str]) -> ExtractionResult:
+        os.makedirs(path, exist_ok=True)
+        write_snapshot_table(self.documents, os.path.join(path, SNAPSHOT_DOCUMENTS_FILE))
+        write_snapshot_table(self.chunks.df, os.path.join(path, SNAPSHOT_CHUNKS_FILE))
+
+        if len(self.chunks.duplicates) > 0:
+            duplicate_rows = [
+                (canonical[0], canonical[1], document_id, chunk_id)
+                for canonical, sources in self.chunks.duplicates.items()
+                for document_id, chunk_id in sources
+            ]
+            duplicates_df = pd.DataFrame(
+                duplicate_rows,
+                columns=["canonical_document_id", "canonical_chunk_id", "document_id", "chunk_id"],
+            )
+            write_snapshot_table(duplicates_df, os.path.join(path, SNAPSHOT_DUPLICATES_FILE))
+        if self.chunks.answer_index is not None:
+            write_snapshot_table(self.chunks.answer_index.to_df(), os.path.join(path, SNAPSHOT_ANSWER_INDEX_FILE))
+
+        metadata = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "version_key": self.version_key,
+            "name": self.name,
+            "dataset_identity": self.dataset_identity,
+            "chunk_size": self.chunk_size,
+            "chunk_storage": self.chunk_storage,
+            "chunk_overlap": self.chunk_overlap,
+            "has_duplicates": len(self.chunks.duplicates) > 0,
+            "index": {
+                "index_name": getattr(self.retriever, "index_name", None),
+                "is_indexed": self.is_indexed,
+                "has_answer_index": self.chunks.answer_index is not None,
+            },
+        }
+        # write the metadata last, so that a partially written snapshot is never picked up by `load`.
+        with open(os.path.join(path, SNAPSHOT_METADATA_FILE), "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        llm_endpoint: LLMEndpoint,
+        retriever: Optional[Retriever] = None,
+        version_key: Optional[str] = None,
+        **kwargs,
+    ) -> "Corpus":
+        """Load a corpus snapshot written by `Corpus.save`. The documents and chunk tables are memory mapped, see
+        `read_snapshot_table`, so loading a snapshot costs little memory until its text is accessed.
+
+        Args:
+            path: directory containing the snapshot.
+            llm_endpoint: LLM endpoint to attach to the loaded corpus.
+            retriever: retriever to attach to the loaded corpus. If the snapshot was indexed, its index is loaded.
+            version_key: expected snapshot key (see `corpus_version_key`). A ValueError is raised on mismatch.
+            kwargs: additional arguments passed to the Corpus constructor, e.g. per-stage endpoints.
+
+        Returns:
+            Corpus object with its chunks restored.
+        """
+        metadata_path = os.path.join(path, SNAPSHOT_METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            raise FileNotFoundError(f"No corpus snapshot found under `{path}`.")
+        with open(metadata_path, encoding="utf-8") as f:
+            metadata = json.load(f)
+
+        if metadata.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(
+                f"Corpus snapshot under `{path}` has format version `{metadata.get('format_version')}`, expected "
+                f"`{SNAPSHOT_FORMAT_VERSION}`."
+            )
+        if version_key is not None and metadata["version_key"] != version_key:
+            raise ValueError(
+                f"Corpus snapshot under `{path}` has version key `{metadata['version_key']}`, expected `{version_key}`."
+            )
+
+        documents = read_snapshot_table(os.path.join(path, SNAPSHOT_DOCUMENTS_FILE))
+        chunks_df = read_snapshot_table(os.path.join(path, SNAPSHOT_CHUNKS_FILE))
+
+        corpus = cls(
+            documents,
+            name=metadata["name"],
+            llm_endpoint=llm_endpoint,
+            retriever=retriever,
+            dataset_identity=metadata["dataset_identity"],
+            **kwargs,
+        )
+        text_store = None
+        if metadata["chunk_storage"] == "offsets":
+            text_store = corpus.create_text_store()
+        duplicates = {}
+        if metadata.get("has_duplicates", False):
+            duplicates_df = read_snapshot_table(os.path.join(path, SNAPSHOT_DUPLICATES_FILE))
+            for canonical_document_id, canonical_chunk_id, document_id, chunk_id in duplicates_df.itertuples(
+                index=False
+            ):
+                duplicates.setdefault((canonical_document_id, canonical_chunk_id), []).append((document_id, chunk_id))
+        corpus.chunks = corpus.create_chunk_list(chunks_df, text_store=text_store, duplicates=duplicates)
+        corpus.chunk_size = metadata["chunk_size"]
+        corpus.chunk_storage = metadata["chunk_storage"]
+        corpus.chunk_overlap = metadata.get("chunk_overlap", False)
+        if metadata["index"].get("has_answer_index", False):
+            answer_index_df = read_snapshot_table(os.path.join(path, SNAPSHOT_ANSWER_INDEX_FILE))
+            corpus.chunks.answer_index = AnswerIndex.from_df(answer_index_df)
+
+        if retriever is not None and metadata["index"]["is_indexed"]:
+            corpus.load_index()
+
+        return corpus
+
+    def extract(self, queries: List[str], executor: Optional[concurrent.futures.Executor] = None) -> ExtractionResult:
         """Extract information from corpus based on the provided queries.
 
         Args:
             queries: list of queries to extract information for.
+            executor: (optional) executor running the extraction calls, e.g. shared by the requests of a server. It
+                must not run the calls to `extract` themselves, see `leaf_executor`.
         """
         if isinstance(queries, str):
             queries = [queries]
@@ -530,17 +1465,81 @@ class Corpus:
                 "You must create chunks for this corpus before attempting to perform extraction. Call the method `chunk` first."
             )
 
-        return self.chunks.document_extract(queries=queries)
+        with request_class(BATCH):
+            return self.chunks.document_extract(queries=queries, executor=executor)
 
-    def query(self, query: str, topk: int = 10) -> RAGResult:
+    def query(
+        self,
+        query: str,
+        topk: int = 10,
+        use_answer_index: bool = False,
+        min_answer_score: float = 0.8,
+        timeout: Optional[float] = None,
+        early_exit_answers: Optional[int] = None,
+        max_parallel: Optional[int] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ) -> RAGResult:
         """Answer a query from the corpus. Uses a combination of retrieval and infomration extraction.
 
         Args:
             query: query to be answered from the corpus.
             topk: number of chunks to retrieve/get an answer from.
+            use_answer_index: answer from the precomputed answer index (see `index`) when the retrieved chunks have
+                close questions with the same answer, instead of extracting. Off by default.
+            min_answer_score: minimum similarity between the query and a question of the answer index.
+            timeout: (optional) number of seconds to answer within. When it is reached, the answer is synthesized
+                from the extractions completed so far and `RAGResult.is_partial` is set.
+            early_exit_answers: (optional) stop extracting once this many chunks agree on the same answer, and go
+                straight to synthesis. Chunks are extracted from in retrieval score order.
+            max_parallel: (optional) maximum number of extraction requests in flight. Use it with
+                `early_exit_answers`, e.g. `early_exit_answers=2, max_parallel=3`, to issue fewer than `topk` calls.
+            executor: (optional) executor running the retrieval, extraction and synthesis calls, e.g. shared by the
+                requests of a server. It must not run the calls to `query` themselves, see `leaf_executor`. Defaults
+                to a new thread pool for the query.
 
         Returns:
             string containing the answer.
         """
-        result = self.chunks.query(query=query, topk=topk)
+        with request_class(INTERACTIVE):
+            result = self.chunks.query(
+                query=query,
+                topk=topk,
+                use_answer_index=use_answer_index,
+                min_answer_score=min_answer_score,
+                timeout=timeout,
+                early_exit_answers=early_exit_answers,
+                max_parallel=max_parallel,
+                executor=executor,
+            )
         return result
+
+    def query_batch(
+        self,
+        queries: List[str],
+        topk: int = 10,
+        use_answer_index: bool = False,
+        min_answer_score: float = 0.8,
+        timeout: Optional[float] = None,
+        early_exit_answers: Optional[int] = None,
+        max_parallel: Optional[int] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+    ) -> List[RAGResult]:
+        """Answer several queries from the corpus, retrieving the chunks of all of them in one batched call. See
+        `query` for the arguments; `timeout` applies to each query, all of them starting together.
+
+        Returns:
+            list of RAGResult, in the same order as `queries`.
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        with request_class(INTERACTIVE):
+            return self.chunks.query_batch(
+                queries=queries,
+                topk=topk,
+                use_answer_index=use_answer_index,
+                min_answer_score=min_answer_score,
+                timeout=timeout,
+                early_exit_answers=early_exit_answers,
+                max_parallel=max_parallel,
+                executor=executor,
+            )
@@ -0,0 +1,183 @@
+import atexit
+import gzip
+import json
+import os
+import threading
+from collections import deque
+from time import perf_counter, sleep
+from typing import Any, Deque, Dict, List
+
+from info_extract.endpoints import LLMEndpoint, unwrap_attribute
+
+
+def load_recording(path: str) -> List[Dict[str, Any]]:
+    """Read the records of a recording written by RecordingLLMEndpoint, in the order they were written."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class RecordingWriter:
+    def __init__(self, path: str, flush_every: int = 100):
+        """Buffers the records of every RecordingLLMEndpoint of a process that writes to `path`.
+
+        Each flush appends the buffered records as one complete gzip member in a single write to a file opened in
+        append mode, so that several processes (e.g. Streamlit or server workers) can record to the same file without
+        interleaving their compressed streams. A gzip file of several members reads as their concatenation.
+
+        Args:
+            path: path of the recording.
+            flush_every: number of records between flushes.
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.pid = os.getpid()
+        self.started_at = perf_counter()
+        self._lines: List[str] = []
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def write(self, line: str):
+        with self._lock:
+            self._lines.append(line)
+            if len(self._lines) >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if len(self._lines) == 0:
+            return
+        data = gzip.compress("".join(line + "\n" for line in self._lines).encode("utf-8"))
+        self._lines = []
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+# path -> writer of the current process.
+_writers: Dict[str, RecordingWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_recording_writer(path: str, flush_every: int = 100) -> RecordingWriter:
+    """Return the writer of the current process for the recording at `path`, creating it on first use."""
+    key = os.path.abspath(path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        # a forked child must not flush the records buffered by its parent.
+        if writer is None or writer.pid != os.getpid():
+            writer = _writers[key] = RecordingWriter(path, flush_every=flush_every)
+        writer.flush_every = min(writer.flush_every, flush_every)
+        return writer
+
+
+class RecordingLLMEndpoint(LLMEndpoint):
+    def __init__(self, llm_endpoint: LLMEndpoint, path: str, flush_every: int = 100):
+        """Wraps an endpoint and records every call to a gzipped JSON lines file, one record per call.
+
+        Records are {"start": seconds since the process started recording, "prompt", "options", "model_name",
+        "response", "latency", "error"}. `options` and `model_name` are those of the wrapped endpoint, if it declares
+        them.
+
+        Every endpoint recording to the same path in a process shares one RecordingWriter, which appends to the file
+        every `flush_every` records and at interpreter exit.
+
+        Args:
+            llm_endpoint: endpoint to record.
+            path: path of the recording, e.g. "traffic.jsonl.gz".
+            flush_every: number of records between flushes. Lower values lose fewer records on a crash, at the cost of
+                compression.
+        """
+        super().__init__(llm_endpoint=llm_endpoint, path=path, flush_every=flush_every)
+        self.llm_endpoint = llm_endpoint
+        self.path = path
+        self.flush_every = flush_every
+        self.options = unwrap_attribute(llm_endpoint, "options", {})
+        self.model_name = unwrap_attribute(llm_endpoint, "model_name")
+        self.writer = get_recording_writer(path, flush_every=flush_every)
+
+    def hit(self, input_text):
+        start_t = perf_counter()
+        response, error = None, None
+        try:
+            response = self.llm_endpoint.hit(input_text)
+            return response
+        except Exception as exc:
+            error = repr(exc)
+            raise
+        finally:
+            record = {
+                "start": round(start_t - self.writer.started_at, 6),
+                "prompt": input_text,
+                "options": self.options,
+                "model_name": self.model_name,
+                "response": response,
+                "latency": round(perf_counter() - start_t, 6),
+                "error": error,
+            }
+            self.writer.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False))
+
+    def close(self):
+        """Flush the records buffered for the recording.
+
+        The writer stays usable by the other endpoints.
+        """
+        self.writer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReplayLLMEndpoint(LLMEndpoint):
+    def __init__(self, path: str, latency_scale: float = 1.0, strict: bool = True):
+        """Serves the responses of a recording written by RecordingLLMEndpoint, without network access.
+
+        Responses are looked up by prompt. A prompt recorded several times gets its recorded responses in order, and
+        the last one once they have all been served. Recorded errors are raised again as RuntimeError.
+
+        Args:
+            path: path of the recording.
+            latency_scale: factor applied to the recorded latencies, e.g. 0.0 to replay instantly or 0.5 to simulate
+                a deployment twice as fast.
+            strict: raise a KeyError for prompts that aren't in the recording. Otherwise they are answered with an
+                empty response, i.e. UNDEFINED.
+        """
+        super().__init__(path=path, latency_scale=latency_scale, strict=strict)
+        self.path = path
+        self.latency_scale = latency_scale
+        self.strict = strict
+
+        records = load_recording(path)
+        self.records: Dict[str, Deque[Dict[str, Any]]] = {}
+        for record in records:
+            self.records.setdefault(record["prompt"], deque()).append(record)
+        # replayed endpoints keep the options of the recorded one, e.g. for query packing.
+        self.options = (records[0].get("options") or {}) if len(records) > 0 else {}
+        if "max_new_tokens" in self.options:
+            self.max_new_tokens = self.options["max_new_tokens"]
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self, input_text):
+        with self._lock:
+            queue = self.records.get(input_text)
+            if queue is None:
+                self.misses += 1
+            else:
+                record = queue.popleft() if len(queue) > 1 else queue[0]
+        if queue is None:
+            if self.strict:
+                raise KeyError(f"Prompt not found in the recording `{self.path}`: {input_text[:100]!r}...")
+            return ""
+
+        sleep(record["latency"] * self.latency_scale)
+        if record.get("error") is not None:
+            raise RuntimeError(f"Recorded error: {record['error']}")
+        return record["response"]
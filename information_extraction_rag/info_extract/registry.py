@@ -0,0 +1,258 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from info_extract.defaults import DEFAULT_CACHE_DIR
+from info_extract.info_extract import Corpus, SNAPSHOT_METADATA_FILE
+
+DEFAULT_REGISTRY_DIR = os.path.join(DEFAULT_CACHE_DIR, "corpora")
+
+
+class _Entry:
+    def __init__(
+        self, builder: Optional[Callable[[], Corpus]], version_key: Optional[str], load_kwargs: Dict[str, Any]
+    ):
+        self.corpus: Optional[Corpus] = None
+        self.builder = builder
+        self.version_key = version_key
+        # arguments passed to `Corpus.load` when the corpus is reloaded (endpoints and retriever).
+        self.load_kwargs = load_kwargs
+        self.num_bytes = 0
+        # part of `num_bytes` held by the index of the retriever, which may be loaded lazily.
+        self.retriever_bytes = 0
+        # state of the corpus when its snapshot was last written or read. Used to skip unnecessary saves.
+        self.persisted_state = None
+        # number of `CorpusRegistry.using` blocks holding the corpus, which keep it from being evicted.
+        self.num_users = 0
+        # evict the corpus once its last user releases it.
+        self.evict_pending = False
+        # held while the corpus is loaded or built, so that concurrent `get` calls of the key wait for one load while
+        # the other keys stay available.
+        self.materialize_lock = threading.Lock()
+
+
+def corpus_state(corpus: Corpus):
+    """Cheap fingerprint of what `Corpus.save` would write."""
+    if corpus.chunks is None:
+        return None
+    return corpus.version_key, corpus.is_indexed, corpus.chunks.answer_index is not None, len(corpus.chunks.df)
+
+
+def retriever_memory_usage(corpus: Corpus) -> int:
+    if corpus.retriever is None or not hasattr(corpus.retriever, "memory_usage"):
+        return 0
+    return corpus.retriever.memory_usage()
+
+
+class CorpusRegistry:
+    def __init__(self, max_bytes: int = 4 * 1024**3, cache_dir: str = DEFAULT_REGISTRY_DIR):
+        """Holds corpora in memory up to an approximate memory budget, and evicts the least recently used ones to
+        their on-disk snapshot form. Evicted corpora are reloaded transparently by `get`.
+
+        Args:
+            max_bytes: approximate memory budget for the corpora held in memory, see `Corpus.memory_usage`.
+            cache_dir: directory under which corpus snapshots are written, one subdirectory per key.
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def snapshot_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key.replace(os.sep, "_"))
+
+    def has_snapshot(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.snapshot_path(key), SNAPSHOT_METADATA_FILE))
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def register(
+        self,
+        key: str,
+        corpus: Optional[Corpus] = None,
+        builder: Optional[Callable[[], Corpus]] = None,
+        version_key: Optional[str] = None,
+        **load_kwargs,
+    ):
+        """Register a corpus under a key, either directly, through a builder called on first access, or from the
+        snapshot already saved under the key.
+
+        When only a builder is given, a snapshot saved under the key (e.g. by a previous process) is loaded instead of
+        calling the builder, provided its version key matches.
+
+        Args:
+            key: key to register the corpus under.
+            corpus: (optional) corpus to register.
+            builder: (optional) callable creating the corpus (chunked and indexed). Required if `corpus` isn't given
+                and no snapshot is saved under the key.
+            version_key: (optional) expected snapshot key, see `corpus_version_key`. Defaults to the key of `corpus`.
+            load_kwargs: arguments passed to `Corpus.load` on reload, e.g. `llm_endpoint` and `retriever`. Defaults
+                to the endpoints and retriever of `corpus`.
+        """
+        if corpus is None and builder is None and not self.has_snapshot(key):
+            raise ValueError(f"Either `corpus` or `builder` must be provided, or a snapshot saved under `{key}`.")
+        if corpus is not None:
+            load_kwargs = {
+                "llm_endpoint": corpus.llm_endpoint,
+                "retriever": corpus.retriever,
+                "extraction_endpoint": corpus.extraction_endpoint,
+                "synthesis_endpoint": corpus.synthesis_endpoint,
+                "escalation_endpoint": corpus.escalation_endpoint,
+                **load_kwargs,
+            }
+            version_key = version_key or corpus.version_key
+        elif "llm_endpoint" not in load_kwargs:
+            raise ValueError("`llm_endpoint` must be provided to reload a corpus registered without a corpus object.")
+
+        with self._lock:
+            entry = _Entry(builder=builder, version_key=version_key, load_kwargs=load_kwargs)
+            self._entries[key] = entry
+            if corpus is not None:
+                entry.corpus = corpus
+                self._measure(entry)
+                self._evict_to_fit(keep=key)
+
+    def get(self, key: str) -> Corpus:
+        """Return the corpus registered under `key`, loading or building it if it isn't in memory.
+
+        The corpus is loaded or built under a lock of its key only, so that other keys can be used in the meantime. The
+        corpus may be evicted while it is still used. Use `using` to keep it in memory for the duration of a call.
+        """
+        entry = self._entry(key)
+        if entry.corpus is not None:
+            return entry.corpus
+
+        with entry.materialize_lock:
+            with self._lock:
+                # loaded by a concurrent call while waiting for the key lock.
+                if entry.corpus is not None:
+                    return entry.corpus
+            corpus = self._materialize(key, entry)
+            num_bytes, retriever_bytes = corpus.memory_usage(), retriever_memory_usage(corpus)
+
+            with self._lock:
+                # the key may have been registered again in the meantime.
+                if self._entries.get(key) is entry:
+                    entry.corpus = corpus
+                    entry.num_bytes, entry.retriever_bytes = num_bytes, retriever_bytes
+                    self._evict_to_fit(keep=key)
+            return corpus
+
+    def _entry(self, key: str) -> _Entry:
+        """Return the entry of `key`, marked as the most recently used."""
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(f"No corpus registered under `{key}`.")
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    @contextmanager
+    def using(self, key: str) -> Iterator[Corpus]:
+        """Return the corpus registered under `key` like `get`, and keep it from being evicted until the block
+        exits.
+
+        The memory usage of its retriever is measured again on exit, e.g. to account for an index loaded on first
+        retrieval.
+        """
+        while True:
+            corpus = self.get(key)
+            with self._lock:
+                entry = self._entries.get(key)
+                # the corpus may have been evicted, or the key registered again, since `get` returned.
+                if entry is not None and entry.corpus is corpus:
+                    entry.num_users += 1
+                    break
+        try:
+            yield corpus
+        finally:
+            with self._lock:
+                entry.num_users -= 1
+                # the key may have been registered again in the meantime.
+                if self._entries.get(key) is entry and entry.corpus is corpus:
+                    self._measure_retriever(entry)
+                    if entry.num_users == 0 and entry.evict_pending:
+                        self.evict(key)
+                    else:
+                        self._evict_to_fit(keep=key)
+
+    def _measure(self, entry: _Entry):
+        entry.num_bytes = entry.corpus.memory_usage()
+        entry.retriever_bytes = retriever_memory_usage(entry.corpus)
+
+    def _measure_retriever(self, entry: _Entry):
+        retriever_bytes = retriever_memory_usage(entry.corpus)
+        entry.num_bytes += retriever_bytes - entry.retriever_bytes
+        entry.retriever_bytes = retriever_bytes
+
+    def _materialize(self, key: str, entry: _Entry) -> Corpus:
+        path = self.snapshot_path(key)
+        if self.has_snapshot(key):
+            try:
+                corpus = Corpus.load(path, version_key=entry.version_key, **entry.load_kwargs)
+                entry.persisted_state = corpus_state(corpus)
+                return corpus
+            except ValueError as exc:
+                if entry.builder is None:
+                    raise
+                print(f"Rebuilding corpus `{key}`: {exc}")
+        if entry.builder is None:
+            raise RuntimeError(f"Corpus `{key}` was evicted but no snapshot was found under `{path}`.")
+
+        corpus = entry.builder()
+        # persist right away, so that other processes and restarts can warm start from the snapshot.
+        self._persist(key, entry, corpus)
+        return corpus
+
+    def _persist(self, key: str, entry: _Entry, corpus: Corpus):
+        state = corpus_state(corpus)
+        if state is None:
+            raise RuntimeError(f"Corpus `{key}` has no chunks and can't be saved. Call the method `chunk` first.")
+        if state != entry.persisted_state:
+            corpus.save(self.snapshot_path(key))
+            entry.persisted_state = state
+
+    def evict(self, key: str):
+        """Write the corpus registered under `key` to its snapshot, if needed, and release it from memory.
+
+        A corpus in use (see `using`) is evicted once its last user releases it.
+        """
+        with self._lock:
+            entry = self._entries[key]
+            if entry.corpus is None:
+                return
+            if entry.num_users > 0:
+                entry.evict_pending = True
+                return
+            entry.evict_pending = False
+            self._persist(key, entry, entry.corpus)
+            if entry.corpus.retriever is not None:
+                entry.corpus.retriever.unload_index()
+            print(f"Evicted corpus `{key}` ({entry.num_bytes} bytes) to {self.snapshot_path(key)}.")
+            entry.corpus = None
+            entry.num_bytes = entry.retriever_bytes = 0
+
+    def _evict_to_fit(self, keep: str):
+        # entries are ordered from least to most recently used.
+        for key in list(self._entries):
+            if self.memory_usage() <= self.max_bytes:
+                break
+            if key != keep and self._entries[key].num_users == 0:
+                self.evict(key)
+
+    def memory_usage(self) -> int:
+        """Return the approximate number of bytes held by the corpora in memory."""
+        with self._lock:
+            return sum(entry.num_bytes for entry in self._entries.values())
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return, per key, whether the corpus is in memory, its approximate size in bytes and its number of
+        users."""
+        with self._lock:
+            return {
+                key: {"in_memory": entry.corpus is not None, "num_bytes": entry.num_bytes, "num_users": entry.num_users}
+                for key, entry in self._entries.items()
+            }
@@ -1,14 +1,27 @@
+import concurrent.futures
+import json
 import os
-from time import perf_counter
-from typing import Optional
+import threading
+from time import monotonic, perf_counter
+from typing import Callable, List, Optional, Tuple, TYPE_CHECKING
 
+import numpy as np
 import pandas as pd
-from ludwig.backend import initialize_backend
-from ludwig.models.retrieval import SemanticRetrieval
-from predibase import PredibaseClient
 
 from info_extract.defaults import DEFAULT_CACHE_DIR
 
+if TYPE_CHECKING:
+    from predibase import PredibaseClient
+
+# connection under which Predibase stores datasets created from dataframes.
+PREDIBASE_INDEX_CONNECTION_NAME = "file_uploads"
+
+DEFAULT_EMBEDDING_MODEL = "all-mpnet-base-v2"
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+# number of reduced precision vectors converted to float32 at a time while scoring. Small enough for the converted
+# block to stay in cache, so that scoring reads the stored vectors once.
+SEARCH_BLOCK_SIZE = 256
+
 
 class Retriever:
     def __init__(self, **kwargs):
@@ -20,9 +33,22 @@ class Retriever:
     def load_index(self):
         pass
 
+    def unload_index(self):
+        pass
+
+    def memory_usage(self) -> int:
+        """Return the approximate number of bytes held by the loaded index.
+
+        Remote indices count for 0.
+        """
+        return 0
+
     def retrieve(self, query: str, k: int):
         pass
 
+    def retrieve_batch(self, queries: List[str], k: int) -> List[pd.DataFrame]:
+        return [self.retrieve(query=query, k=k) for query in queries]
+
 
 class LudwigRetriever:
     def __init__(self, index_name: Optional[str] = None, cache_dir: Optional[str] = DEFAULT_CACHE_DIR):
@@ -34,6 +60,9 @@ class LudwigRetriever:
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
 
+        from ludwig.backend import initialize_backend
+        from ludwig.models.retrieval import SemanticRetrieval
+
         print(f"Indexing {len(df_to_index)} chunks.")
         start_t = perf_counter()
         self.semantic_retrieval = SemanticRetrieval(model_name="all-mpnet-base-v2")
@@ -45,6 +74,8 @@ class LudwigRetriever:
         self.semantic_retrieval.save_index(name=self.index_name, cache_directory=self.cache_dir)
 
     def load_index(self):
+        from ludwig.models.retrieval import SemanticRetrieval
+
         print(f"Loading index {self.index_name}.")
         start_t = perf_counter()
         self.semantic_retrieval = SemanticRetrieval(model_name="all-mpnet-base-v2")
@@ -52,7 +83,19 @@ class LudwigRetriever:
         end_t = perf_counter()
         print(f"\nTOOK {end_t - start_t}s to load the index.")
 
+    def unload_index(self):
+        self.semantic_retrieval = None
+
+    def memory_usage(self) -> int:
+        # the memory of the Ludwig index isn't exposed.
+        return 0
+
     def retrieve(self, query: str, k: int):
+        return self.retrieve_batch([query], k=k)[0]
+
+    def retrieve_batch(self, queries: List[str], k: int) -> List[pd.DataFrame]:
+        from ludwig.backend import initialize_backend
+
         if self.semantic_retrieval is None:
             try:
                 self.load_index()
@@ -64,44 +107,359 @@ class LudwigRetriever:
 
         backend = initialize_backend("local")
         answer = self.semantic_retrieval.search(
-            df=pd.DataFrame({"query": [query]}), backend=backend, k=k, return_data=True
+            df=pd.DataFrame({"query": queries}), backend=backend, k=k, return_data=True
         )
-        retrieved_documents = pd.DataFrame(answer[0])
-        return retrieved_documents
+        return [pd.DataFrame(retrieved_documents) for retrieved_documents in answer]
 
 
 class PredibaseRetriever:
     def __init__(
         self,
-        predibase_client: PredibaseClient,
+        predibase_client: "PredibaseClient",
         index_name: Optional[str] = None,
         cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
         model_name: str = "llama-2-13b",
+        index_ttl: float = 300.0,
+        max_workers: int = 16,
     ):
+        """Retriever backed by a Predibase dataset index.
+
+        Args:
+            predibase_client: client used to reach Predibase. Any object with the `get_dataset`,
+                `create_dataset_from_df` and `prompt` methods of PredibaseClient can be used.
+            index_name: name of the dataset holding the index.
+            cache_dir: unused, kept for parity with LudwigRetriever.
+            model_name: name of the LLM used to query the index.
+            index_ttl: number of seconds for which a resolved index handle is reused before being looked up again.
+            max_workers: maximum number of concurrent retrievals issued by `retrieve_batch`.
+        """
         self.cache_dir = cache_dir
         self.index_name = index_name
         self.predibase_client = predibase_client
         self.model_name = model_name
+        self.index_ttl = index_ttl
+        self.max_workers = max_workers
+
+        self._index_handle = None
+        self._index_resolved_at = None
+        self._index_lock = threading.Lock()
+
+    def get_index(self, refresh: bool = False):
+        """Return the dataset handle of the index, looking it up at most once every `index_ttl` seconds.
+
+        Args:
+            refresh: look the handle up even if the cached one hasn't expired.
+        """
+        with self._index_lock:
+            now = monotonic()
+            if refresh or self._index_handle is None or now - self._index_resolved_at > self.index_ttl:
+                self._index_handle = self.predibase_client.get_dataset(
+                    self.index_name, connection_name=PREDIBASE_INDEX_CONNECTION_NAME
+                )
+                self._index_resolved_at = now
+            return self._index_handle
+
+    def invalidate_index(self):
+        """Drop the cached index handle, so that the next call looks it up again."""
+        with self._index_lock:
+            self._index_handle = None
+            self._index_resolved_at = None
 
     def index(self, df_to_index: pd.DataFrame):
         try:
-            index = self.predibase_client.get_dataset(self.index_name, connection_name="file_uploads")
+            index = self.get_index()
         except Exception:
-            self.predibase_client.create_dataset_from_df(df_to_index, name=self.index_name)
-            index = self.predibase_client.get_dataset(self.index_name, connection_name="file_uploads")
+            index = self.predibase_client.create_dataset_from_df(df_to_index, name=self.index_name)
+            if index is None:
+                index = self.get_index(refresh=True)
+            else:
+                with self._index_lock:
+                    self._index_handle, self._index_resolved_at = index, monotonic()
 
         self.predibase_client.prompt("", self.model_name, index=index)
 
     def load_index(self):
         pass
 
+    def unload_index(self):
+        self.invalidate_index()
+
+    def memory_usage(self) -> int:
+        return 0
+
     def retrieve(self, query: str, k: int):
-        index = self.predibase_client.get_dataset(self.index_name, connection_name="file_uploads")
+        index = self.get_index()
         return self.predibase_client.prompt(query, self.model_name, options={"retrieve_top_k": k}, index=index)
 
+    def retrieve_batch(self, queries: List[str], k: int) -> List[pd.DataFrame]:
+        """Retrieve the topk chunks for several queries, resolving the index once and querying it concurrently.
+
+        Args:
+            queries: queries to use for retrieval.
+            k: number of chunks to retrieve per query.
+
+        Returns:
+            List of retrieved documents, in the same order as `queries`.
+        """
+        index = self.get_index()
+        options = {"retrieve_top_k": k}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(self.predibase_client.prompt, query, self.model_name, options=options, index=index)
+                for query in queries
+            ]
+            return [future.result() for future in futures]
+
+
+class EmbeddingIndex:
+    def __init__(self, dtype: str = "float32", rescore: bool = False, rescore_factor: int = 4):
+        """Exact (brute-force) cosine similarity index over embeddings, stored in full or reduced precision.
+
+        Args:
+            dtype: storage type of the searched embeddings. "int8" quarters memory, with one float32 scale per
+                vector, and is searched about as fast as "float32". "float16" only halves memory: numpy has no fast
+                half precision kernels, so it is searched several times slower than "float32".
+            rescore: keep the float32 embeddings (memory-mapped once saved) and rescore the top
+                `k * rescore_factor` candidates of the reduced precision search with them.
+            rescore_factor: number of candidates per result to rescore.
+        """
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Invalid embedding dtype `{dtype}`. Must be one of {EMBEDDING_DTYPES}.")
+        self.dtype = dtype
+        self.rescore = rescore and dtype != "float32"
+        self.rescore_factor = rescore_factor
+        self.embeddings: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.full_embeddings: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return 0 if self.embeddings is None else len(self.embeddings)
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes searched per query (the stored embeddings and their scales)."""
+        return sum(array.nbytes for array in (self.embeddings, self.scales) if array is not None)
+
+    def build(self, embeddings: np.ndarray):
+        """Normalize and store the embeddings, one row per indexed item."""
+        embeddings = normalize_rows(embeddings)
+        if self.dtype == "int8":
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.embeddings = np.round(embeddings / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        else:
+            self.embeddings = embeddings.astype(self.dtype)
+        self.full_embeddings = embeddings if self.rescore else None
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Return the (num_queries, num_items) similarity matrix of normalized queries against the stored items."""
+        if self.embeddings.dtype == np.float32:
+            return queries @ self.embeddings.T
+
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        block = np.empty((min(SEARCH_BLOCK_SIZE, len(self)), self.embeddings.shape[1]), dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_SIZE):
+            stored = self.embeddings[start : start + SEARCH_BLOCK_SIZE]
+            converted = block[: len(stored)]
+            np.copyto(converted, stored, casting="unsafe")
+            np.matmul(queries, converted.T, out=scores[:, start : start + len(stored)])
+        if self.scales is not None:
+            scores *= self.scales[None, :]
+        return scores
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the scores and positions of the top k items for each query, best first.
+
+        Args:
+            queries: (num_queries, dim) query embeddings.
+            k: number of items to return per query.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        scores = self.scores(queries)
+
+        k = min(k, len(self))
+        num_candidates = min(len(self), k * self.rescore_factor) if self.rescore else k
+        candidates = np.argpartition(-scores, num_candidates - 1, axis=1)[:, :num_candidates]
+        if self.rescore:
+            candidate_scores = np.einsum("qd,qcd->qc", queries, np.asarray(self.full_embeddings[candidates]))
+        else:
+            candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+
+        order = np.argsort(-candidate_scores, axis=1)[:, :k]
+        return np.take_along_axis(candidate_scores, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "embeddings.npy"), self.embeddings)
+        if self.scales is not None:
+            np.save(os.path.join(path, "scales.npy"), self.scales)
+        if self.full_embeddings is not None:
+            np.save(os.path.join(path, "full_embeddings.npy"), self.full_embeddings)
+        with open(os.path.join(path, "embedding_index.json"), "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "rescore": self.rescore, "rescore_factor": self.rescore_factor}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingIndex":
+        """Load an index saved with `save`.
+
+        The full precision embeddings used for rescoring stay on disk.
+        """
+        with open(os.path.join(path, "embedding_index.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        index = cls(**config)
+        index.embeddings = np.load(os.path.join(path, "embeddings.npy"))
+        if os.path.exists(os.path.join(path, "scales.npy")):
+            index.scales = np.load(os.path.join(path, "scales.npy"))
+        if index.rescore:
+            index.full_embeddings = np.load(os.path.join(path, "full_embeddings.npy"), mmap_mode="r")
+        return index
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class LocalRetriever(Retriever):
+    def __init__(
+        self,
+        index_name: Optional[str] = None,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        embedding_dtype: str = "float32",
+        rescore: bool = False,
+        rescore_factor: int = 4,
+        embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+        batch_size: int = 64,
+    ):
+        """Retriever embedding chunks with sentence-transformers and searching them with an EmbeddingIndex.
+
+        Args:
+            index_name: name under which the index is saved in `cache_dir`.
+            cache_dir: cache directory where the index will be saved.
+            model_name: sentence-transformers model used to embed chunks and queries.
+            embedding_dtype: storage type of the embeddings, one of "float32", "float16" and "int8".
+            rescore: rescore the reduced precision candidates with the full precision embeddings.
+            rescore_factor: number of candidates per result to rescore.
+            embed_fn: (optional) function embedding a list of texts, used instead of `model_name`.
+            batch_size: number of texts embedded at a time.
+        """
+        self.index_name = index_name
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.embedding_dtype = embedding_dtype
+        self.rescore = rescore
+        self.rescore_factor = rescore_factor
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+
+        self.model = None
+        self.embedding_index: Optional[EmbeddingIndex] = None
+        self.indexed_df: Optional[pd.DataFrame] = None
+        # guards loading and unloading the index, see `loaded_index`.
+        self._index_lock = threading.Lock()
+
+    @property
+    def index_dir(self) -> str:
+        return os.path.join(self.cache_dir, self.index_name)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if self.embed_fn is not None:
+            return self.embed_fn(texts)
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self.model = SentenceTransformer(self.model_name)
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+
+    def index(self, df_to_index: pd.DataFrame):
+        print(f"Indexing {len(df_to_index)} chunks.")
+        start_t = perf_counter()
+        embedding_index = EmbeddingIndex(
+            dtype=self.embedding_dtype, rescore=self.rescore, rescore_factor=self.rescore_factor
+        )
+        embedding_index.build(self.embed(df_to_index["chunk_text"].tolist()))
+        indexed_df = df_to_index.reset_index(drop=True)
+        with self._index_lock:
+            self.embedding_index, self.indexed_df = embedding_index, indexed_df
+        end_t = perf_counter()
+        print(f"\nTOOK {end_t - start_t}s to compute embeddings for the index.")
+
+        print(f"Saving index to {self.cache_dir} under name {self.index_name}.")
+        embedding_index.save(self.index_dir)
+        indexed_df.to_parquet(os.path.join(self.index_dir, "chunks.parquet"), index=False)
+
+    def load_index(self):
+        self._load_index()
+
+    def _load_index(self) -> Tuple[EmbeddingIndex, pd.DataFrame]:
+        print(f"Loading index {self.index_name}.")
+        embedding_index = EmbeddingIndex.load(self.index_dir)
+        indexed_df = pd.read_parquet(os.path.join(self.index_dir, "chunks.parquet"))
+        with self._index_lock:
+            self.embedding_index, self.indexed_df = embedding_index, indexed_df
+        return embedding_index, indexed_df
+
+    def unload_index(self):
+        with self._index_lock:
+            self.embedding_index = None
+            self.indexed_df = None
+
+    def loaded_index(self) -> Tuple[EmbeddingIndex, pd.DataFrame]:
+        """Return the embedding index and the indexed chunks, loading them if needed.
+
+        The returned pair stays usable if the index is unloaded concurrently.
+        """
+        with self._index_lock:
+            if self.embedding_index is not None:
+                return self.embedding_index, self.indexed_df
+        try:
+            return self._load_index()
+        except Exception:
+            raise RuntimeError(
+                f"Failed to retrieve the index `{self.index_name}` from `{self.cache_dir}`. Please call `index` first."
+            )
+
+    def memory_usage(self) -> int:
+        """Return the number of bytes held by the loaded embeddings and indexed chunks."""
+        with self._index_lock:
+            if self.embedding_index is None:
+                return 0
+            return self.embedding_index.nbytes + int(self.indexed_df.memory_usage(deep=True).sum())
+
+    def retrieve(self, query: str, k: int) -> pd.DataFrame:
+        return self.retrieve_batch([query], k=k)[0]
+
+    def retrieve_batch(self, queries: List[str], k: int) -> List[pd.DataFrame]:
+        self.loaded_index()
+        return self.retrieve_embeddings(self.embed(queries), k=k)
+
+    def retrieve_embeddings(self, query_embeddings: np.ndarray, k: int) -> List[pd.DataFrame]:
+        """Retrieve the topk chunks for already embedded queries, loading the index if needed.
+
+        Returns:
+            List of retrieved documents with a `score` column, best first, one per query.
+        """
+        embedding_index, indexed_df = self.loaded_index()
+        scores, positions = embedding_index.search(query_embeddings, k=k)
+        return [
+            indexed_df.iloc[query_positions].assign(score=query_scores)
+            for query_scores, query_positions in zip(scores, positions)
+        ]
+
 
 def get_retriever(retrieval_provider, **kwargs):
     if retrieval_provider == "predibase":
         return PredibaseRetriever(**kwargs)
     elif retrieval_provider == "ludwig":
         return LudwigRetriever(**kwargs)
+    elif retrieval_provider == "local":
+        return LocalRetriever(**kwargs)
+    elif retrieval_provider == "sharded":
+        from info_extract.sharding import ShardedRetriever
+
+        return ShardedRetriever(**kwargs)
+    else:
+        raise ValueError("Invalid retrieval provider")
@@ -0,0 +1,161 @@
+import concurrent.futures
+import contextvars
+import math
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, Optional
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+DEFAULT_WEIGHTS = {INTERACTIVE: 4.0, BATCH: 1.0}
+DEFAULT_RESERVED_SHARES = {INTERACTIVE: 0.25}
+
+_current_request_class = contextvars.ContextVar("request_class", default=INTERACTIVE)
+
+
+def current_request_class() -> str:
+    """Return the request class of the calling context.
+
+    Defaults to "interactive".
+    """
+    return _current_request_class.get()
+
+
+@contextmanager
+def request_class(name: str):
+    """Tag the LLM calls made in this context (and in tasks submitted with `submit_in_context`) with a class.
+
+    Args:
+        name: request class, e.g. "interactive" or "batch".
+    """
+    token = _current_request_class.set(name)
+    try:
+        yield
+    finally:
+        _current_request_class.reset(token)
+
+
+def submit_in_context(executor: concurrent.futures.Executor, fn, *args, **kwargs) -> concurrent.futures.Future:
+    """Submit `fn` to an executor so that it runs in a copy of the caller's context (e.g. its request class)."""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
+
+
+class _Ticket:
+    __slots__ = ("request_class", "tag", "enqueued_at")
+
+    def __init__(self, request_class: str, tag: float, enqueued_at: float):
+        self.request_class = request_class
+        self.tag = tag
+        self.enqueued_at = enqueued_at
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        weights: Optional[Dict[str, float]] = None,
+        reserved_shares: Optional[Dict[str, float]] = None,
+    ):
+        """Priority-aware admission of requests to a shared deployment.
+
+        Requests wait in one FIFO queue per class and are admitted by weighted fair queuing: every request gets a
+        virtual finish tag that grows by 1 / weight of its class, and the eligible request with the lowest tag goes
+        first. A class with a reserved share always has that share of the slots available to it; the other classes
+        can't take those slots even when they are idle.
+
+        Args:
+            max_concurrency: maximum number of requests running at once.
+            weights: relative share of admissions per class under contention. Defaults to interactive: 4, batch: 1.
+            reserved_shares: fraction of `max_concurrency` reserved per class, rounded down to whole slots. Defaults to
+                interactive: 0.25. The reserved slots must leave at least one slot to the other classes.
+        """
+        self.max_concurrency = max_concurrency
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        reserved_shares = DEFAULT_RESERVED_SHARES if reserved_shares is None else reserved_shares
+        # rounded down, so that a small `max_concurrency` doesn't end up entirely reserved.
+        self.reserved_slots = {name: math.floor(share * max_concurrency) for name, share in reserved_shares.items()}
+        if sum(self.reserved_slots.values()) >= max_concurrency:
+            # the unreserved classes (e.g. batch) could never be admitted.
+            raise ValueError("The reserved shares leave no slot of `max_concurrency` for the unreserved classes.")
+
+        self._condition = threading.Condition()
+        self._queues: Dict[str, deque] = {}
+        self._last_tags: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._running = Counter()
+        self._admitted = Counter()
+        self._total_wait = Counter()
+        self._max_wait = Counter()
+
+    def _can_admit(self, name: str) -> bool:
+        free_slots = self.max_concurrency - sum(self._running.values())
+        # slots other classes are guaranteed and aren't using.
+        held_back = sum(
+            max(0, reserved - self._running[other]) for other, reserved in self.reserved_slots.items() if other != name
+        )
+        return free_slots - held_back >= 1
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        candidates = [queue[0] for name, queue in self._queues.items() if len(queue) > 0 and self._can_admit(name)]
+        return min(candidates, key=lambda ticket: ticket.tag, default=None)
+
+    def acquire(self, name: str) -> float:
+        """Wait until a request of class `name` may run and take a slot for it.
+
+        Returns:
+            Number of seconds the request waited.
+        """
+        with self._condition:
+            tag = max(self._virtual_time, self._last_tags.get(name, 0.0)) + 1.0 / self.weights.get(name, 1.0)
+            self._last_tags[name] = tag
+            ticket = _Ticket(name, tag, monotonic())
+            queue = self._queues.setdefault(name, deque())
+            queue.append(ticket)
+
+            while self._next_ticket() is not ticket:
+                self._condition.wait()
+
+            queue.popleft()
+            self._virtual_time = max(self._virtual_time, ticket.tag)
+            self._running[name] += 1
+            wait = monotonic() - ticket.enqueued_at
+            self._admitted[name] += 1
+            self._total_wait[name] += wait
+            self._max_wait[name] = max(self._max_wait[name], wait)
+            # the next ticket may be admissible as well.
+            self._condition.notify_all()
+            return wait
+
+    def release(self, name: str):
+        with self._condition:
+            self._running[name] -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, name: str):
+        """Hold a slot for a request of class `name` for the duration of the context."""
+        self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Return, per request class, the queue depth, running and admitted requests, and mean/max wait in
+        seconds."""
+        with self._condition:
+            names = set(self.weights) | set(self._queues) | set(self._admitted)
+            return {
+                name: {
+                    "queue_depth": len(self._queues.get(name, ())),
+                    "running": self._running[name],
+                    "admitted": self._admitted[name],
+                    "mean_wait": self._total_wait[name] / self._admitted[name] if self._admitted[name] else 0.0,
+                    "max_wait": self._max_wait[name],
+                }
+                for name in names
+            }
@@ -0,0 +1,366 @@
+"""Async HTTP service answering queries from the corpus snapshots of a CorpusRegistry directory.
+
+Every worker process holds one CorpusRegistry, one LLM endpoint behind one RequestScheduler, and one bounded thread
+pool running the blocking corpus calls. Several worker processes can share one port (SO_REUSEPORT), in which case the
+kernel balances incoming connections across them.
+
+Usage:
+    PREDIBASE_API_TOKEN=... python -m info_extract.server --port 8080 --workers 4
+
+Routes:
+    GET  /corpora                      registry and index status of every corpus.
+    GET  /corpora/{key}                registry and index status of one corpus.
+    GET  /stats                        scheduler and executor statistics of the worker process.
+    POST /corpora/{key}/query          {"query": str, "topk": int, "timeout": float, ...} -> RAGResult.
+    POST /corpora/{key}/query_batch    {"queries": [str], "topk": int, ...} -> [RAGResult].
+    POST /corpora/{key}/extract        {"queries": [str]} -> per-document extractions.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import json
+import multiprocessing
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+
+from info_extract.endpoints import get_llm_endpoint
+from info_extract.info_extract import SNAPSHOT_METADATA_FILE
+from info_extract.registry import CorpusRegistry, DEFAULT_REGISTRY_DIR
+from info_extract.retrieval import get_retriever
+from info_extract.scheduler import RequestScheduler
+
+if TYPE_CHECKING:
+    from predibase import PredibaseClient
+
+# query options accepted in request bodies, with their accepted JSON types.
+QUERY_OPTIONS = {
+    "topk": (int,),
+    "use_answer_index": (bool,),
+    "min_answer_score": (int, float),
+    "timeout": (int, float, type(None)),
+    "early_exit_answers": (int, type(None)),
+    "max_parallel": (int, type(None)),
+}
+
+
+@dataclass
+class ServerConfig:
+    """Dataclass to hold the configuration of a worker process.
+
+    It is pickled to spawn the workers.
+    """
+
+    host: str = "0.0.0.0"
+    port: int = 8080
+    workers: int = 1
+    registry_dir: str = DEFAULT_REGISTRY_DIR
+    max_bytes: int = 4 * 1024**3
+    model_name: str = "llama-2-13b"
+    retrieval_provider: str = "predibase"
+    # maximum number of LLM requests in flight per worker process.
+    max_concurrency: int = 16
+    # threads running the blocking corpus calls, and requests admitted beyond them before answering 503.
+    max_threads: int = 32
+    max_pending: int = 256
+    # threads running the retrieval and LLM calls of every request. Calls beyond `max_concurrency` wait in the
+    # scheduler, in request class order, so the pool should be well above it.
+    max_call_threads: int = 256
+
+
+class ServiceOverloaded(Exception):
+    pass
+
+
+class CorpusNotFound(KeyError):
+    pass
+
+
+class CorpusService:
+    def __init__(self, config: ServerConfig, predibase_client: Optional["PredibaseClient"] = None):
+        """State shared by every request of a worker process.
+
+        Args:
+            config: worker configuration.
+            predibase_client: (optional) client used by the LLM endpoint and the Predibase retrievers. Defaults to a
+                PredibaseClient authenticated with PREDIBASE_API_TOKEN.
+        """
+        if predibase_client is None:
+            from predibase import PredibaseClient
+
+            predibase_client = PredibaseClient(token=os.environ.get("PREDIBASE_API_TOKEN"))
+
+        self.config = config
+        self.predibase_client = predibase_client
+
+        self.scheduler = RequestScheduler(max_concurrency=config.max_concurrency)
+        self.llm_endpoint = get_llm_endpoint(
+            model_provider="predibase",
+            scheduler=self.scheduler,
+            predibase_client=self.predibase_client,
+            model_name=config.model_name,
+        )
+        self.registry = CorpusRegistry(max_bytes=config.max_bytes, cache_dir=config.registry_dir)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.max_threads)
+        # shared by the corpus calls for their retrieval and LLM calls. Kept separate from `executor`, whose threads
+        # wait on these calls.
+        self.call_executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.max_call_threads)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def snapshot_metadata(self, key: str) -> Dict[str, Any]:
+        with open(os.path.join(self.registry.snapshot_path(key), SNAPSHOT_METADATA_FILE), encoding="utf-8") as f:
+            return json.load(f)
+
+    def register_snapshots(self):
+        """Register every corpus snapshot saved in the registry directory, under its directory name."""
+        if not os.path.isdir(self.config.registry_dir):
+            return
+        for key in sorted(os.listdir(self.config.registry_dir)):
+            if key in self.registry or not self.registry.has_snapshot(key):
+                continue
+            retriever_kwargs = {"index_name": self.snapshot_metadata(key)["index"]["index_name"]}
+            if self.config.retrieval_provider == "predibase":
+                retriever_kwargs.update(predibase_client=self.predibase_client, model_name=self.config.model_name)
+            retriever = get_retriever(retrieval_provider=self.config.retrieval_provider, **retriever_kwargs)
+            self.registry.register(key, llm_endpoint=self.llm_endpoint, retriever=retriever)
+            print(f"Registered corpus `{key}`.")
+
+    def status(self, key: str) -> Dict[str, Any]:
+        """Return the registry status of a corpus and the index status of its snapshot.
+
+        Raises CorpusNotFound if no corpus is registered under `key`, or if it wasn't saved yet.
+        """
+        if key not in self.registry:
+            raise CorpusNotFound(f"No corpus registered under `{key}`.")
+        status = dict(self.registry.stats()[key])
+        try:
+            metadata = self.snapshot_metadata(key)
+        except FileNotFoundError:
+            # registered in memory, and not saved yet.
+            raise CorpusNotFound(f"No snapshot saved for the corpus `{key}`.")
+        status.update(
+            name=metadata["name"],
+            chunk_size=metadata["chunk_size"],
+            is_indexed=metadata["index"]["is_indexed"],
+            has_answer_index=metadata["index"].get("has_answer_index", False),
+        )
+        return status
+
+    @contextmanager
+    def admit(self, num_calls: int = 1):
+        """Reserve room for `num_calls` blocking calls.
+
+        Raises ServiceOverloaded when too many calls are pending.
+        """
+        with self._pending_lock:
+            if self._pending + num_calls > self.config.max_threads + self.config.max_pending:
+                raise ServiceOverloaded()
+            self._pending += num_calls
+        try:
+            yield
+        finally:
+            with self._pending_lock:
+                self._pending -= num_calls
+
+    def run(self, fn, *args, **kwargs) -> asyncio.Future:
+        """Run a blocking call in the worker thread pool, from the event loop."""
+        return asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def query(self, key: str, query: str, **options) -> Dict[str, Any]:
+        with self.registry.using(key) as corpus:
+            return rag_result_to_dict(corpus.query(query, executor=self.call_executor, **options))
+
+    def query_batch(self, key: str, queries: List[str], **options) -> List[Dict[str, Any]]:
+        with self.registry.using(key) as corpus:
+            results = corpus.query_batch(queries, executor=self.call_executor, **options)
+        return [rag_result_to_dict(result) for result in results]
+
+    def extract(self, key: str, queries: List[str]) -> List[Dict[str, Any]]:
+        with self.registry.using(key) as corpus:
+            extractions = corpus.extract(queries, executor=self.call_executor).extractions
+        return json.loads(extractions.to_json(orient="records"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pid": os.getpid(), "pending": self._pending, "scheduler": self.scheduler.stats()}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.call_executor.shutdown(wait=False)
+
+
+def rag_result_to_dict(result) -> Dict[str, Any]:
+    return {
+        "answer": result.answer,
+        "is_partial": result.is_partial,
+        "chunk_answers": [
+            {
+                "document_id": int(chunk_answer.document_id),
+                "chunk_id": int(chunk_answer.chunk_id),
+                "chunk_text": str(chunk_answer.chunk_text),
+                "query": chunk_answer.query,
+                "answer": chunk_answer.answer,
+                "is_correct": bool(chunk_answer.is_correct),
+            }
+            for chunk_answer in result.chunk_answers
+        ],
+    }
+
+
+def create_app(service: CorpusService):
+    """Create the aiohttp application serving `service`."""
+    from aiohttp import web
+
+    async def read_json(request) -> Dict[str, Any]:
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise ValueError("The request body must be a JSON object.")
+        if not isinstance(body, dict):
+            raise ValueError("The request body must be a JSON object.")
+        return body
+
+    def corpus_key(request) -> str:
+        key = request.match_info["key"]
+        if key not in service.registry:
+            raise CorpusNotFound(f"No corpus registered under `{key}`.")
+        return key
+
+    def query_options(body: Dict[str, Any]) -> Dict[str, Any]:
+        options = {name: body[name] for name in QUERY_OPTIONS if name in body}
+        for name, value in options.items():
+            types = QUERY_OPTIONS[name]
+            # JSON booleans are ints in Python.
+            if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+                expected = " or ".join({type(None): "null"}.get(type_, type_.__name__) for type_ in types)
+                raise ValueError(f"`{name}` must be {expected}.")
+        return options
+
+    @web.middleware
+    async def errors(request, handler):
+        try:
+            return await handler(request)
+        except ValueError as exc:
+            return web.json_response({"error": str(exc)}, status=400)
+        except CorpusNotFound as exc:
+            return web.json_response({"error": exc.args[0]}, status=404)
+        except ServiceOverloaded:
+            return web.json_response({"error": "Too many pending requests."}, status=503)
+
+    async def list_corpora(request):
+        corpora = {}
+        for key, stats in service.registry.stats().items():
+            try:
+                corpora[key] = service.status(key)
+            except CorpusNotFound:
+                # not saved yet, or unregistered in the meantime.
+                corpora[key] = stats
+        return web.json_response(corpora)
+
+    async def corpus_status(request):
+        return web.json_response(service.status(corpus_key(request)))
+
+    async def stats(request):
+        return web.json_response(service.stats())
+
+    async def query(request):
+        body = await read_json(request)
+        if not isinstance(body.get("query"), str):
+            raise ValueError("`query` must be a string.")
+        with service.admit():
+            result = await service.run(service.query, corpus_key(request), body["query"], **query_options(body))
+        return web.json_response(result)
+
+    async def query_batch(request):
+        body = await read_json(request)
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError("`queries` must be a list of strings.")
+        key, options = corpus_key(request), query_options(body)
+        # the batch is admitted as a whole, so that it is either served completely or rejected upfront.
+        with service.admit(len(queries)):
+            result = await service.run(service.query_batch, key, queries, **options)
+        return web.json_response(result)
+
+    async def extract(request):
+        body = await read_json(request)
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError("`queries` must be a list of strings.")
+        with service.admit():
+            result = await service.run(service.extract, corpus_key(request), queries)
+        return web.json_response(result)
+
+    async def on_cleanup(app):
+        service.close()
+
+    app = web.Application(middlewares=[errors])
+    app.add_routes(
+        [
+            web.get("/corpora", list_corpora),
+            web.get("/corpora/{key}", corpus_status),
+            web.get("/stats", stats),
+            web.post("/corpora/{key}/query", query),
+            web.post("/corpora/{key}/query_batch", query_batch),
+            web.post("/corpora/{key}/extract", extract),
+        ]
+    )
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def run_worker(config: ServerConfig):
+    """Serve on `config.host:config.port` until interrupted.
+
+    Binds with SO_REUSEPORT when there are several workers.
+    """
+    from aiohttp import web
+
+    service = CorpusService(config)
+    service.register_snapshots()
+    print(f"Worker {os.getpid()} serving {len(service.registry.stats())} corpora on {config.host}:{config.port}.")
+    web.run_app(create_app(service), host=config.host, port=config.port, reuse_port=config.workers > 1, print=None)
+
+
+def serve(config: ServerConfig):
+    """Start `config.workers` worker processes behind one port, or serve in this process if there is one worker."""
+    if config.workers == 1:
+        run_worker(config)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(config,)) for _ in range(config.workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+
+def main(args: Optional[List[str]] = None):
+    defaults = ServerConfig()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=defaults.host)
+    parser.add_argument("--port", type=int, default=defaults.port)
+    parser.add_argument("--workers", type=int, default=defaults.workers, help="number of worker processes")
+    parser.add_argument("--registry-dir", default=defaults.registry_dir, help="directory of the corpus snapshots")
+    parser.add_argument("--max-bytes", type=int, default=defaults.max_bytes, help="in-memory corpora per worker")
+    parser.add_argument("--model-name", default=defaults.model_name)
+    parser.add_argument("--retrieval-provider", default=defaults.retrieval_provider)
+    parser.add_argument("--max-concurrency", type=int, default=defaults.max_concurrency)
+    parser.add_argument("--max-threads", type=int, default=defaults.max_threads)
+    parser.add_argument("--max-pending", type=int, default=defaults.max_pending)
+    parser.add_argument("--max-call-threads", type=int, default=defaults.max_call_threads)
+    parsed = parser.parse_args(args)
+    serve(ServerConfig(**{name.replace("-", "_"): value for name, value in vars(parsed).items()}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import concurrent.futures
+import itertools
+import multiprocessing
+import threading
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from info_extract.defaults import DEFAULT_CACHE_DIR
+from info_extract.retrieval import LocalRetriever, Retriever
+
+
+def _run_shard_command(retriever: LocalRetriever, command: str, payload: Any) -> Any:
+    if command == "index":
+        retriever.index(payload)
+    elif command == "load_index":
+        retriever.load_index()
+    elif command == "unload_index":
+        retriever.unload_index()
+    elif command == "memory_usage":
+        return retriever.memory_usage()
+    elif command == "search":
+        query_embeddings, k = payload
+        return retriever.retrieve_embeddings(query_embeddings, k=k)
+    else:
+        raise ValueError(f"Invalid shard command `{command}`.")
+
+
+def _shard_worker(connection, retriever_kwargs: Dict[str, Any], max_threads: int):
+    """Serve commands for one index shard until "stop" is received.
+
+    Requests are (request_id, command, payload) tuples and are run concurrently on `max_threads` threads. Each reply is
+    a (request_id, status, result) tuple, so replies may be sent in any order.
+    """
+    retriever = LocalRetriever(**retriever_kwargs)
+    send_lock = threading.Lock()
+
+    def run(request_id: int, command: str, payload: Any):
+        try:
+            reply = (request_id, "ok", _run_shard_command(retriever, command, payload))
+        except Exception as exc:
+            reply = (request_id, "error", repr(exc))
+        with send_lock:
+            connection.send(reply)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
+        while True:
+            request_id, command, payload = connection.recv()
+            if command == "stop":
+                break
+            executor.submit(run, request_id, command, payload)
+    with send_lock:
+        connection.send((request_id, "ok", None))
+
+
+class _Shard:
+    def __init__(self, worker, connection):
+        """Parent side of a shard worker.
+
+        Requests are sent under `send_lock`, and a reader thread resolves the future of each request when its reply
+        arrives.
+        """
+        self.worker = worker
+        self.connection = connection
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, concurrent.futures.Future] = {}
+        self.pending_lock = threading.Lock()
+        self.reader = threading.Thread(target=self.read_replies, daemon=True)
+        self.reader.start()
+
+    def request(self, request_id: int, command: str, payload: Any) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self.pending_lock:
+            self.pending[request_id] = future
+        try:
+            with self.send_lock:
+                self.connection.send((request_id, command, payload))
+        except Exception as exc:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            future.set_exception(exc)
+        return future
+
+    def read_replies(self):
+        while True:
+            try:
+                request_id, status, result = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            with self.pending_lock:
+                future = self.pending.pop(request_id, None)
+            if future is not None:
+                future.set_result((status, result))
+
+        # the worker exited: fail the requests still waiting for a reply.
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError("The shard worker exited."))
+
+
+class ShardedRetriever(Retriever):
+    def __init__(
+        self,
+        index_name: Optional[str] = None,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        num_shards: int = 4,
+        start_method: str = "spawn",
+        max_threads_per_shard: int = 4,
+        **retriever_kwargs,
+    ):
+        """Retriever partitioning the chunk table across worker processes, each holding a LocalRetriever.
+
+        Shards are built in parallel, and every query is searched on all shards in parallel before the per-shard top k
+        are merged.
+
+        Queries are embedded once, in the calling process, and only their embeddings are sent to the shards. Queries
+        from several threads are in flight together: each request carries an id, and replies are matched to their
+        request as they arrive.
+
+        Args:
+            index_name: name of the index. Shard i is saved in `cache_dir` as f"{index_name}-shard{i}-of{num_shards}".
+            cache_dir: cache directory where the shards will be saved.
+            num_shards: number of shards, i.e. of worker processes.
+            start_method: multiprocessing start method of the workers.
+            max_threads_per_shard: number of requests each shard worker runs concurrently.
+            retriever_kwargs: arguments of the LocalRetriever of each shard (e.g. `model_name`, `embedding_dtype`).
+                An `embed_fn` must be picklable, i.e. a module-level function.
+        """
+        self.index_name = index_name
+        self.cache_dir = cache_dir
+        self.num_shards = num_shards
+        self.start_method = start_method
+        self.max_threads_per_shard = max_threads_per_shard
+        self.retriever_kwargs = retriever_kwargs
+
+        # embeds the queries in this process. Its own index is never built.
+        self.query_embedder = LocalRetriever(index_name=index_name, cache_dir=cache_dir, **retriever_kwargs)
+        self.shards: List[_Shard] = []
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self) -> List[_Shard]:
+        """Start the shard worker processes, if they aren't running, and return their shards."""
+        with self._lock:
+            if len(self.shards) > 0:
+                return self.shards
+            context = multiprocessing.get_context(self.start_method)
+            for shard in range(self.num_shards):
+                parent_connection, child_connection = context.Pipe()
+                retriever_kwargs = {
+                    **self.retriever_kwargs,
+                    "index_name": f"{self.index_name}-shard{shard}-of{self.num_shards}",
+                    "cache_dir": self.cache_dir,
+                }
+                worker = context.Process(
+                    target=_shard_worker,
+                    args=(child_connection, retriever_kwargs, self.max_threads_per_shard),
+                    daemon=True,
+                )
+                worker.start()
+                self.shards.append(_Shard(worker, parent_connection))
+            return self.shards
+
+    def close(self):
+        """Stop the shard worker processes, once the requests in flight are answered."""
+        with self._lock:
+            shards, self.shards = self.shards, []
+        futures = [shard.request(next(self._request_ids), "stop", None) for shard in shards]
+        concurrent.futures.wait(futures)
+        for shard in shards:
+            shard.worker.join()
+            shard.reader.join()
+            shard.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _scatter_gather(self, command: str, payloads: List[Any]) -> List[Any]:
+        shards = self.start()
+        futures = [shard.request(next(self._request_ids), command, payload) for shard, payload in zip(shards, payloads)]
+        replies = [future.result() for future in futures]
+
+        errors = [(shard, result) for shard, (status, result) in enumerate(replies) if status == "error"]
+        if len(errors) > 0:
+            raise RuntimeError(f"Shard command `{command}` failed: {errors}")
+        return [result for _, result in replies]
+
+    def index(self, df_to_index: pd.DataFrame):
+        print(f"Indexing {len(df_to_index)} chunks across {self.num_shards} shards.")
+        shards = [df_to_index.iloc[shard :: self.num_shards] for shard in range(self.num_shards)]
+        self._scatter_gather("index", shards)
+
+    def load_index(self):
+        self._scatter_gather("load_index", [None] * self.num_shards)
+
+    def unload_index(self):
+        if len(self.shards) > 0:
+            self._scatter_gather("unload_index", [None] * self.num_shards)
+
+    def memory_usage(self) -> int:
+        """Return the number of bytes held by the indices loaded in the shard processes."""
+        if len(self.shards) == 0:
+            return 0
+        return sum(self._scatter_gather("memory_usage", [None] * self.num_shards))
+
+    def retrieve(self, query: str, k: int) -> pd.DataFrame:
+        return self.retrieve_batch([query], k=k)[0]
+
+    def retrieve_batch(self, queries: List[str], k: int) -> List[pd.DataFrame]:
+        query_embeddings = self.query_embedder.embed(queries)
+        shard_results = self._scatter_gather("search", [(query_embeddings, k)] * self.num_shards)
+        return [
+            pd.concat([results[i] for results in shard_results])
+            .sort_values("score", ascending=False)
+            .head(k)
+            .reset_index(drop=True)
+            for i in range(len(queries))
+        ]
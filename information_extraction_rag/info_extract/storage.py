@@ -0,0 +1,135 @@
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+WORD_PATTERN = re.compile(rb"\S+")
+
+
+class TextSpan:
+    """Reference to a slice of a document's UTF-8 text.
+
+    The slice is a memoryview over the document buffer, so no text is copied until the span is converted to a string
+    (e.g. when a prompt is formatted or the chunk is displayed).
+    """
+
+    __slots__ = ("buffer", "start", "end")
+
+    def __init__(self, buffer: memoryview, start: int, end: int):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    def __str__(self) -> str:
+        return str(self.buffer[self.start : self.end], "utf-8")
+
+    def __format__(self, format_spec: str) -> str:
+        return format(str(self), format_spec)
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        return f"TextSpan(start={self.start}, end={self.end})"
+
+
+class DocumentTextStore:
+    def __init__(self, text: pa.ChunkedArray):
+        """Holds the UTF-8 text of every document, which chunks reference through (start, end) byte offsets.
+
+        Args:
+            text: Arrow string array of the document text. Documents are added as views of its data buffers.
+        """
+        self.text = text
+        self.buffers: Dict[int, memoryview] = {}
+
+    @classmethod
+    def from_documents(cls, documents: pd.DataFrame) -> "DocumentTextStore":
+        """Create a store from a dataframe with the following schema: (document_id, document_name, document_text).
+
+        An Arrow-backed `document_text` column is referenced without copying. Other columns (e.g. of Python strings) are
+        encoded once, and should be replaced by `document_texts` so that the text isn't held twice.
+        """
+        series = documents["document_text"]
+        if hasattr(series.array, "__arrow_array__"):
+            text = pa.chunked_array(series.array.__arrow_array__())
+        else:
+            text = pa.chunked_array([pa.array(series, from_pandas=True)])
+        if text.type not in (pa.string(), pa.large_string()):
+            text = text.cast(pa.large_string())
+
+        store = cls(text)
+        document_ids = iter(documents["document_id"].tolist())
+        for array in text.chunks:
+            offset_dtype = np.int32 if array.type == pa.string() else np.int64
+            offsets = np.frombuffer(array.buffers()[1], dtype=offset_dtype)
+            offsets = offsets[array.offset : array.offset + len(array) + 1]
+            data = memoryview(array.buffers()[2] or b"").cast("B")
+            for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+                store.buffers[next(document_ids)] = data[start:end]
+        return store
+
+    def document_texts(self, index: pd.Index) -> pd.Series:
+        """Return the document text as an Arrow-backed series over the buffers of the store."""
+        return pd.Series(pd.arrays.ArrowExtensionArray(self.text), index=index)
+
+    def buffer(self, document_id: int) -> memoryview:
+        return self.buffers[document_id]
+
+    def span(self, document_id: int, start: int, end: int) -> TextSpan:
+        return TextSpan(self.buffers[document_id], start, end)
+
+
+def chunk_spans(data: memoryview, chunk_size: int = 2048, overlap: bool = False) -> List[Tuple[int, int]]:
+    """Create (start, end) byte offsets of chunks out of UTF-8 encoded text.
+
+    Words are packed greedily like `textwrap.wrap`, but the original whitespace between words is kept so that every
+    chunk is a plain slice of `data`. Words longer than `chunk_size` are split on character boundaries.
+
+    Args:
+        data: UTF-8 encoded text to be chunked.
+        chunk_size: an upper bound on the number of bytes per chunk.
+        overlap: also create chunks straddling the boundaries of the first ones, like `chunk_text`: half-size chunks
+            are packed and consecutive pairs of them, shifted by one, are merged.
+    """
+    spans = _packed_spans(data, chunk_size)
+    if overlap:
+        half_spans = _packed_spans(data, chunk_size // 2)
+        if len(half_spans) > 0:
+            spans.append(half_spans[0])
+            for i in range(1, len(half_spans) - 1, 2):
+                spans.append((half_spans[i][0], half_spans[i + 1][1]))
+            if len(half_spans) > 1:
+                spans.append(half_spans[-1])
+    return spans
+
+
+def _packed_spans(data: memoryview, chunk_size: int) -> List[Tuple[int, int]]:
+    spans = []
+    start, end = None, None
+    for match in WORD_PATTERN.finditer(data):
+        word_start, word_end = match.span()
+        if start is not None and word_end - start <= chunk_size:
+            end = word_end
+            continue
+        if start is not None:
+            spans.append((start, end))
+
+        while word_end - word_start > chunk_size:
+            cut = word_start + chunk_size
+            # step back to the first byte of a UTF-8 character.
+            while cut > word_start and data[cut] & 0xC0 == 0x80:
+                cut -= 1
+            if cut == word_start:
+                cut = word_start + chunk_size
+                while cut < word_end and data[cut] & 0xC0 == 0x80:
+                    cut += 1
+            spans.append((word_start, cut))
+            word_start = cut
+        start, end = word_start, word_end
+
+    if start is not None:
+        spans.append((start, end))
+    return spans
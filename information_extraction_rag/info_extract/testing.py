@@ -0,0 +1,56 @@
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+
+
+class FakePredibaseClient:
+    def __init__(self, respond: Optional[Callable[[str], str]] = None):
+        """In-memory stand-in for PredibaseClient, implementing the methods used by PredibaseRetriever and
+        PredibaseLLMEndpoint.
+
+        Datasets are dataframes with a `chunk_text` column, and prompting with `retrieve_top_k` returns the rows sharing
+        the most words with the prompt. Prompting without an index returns the response of `respond`, UNDEFINED by
+        default. Calls are counted per method in `calls`.
+
+        Args:
+            respond: (optional) function returning the LLM response to a prompt.
+        """
+        self.respond = respond or (lambda text: "UNDEFINED")
+        self.datasets: Dict[str, pd.DataFrame] = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+
+    def get_dataset(self, name: str, connection_name: Optional[str] = None) -> str:
+        self._count("get_dataset")
+        if name not in self.datasets:
+            raise KeyError(f"No dataset named `{name}`.")
+        return name
+
+    def create_dataset_from_df(self, df: pd.DataFrame, name: str) -> str:
+        self._count("create_dataset_from_df")
+        self.datasets[name] = df.reset_index(drop=True)
+        return name
+
+    def prompt(
+        self,
+        text: str,
+        model_name: str,
+        options: Optional[Dict[str, Any]] = None,
+        index: Optional[str] = None,
+    ) -> Optional[pd.DataFrame]:
+        self._count("prompt")
+        if index is None:
+            return pd.DataFrame({"response": [self.respond(text)]})
+        if not text:
+            return None
+        df = self.datasets[index]
+        words = set(text.lower().split())
+        scores = [len(words & set(str(chunk_text).lower().split())) for chunk_text in df["chunk_text"]]
+        k = (options or {}).get("retrieve_top_k", 10)
+        return df.assign(score=scores).sort_values("score", ascending=False, kind="stable").head(k)
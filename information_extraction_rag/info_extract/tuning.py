@@ -0,0 +1,234 @@
+import hashlib
+import tempfile
+import threading
+from dataclasses import asdict, dataclass
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from info_extract.endpoints import CachingLLMEndpoint, CallCounter, LLMEndpoint
+from info_extract.info_extract import Corpus, normalize_answer
+from info_extract.retrieval import DEFAULT_EMBEDDING_MODEL, LocalRetriever
+
+TOKEN_ENCODING = "cl100k_base"
+
+
+def get_token_counter() -> Callable[[str], int]:
+    """Return a function counting the tokens of a text with tiktoken, or approximating them as characters / 4 if
+    tiktoken or its encoding isn't available."""
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception as exc:
+        print(f"Approximating token counts as characters / 4, tiktoken is unavailable: {exc}")
+        return lambda text: (len(text) + 3) // 4
+
+
+class TokenCountingLLMEndpoint(LLMEndpoint):
+    def __init__(self, llm_endpoint: LLMEndpoint, counter: CallCounter, count_tokens: Callable[[str], int]):
+        """Wraps an endpoint and counts its prompt and completion tokens in `counter`."""
+        super().__init__(llm_endpoint=llm_endpoint, counter=counter, count_tokens=count_tokens)
+        self.llm_endpoint = llm_endpoint
+        self.counter = counter
+        self.count_tokens = count_tokens
+
+    def hit(self, input_text):
+        response = self.llm_endpoint.hit(input_text)
+        self.counter.increment("prompt_tokens", self.count_tokens(input_text))
+        self.counter.increment("completion_tokens", self.count_tokens(response or ""))
+        return response
+
+
+class EmbeddingCache:
+    def __init__(self, embed_fn: Callable[[List[str]], np.ndarray]):
+        """Embedding function caching the embedding of every text it has seen, so that chunks shared by several
+        chunking configurations (and repeated queries) are only embedded once.
+
+        Args:
+            embed_fn: function embedding a list of texts.
+        """
+        self.embed_fn = embed_fn
+        self.embeddings: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        with self._lock:
+            missing = {key: text for key, text in zip(keys, texts) if key not in self.embeddings}
+        if len(missing) > 0:
+            embeddings = self.embed_fn(list(missing.values()))
+            with self._lock:
+                self.embeddings.update(zip(missing.keys(), embeddings))
+        with self._lock:
+            return np.stack([self.embeddings[key] for key in keys])
+
+
+@dataclass
+class TuningResult:
+    """Dataclass to hold the per-query averages measured for one configuration."""
+
+    chunk_size: int
+    overlap: bool
+    topk: int
+    num_chunks: int
+    llm_calls: float
+    prompt_tokens: float
+    completion_tokens: float
+    latency: float
+    p95_latency: float
+    match_rate: float
+
+
+@dataclass
+class TuningReport:
+    """Dataclass to hold the results of every configuration of a sweep, and the recommended one."""
+
+    results: List[TuningResult]
+    recommended: Optional[TuningResult]
+
+    def to_df(self) -> pd.DataFrame:
+        return pd.DataFrame([asdict(result) for result in self.results])
+
+
+def answer_matches(answer: str, expected: str) -> bool:
+    """Whether an answer contains the expected answer, ignoring case, punctuation and whitespace."""
+    expected = normalize_answer(expected)
+    return len(expected) > 0 and expected in normalize_answer(answer)
+
+
+def recommend(
+    results: List[TuningResult], min_match_rate: float = 0.8, max_latency: Optional[float] = None
+) -> Optional[TuningResult]:
+    """Return the fastest configuration meeting the quality (and latency) budget, with ties broken by token usage.
+
+    If no configuration meets the budget, return the one with the best match rate.
+    """
+    eligible = [
+        result
+        for result in results
+        if result.match_rate >= min_match_rate and (max_latency is None or result.latency <= max_latency)
+    ]
+    if len(eligible) > 0:
+        return min(
+            eligible, key=lambda result: (result.latency, result.prompt_tokens + result.completion_tokens, result.topk)
+        )
+    print(f"No configuration meets the budget (match rate >= {min_match_rate}, latency <= {max_latency}).")
+    return max(results, key=lambda result: (result.match_rate, -result.latency), default=None)
+
+
+def tune(
+    corpus: Corpus,
+    qa_pairs: Sequence[Tuple[str, str]],
+    chunk_sizes: Sequence[int] = (512, 1024, 2048),
+    overlaps: Sequence[bool] = (False, True),
+    topks: Sequence[int] = (3, 5, 10),
+    min_match_rate: float = 0.8,
+    max_latency: Optional[float] = None,
+    embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+    model_name: str = DEFAULT_EMBEDDING_MODEL,
+    replay_latency: bool = True,
+    cache_dir: Optional[str] = None,
+) -> TuningReport:
+    """Sweep chunk size, chunk overlap and topk for a corpus against a question/answer set, and recommend the
+    configuration with the lowest query latency among those answering enough questions correctly.
+
+    Every configuration is chunked and indexed from the documents of `corpus` with a LocalRetriever, and queried with
+    the LLM endpoints of `corpus`. Embeddings and LLM responses are cached across configurations, so each distinct
+    chunk is embedded once and each distinct prompt is sent once.
+
+    Args:
+        corpus: corpus to tune. Its documents, chunk storage mode and LLM endpoints are used; it isn't modified.
+        qa_pairs: (question, expected answer) pairs. An answer matches if it contains the expected answer.
+        chunk_sizes: chunk sizes to sweep.
+        overlaps: chunk overlap settings to sweep, see `Corpus.chunk`.
+        topks: numbers of retrieved chunks to sweep.
+        min_match_rate: minimum fraction of matched answers for a configuration to be recommended.
+        max_latency: (optional) maximum mean query latency in seconds for a configuration to be recommended.
+        embed_fn: (optional) function embedding a list of texts. Defaults to the sentence-transformers `model_name`.
+        model_name: sentence-transformers embedding model, used if `embed_fn` isn't given.
+        replay_latency: replay the recorded latency of cached LLM responses, so that latencies are comparable between
+            configurations regardless of which one made the call first.
+        cache_dir: (optional) directory for the indices of the configurations. Defaults to a temporary directory.
+
+    Returns:
+        TuningReport with per-query averages for every configuration and the recommended configuration.
+    """
+    count_tokens = get_token_counter()
+    token_counter = CallCounter()
+    embedder = EmbeddingCache(embed_fn or LocalRetriever(model_name=model_name).embed)
+    cache_dir = cache_dir or tempfile.mkdtemp(prefix="info_extract_tuning_")
+
+    # one cache per distinct endpoint, shared by every configuration.
+    wrapped_endpoints = {}
+
+    def wrap(llm_endpoint: Optional[LLMEndpoint]) -> Optional[LLMEndpoint]:
+        if llm_endpoint is None:
+            return None
+        if id(llm_endpoint) not in wrapped_endpoints:
+            cached_endpoint = CachingLLMEndpoint(llm_endpoint, replay_latency=replay_latency)
+            wrapped_endpoints[id(llm_endpoint)] = TokenCountingLLMEndpoint(cached_endpoint, token_counter, count_tokens)
+        return wrapped_endpoints[id(llm_endpoint)]
+
+    results = []
+    for chunk_size in chunk_sizes:
+        for overlap in overlaps:
+            tuned_corpus = Corpus(
+                corpus.documents,
+                name=f"{corpus.name}-tuning",
+                llm_endpoint=wrap(corpus.llm_endpoint),
+                retriever=LocalRetriever(
+                    index_name=f"{corpus.name}-{chunk_size}{'-overlap' if overlap else ''}",
+                    cache_dir=cache_dir,
+                    embed_fn=embedder,
+                ),
+                extraction_endpoint=wrap(corpus.extraction_endpoint),
+                synthesis_endpoint=wrap(corpus.synthesis_endpoint),
+                escalation_endpoint=wrap(corpus.escalation_endpoint),
+            )
+            tuned_corpus.chunk(chunk_size, storage=corpus.chunk_storage, overlap=overlap)
+            tuned_corpus.index()
+
+            for topk in topks:
+                llm_calls, prompt_tokens, completion_tokens, latencies, matches = [], [], [], [], []
+                for question, expected in qa_pairs:
+                    calls_before, tokens_before = tuned_corpus.call_counts(), token_counter.snapshot()
+                    start_t = perf_counter()
+                    rag_result = tuned_corpus.query(question, topk=topk, use_answer_index=False)
+                    latencies.append(perf_counter() - start_t)
+                    calls_after, tokens_after = tuned_corpus.call_counts(), token_counter.snapshot()
+
+                    llm_calls.append(sum(calls_after.values()) - sum(calls_before.values()))
+                    for name, values in (("prompt_tokens", prompt_tokens), ("completion_tokens", completion_tokens)):
+                        values.append(tokens_after.get(name, 0) - tokens_before.get(name, 0))
+                    matches.append(answer_matches(rag_result.answer, expected))
+
+                result = TuningResult(
+                    chunk_size=chunk_size,
+                    overlap=overlap,
+                    topk=topk,
+                    num_chunks=len(tuned_corpus.chunks.df),
+                    llm_calls=float(np.mean(llm_calls)),
+                    prompt_tokens=float(np.mean(prompt_tokens)),
+                    completion_tokens=float(np.mean(completion_tokens)),
+                    latency=float(np.mean(latencies)),
+                    p95_latency=float(np.percentile(latencies, 95)),
+                    match_rate=float(np.mean(matches)),
+                )
+                print(
+                    f"chunk_size={chunk_size} overlap={overlap} topk={topk}: match rate {result.match_rate:.2f}, "
+                    f"{result.llm_calls:.1f} LLM calls, {result.prompt_tokens + result.completion_tokens:.0f} tokens, "
+                    f"{result.latency:.2f}s per query."
+                )
+                results.append(result)
+
+    recommended = recommend(results, min_match_rate=min_match_rate, max_latency=max_latency)
+    if recommended is not None:
+        print(
+            f"Recommended configuration: chunk_size={recommended.chunk_size}, overlap={recommended.overlap}, "
+            f"topk={recommended.topk}."
+        )
+    return TuningReport(results=results, recommended=recommended)
@@ -11,7 +11,7 @@ with open(path.join(here, "README.md"), encoding="utf-8") as f:
 with open(path.join(here, "requirements.txt"), encoding="utf-8") as f:
     requirements = [line.strip() for line in f if line]
 
-extra_requirements = {}
+extra_requirements = {"serve": ["aiohttp"]}
 
 with open(path.join(here, "requirements_test.txt"), encoding="utf-8") as f:
     extra_requirements["test"] = [line.strip() for line in f if line]
@@ -0,0 +1,57 @@
+import pandas as pd
+
+from info_extract.answer_index import AnswerIndex, QAPair
+from info_extract.info_extract import ChunkList
+
+
+def make_chunk_list(pairs):
+    chunk_list = ChunkList(
+        pd.DataFrame(
+            {
+                "document_id": [0, 1, 2],
+                "chunk_id": [0, 0, 0],
+                "chunk_text": ["Revenue was $10M.", "Revenue was $20M.", "Revenue was $10M in total."],
+            }
+        ),
+        llm_endpoint=None,
+        retriever=None,
+    )
+    chunk_list.answer_index = AnswerIndex()
+    for pair in pairs:
+        chunk_list.answer_index.add(pair)
+    return chunk_list
+
+
+def retrieved(*document_ids):
+    return pd.DataFrame({"document_id": list(document_ids), "chunk_id": [0] * len(document_ids)})
+
+
+def test_search_restricted_to_chunks():
+    answer_index = AnswerIndex()
+    answer_index.add(QAPair(0, 0, "What was the revenue?", "$10M"))
+    answer_index.add(QAPair(1, 0, "What was the total revenue?", "$20M"))
+
+    assert [pair.answer for pair, _ in answer_index.search("What was the revenue?", min_score=0.5)] == ["$10M", "$20M"]
+    matches = answer_index.search("What was the revenue?", min_score=0.5, chunk_keys={(1, 0)})
+    assert [pair.answer for pair, _ in matches] == ["$20M"]
+    assert answer_index.search("Who is the CEO?") == []
+
+
+def test_answer_from_index_conflicting_answers():
+    chunk_list = make_chunk_list(
+        [QAPair(0, 0, "What was the revenue?", "$10M"), QAPair(1, 0, "What was the revenue?", "$20M")]
+    )
+    assert chunk_list.answer_from_index("What was the revenue?") is None
+    result = chunk_list.answer_from_index("What was the revenue?", retrieved_documents=retrieved(1))
+    assert result.answer == "$20M"
+    assert [chunk_answer.document_id for chunk_answer in result.chunk_answers] == [1]
+
+
+def test_answer_from_index_agreeing_answers():
+    chunk_list = make_chunk_list(
+        [QAPair(0, 0, "What was the revenue?", "$10M"), QAPair(2, 0, "What was the revenue?", "$10M.")]
+    )
+    result = chunk_list.answer_from_index("What was the revenue?", retrieved_documents=retrieved(0, 1, 2))
+    assert result.answer == "$10M"
+    assert len(result.chunk_answers) == 2
+    assert chunk_list.answer_from_index("What was the revenue?", retrieved_documents=retrieved(1)) is None
@@ -0,0 +1,83 @@
+import hashlib
+import re
+
+import numpy as np
+import pandas as pd
+
+from info_extract.endpoints import LLMEndpoint
+from info_extract.info_extract import ChunkList, Corpus
+from info_extract.retrieval import LocalRetriever
+
+FILLER = " ".join(f"word{i}" for i in range(60))
+
+
+class RevenueLLMEndpoint(LLMEndpoint):
+    """Extracts the revenue figure of a chunk, and synthesizes the first of a list of answers."""
+
+    def hit(self, input_text):
+        match = re.search(r"revenue was (\$\d+M)", input_text) or re.search(r"^- (.+)$", input_text, re.MULTILINE)
+        return match.group(1) if match else "UNDEFINED"
+
+
+def embed(texts):
+    embeddings = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in text.lower().split():
+            embeddings[i, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 64] += 1
+    return embeddings
+
+
+def make_chunk_list(texts):
+    df = pd.DataFrame({"document_id": list(range(len(texts))), "chunk_id": [0] * len(texts), "chunk_text": texts})
+    return ChunkList(df, llm_endpoint=RevenueLLMEndpoint(), retriever=None)
+
+
+def test_deduplicate_only_drops_exact_duplicates():
+    chunk_list = make_chunk_list(
+        [f"{FILLER} revenue was $10M", f"{FILLER} revenue was $10M", f"{FILLER} revenue was $20M"]
+    )
+    chunk_list.deduplicate()
+
+    assert chunk_list.df["document_id"].tolist() == [0, 2]
+    assert chunk_list.duplicates == {(0, 0): [(0, 0), (1, 0)]}
+    assert str(chunk_list.get_chunk(1, 0).chunk_text) == f"{FILLER} revenue was $10M"
+
+
+def test_deduplicate_collapse_near_duplicates():
+    chunk_list = make_chunk_list(
+        [f"{FILLER} revenue was $10M", f"{FILLER} revenue was $10M", f"{FILLER} revenue was $20M"]
+    )
+    chunk_list.deduplicate(collapse_near_duplicates=True)
+
+    assert chunk_list.df["document_id"].tolist() == [0]
+    assert chunk_list.duplicates == {(0, 0): [(0, 0), (1, 0), (2, 0)]}
+    result = chunk_list.document_extract(["What was the revenue?"])
+    # the near-duplicate is attributed the figure of the chunk it was collapsed into.
+    answers = dict(zip(result.extractions["document_id"].tolist(), result.extractions["answer"].tolist()))
+    assert answers == {0: "$10M", 1: "$10M", 2: "$10M"}
+    assert chunk_list.call_counts()["extract"] == 1
+
+
+def test_differing_near_duplicate_is_retrievable(tmp_path):
+    texts = [f"{FILLER} revenue was $10M", f"{FILLER} revenue was $10M", f"{FILLER} revenue was $20M"]
+    documents = pd.DataFrame({"document_id": [0, 1, 2], "document_name": ["a", "b", "c"], "document_text": texts})
+    retriever = LocalRetriever(index_name="revenue", cache_dir=str(tmp_path), embed_fn=embed)
+    corpus = Corpus(documents, name="revenue", llm_endpoint=RevenueLLMEndpoint(), retriever=retriever)
+    corpus.chunk(chunk_size=2048, dedup=True)
+    corpus.index()
+
+    result = corpus.query("revenue was $20M", topk=1)
+    assert result.answer == "$20M"
+    assert [answer.document_id for answer in result.chunk_answers] == [2]
+
+
+def test_document_extract_near_duplicates():
+    chunk_list = make_chunk_list(
+        [f"{FILLER} revenue was $10M", f"{FILLER} revenue was $10M", f"{FILLER} revenue was $20M"]
+    )
+    chunk_list.deduplicate()
+    result = chunk_list.document_extract(["What was the revenue?"])
+
+    answers = dict(zip(result.extractions["document_id"].tolist(), result.extractions["answer"].tolist()))
+    assert answers == {0: "$10M", 1: "$10M", 2: "$20M"}
+    assert chunk_list.call_counts()["extract"] == 2
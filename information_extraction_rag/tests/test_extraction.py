@@ -0,0 +1,113 @@
+import re
+import threading
+from typing import List
+
+import pandas as pd
+
+from info_extract.endpoints import LLMEndpoint
+from info_extract.info_extract import Chunk, Corpus, parse_answers
+
+
+class ScriptedLLMEndpoint(LLMEndpoint):
+    """Answers prompts from a function of the prompted questions, and records them."""
+
+    def __init__(self, respond, max_new_tokens: int = 512):
+        self.respond = respond
+        self.max_new_tokens = max_new_tokens
+        self.prompts: List[List[str]] = []
+        self._lock = threading.Lock()
+
+    def hit(self, input_text):
+        questions = [line.split(": ", 1)[1] for line in input_text.split("\n") if line.startswith("Q")]
+        with self._lock:
+            self.prompts.append(questions)
+        return self.respond(questions)
+
+
+def test_parse_answers_labeled():
+    assert parse_answers("Paris\nA2: Berlin", 2) == ["Paris", "Berlin"]
+    assert parse_answers("A1: Paris\nA2: Berlin", 2) == ["Paris", "Berlin"]
+    assert parse_answers("A2: Berlin\nA1: Paris", 2) == ["Paris", "Berlin"]
+
+
+def test_parse_answers_keeps_complete_answers():
+    assert parse_answers("Paris", 2) == ["Paris", None]
+    assert parse_answers("Paris", 2, max_new_tokens=512) == ["Paris", None]
+    assert parse_answers("Paris\nA3: Rome", 3, max_new_tokens=512) == ["Paris", None, "Rome"]
+
+
+def test_parse_answers_drops_truncated_answer():
+    text = "Paris\nA2: " + "a very long answer " * 20
+    assert parse_answers(text, 3, max_new_tokens=64) == ["Paris", None, None]
+    # the response is complete when the last answer is the last question's.
+    assert parse_answers(text, 2, max_new_tokens=64)[1] is not None
+
+
+def test_parse_answers_multiline():
+    assert parse_answers("Paris\nFrance\nA2: Berlin", 2) == ["Paris. France", "Berlin"]
+    assert parse_answers("A1: Paris\nQ2: what?\nA2: Berlin", 2) == ["Paris", "Berlin"]
+
+
+def test_pack_queries():
+    chunk = Chunk(0, 0, "text", None, expected_answer_tokens=48)
+    endpoint = ScriptedLLMEndpoint(None, max_new_tokens=128)
+    groups = chunk.pack_queries(endpoint, 5)
+    assert [len(group) for group in groups] == [2, 2, 1]
+    assert [i for group in groups for i in group] == list(range(5))
+
+    assert chunk.pack_queries(ScriptedLLMEndpoint(None, max_new_tokens=16), 2) == [[0], [1]]
+    assert chunk.pack_queries(ScriptedLLMEndpoint(None, max_new_tokens=4096), 3) == [[0, 1, 2]]
+
+
+def test_answer_queries_retries_missing_queries_alone():
+    answers = {"capital of France?": "Paris", "capital of Germany?": "Berlin"}
+
+    def respond(questions):
+        # only answers the first question of a prompt.
+        return answers[questions[0]]
+
+    chunk = Chunk(0, 0, "text", None)
+    endpoint = ScriptedLLMEndpoint(respond)
+    assert chunk.answer_queries(endpoint, list(answers)) == ["Paris", "Berlin"]
+    assert endpoint.prompts == [list(answers), ["capital of Germany?"]]
+
+
+def test_answer_queries_undefined_after_retries():
+    chunk = Chunk(0, 0, "text", None)
+    endpoint = ScriptedLLMEndpoint(lambda questions: "" if questions == ["b?"] else "A1: yes")
+    assert chunk.answer_queries(endpoint, ["a?", "b?"]) == ["yes", "UNDEFINED"]
+
+
+class CityLLMEndpoint(LLMEndpoint):
+    """Answers every question about a passage with the city the passage names, and synthesizes the first answer."""
+
+    def hit(self, input_text):
+        questions = [line for line in input_text.split("\n") if re.match(r"Q\d+: ", line)]
+        if len(questions) > 0:
+            city = input_text.split("lives in ", 1)[1].split()[0]
+            answers = [f"{city} ({question.split(': ', 1)[1]})" for question in questions]
+            return "\n".join([answers[0]] + [f"A{i + 1}: {answer}" for i, answer in enumerate(answers) if i > 0])
+        return next(line[2:] for line in input_text.split("\n") if line.startswith("- "))
+
+
+def test_corpus_extract_answers_every_query_of_every_document():
+    documents = pd.DataFrame(
+        {
+            "document_id": [0, 1],
+            "document_name": ["a", "b"],
+            "document_text": ["Alice lives in Paris and works there.", "Bob lives in Berlin and works there."],
+        }
+    )
+    corpus = Corpus(documents, name="people", llm_endpoint=CityLLMEndpoint())
+    corpus.chunk(chunk_size=2048)
+    queries = ["Where do they live?", "Where do they work?"]
+    extractions = corpus.extract(queries).extractions
+
+    answers = dict(zip(zip(extractions["document_id"], extractions["query"]), extractions["answer"]))
+    assert answers == {
+        (document_id, query): f"{city} ({query})"
+        for document_id, city in [(0, "Paris"), (1, "Berlin")]
+        for query in queries
+    }
+    # both queries are packed into one extraction prompt per chunk.
+    assert corpus.call_counts()["extract"] == 2
@@ -0,0 +1,150 @@
+import hashlib
+import time
+
+import numpy as np
+import pandas as pd
+
+from info_extract.endpoints import LLMEndpoint
+from info_extract.info_extract import Corpus
+from info_extract.retrieval import LocalRetriever
+
+
+def embed(texts):
+    embeddings = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in text.lower().split():
+            embeddings[i, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 64] += 1
+    return embeddings
+
+
+class StubLLMEndpoint(LLMEndpoint):
+    """Answers every prompt with `response`, after `latency(prompt)` seconds."""
+
+    def __init__(self, response, latency=lambda prompt: 0.0):
+        self.response = response
+        self.latency = latency
+
+    def hit(self, input_text):
+        time.sleep(self.latency(input_text))
+        return self.response
+
+
+def make_corpus(document_texts, cache_dir, **endpoints):
+    documents = pd.DataFrame(
+        {
+            "document_id": list(range(len(document_texts))),
+            "document_name": [f"doc{i}" for i in range(len(document_texts))],
+            "document_text": document_texts,
+        }
+    )
+    retriever = LocalRetriever(index_name="capitals", cache_dir=cache_dir, embed_fn=embed)
+    corpus = Corpus(documents, name="capitals", retriever=retriever, **endpoints)
+    corpus.chunk(chunk_size=2048)
+    corpus.index()
+    return corpus
+
+
+def test_query_deadline_returns_partial_answer(tmp_path):
+    # two of the four chunks take longer to extract than the whole timeout.
+    extraction_endpoint = StubLLMEndpoint("A1: Paris", latency=lambda prompt: 2.0 if "slow" in prompt else 0.05)
+    corpus = make_corpus(
+        ["The capital of France is Paris.", "France has Paris as capital.", "A slow page.", "Another slow page."],
+        str(tmp_path),
+        llm_endpoint=StubLLMEndpoint("Paris"),
+        extraction_endpoint=extraction_endpoint,
+    )
+
+    start = time.monotonic()
+    result = corpus.query("What is the capital of France?", topk=4, timeout=1.0)
+    elapsed = time.monotonic() - start
+    # answered from the completed extractions once the extraction budget (3/4 of the timeout) ran out.
+    assert 0.7 <= elapsed < 1.0
+    assert result.is_partial
+    assert result.answer == "Paris"
+    assert sorted(answer.document_id for answer in result.chunk_answers) == [0, 1]
+    assert corpus.call_counts() == {"extract": 4, "synthesize": 1}
+
+
+def test_query_deadline_falls_back_to_extractions(tmp_path):
+    corpus = make_corpus(
+        ["The capital of France is Paris.", "France has Paris as capital."],
+        str(tmp_path),
+        llm_endpoint=StubLLMEndpoint("A1: Paris"),
+        synthesis_endpoint=StubLLMEndpoint("Paris", latency=lambda prompt: 2.0),
+    )
+
+    start = time.monotonic()
+    result = corpus.query("What is the capital of France?", topk=2, timeout=1.0)
+    assert time.monotonic() - start < 1.1
+    # the synthesis didn't complete: the answer lists the extracted answers.
+    assert result.is_partial
+    assert result.answer == "- Paris\n- Paris"
+
+
+def test_query_within_deadline_is_complete(tmp_path):
+    corpus = make_corpus(
+        ["The capital of France is Paris.", "France has Paris as capital."],
+        str(tmp_path),
+        llm_endpoint=StubLLMEndpoint("A1: Paris"),
+    )
+    result = corpus.query("What is the capital of France?", topk=2, timeout=5.0)
+    assert not result.is_partial
+    assert len(result.chunk_answers) == 2
+
+
+CAPITAL_TEXTS = [f"The capital of France is Paris, says source {i}." for i in range(6)]
+
+
+def test_early_exit_skips_remaining_chunks(tmp_path):
+    corpus = make_corpus(CAPITAL_TEXTS, str(tmp_path), llm_endpoint=StubLLMEndpoint("A1: Paris"))
+    query = "What is the capital of France?"
+    retrieved = corpus.chunks.retrieve(query, topk=6)
+
+    result = corpus.query(query, topk=6, early_exit_answers=2, max_parallel=1)
+    assert not result.is_partial
+    assert result.answer == "A1: Paris"
+    # the two highest scoring chunks are extracted, and the other four are skipped.
+    assert [(answer.document_id, answer.chunk_id) for answer in result.chunk_answers] == list(
+        zip(retrieved["document_id"].tolist()[:2], retrieved["chunk_id"].tolist()[:2])
+    )
+    assert corpus.call_counts() == {"extract": 2, "synthesize": 1}
+
+
+def test_early_exit_needs_agreeing_answers(tmp_path):
+    corpus = make_corpus(CAPITAL_TEXTS, str(tmp_path), llm_endpoint=StubLLMEndpoint("A1: UNDEFINED"))
+    result = corpus.query("What is the capital of France?", topk=6, early_exit_answers=2, max_parallel=2)
+    # no answer reached the threshold, so every chunk was extracted.
+    assert len(result.chunk_answers) == 6
+    assert corpus.call_counts() == {"extract": 6}
+
+
+def test_cascade_escalates_undefined_extractions(tmp_path):
+    corpus = make_corpus(
+        CAPITAL_TEXTS[:3],
+        str(tmp_path),
+        llm_endpoint=StubLLMEndpoint("Paris"),
+        extraction_endpoint=StubLLMEndpoint("A1: UNDEFINED"),
+        escalation_endpoint=StubLLMEndpoint("A1: Paris"),
+    )
+    result = corpus.query("What is the capital of France?", topk=3)
+    assert result.answer == "Paris"
+    assert [answer.answer for answer in result.chunk_answers] == ["Paris"] * 3
+    assert corpus.call_counts() == {"extract": 3, "escalate": 3, "synthesize": 1}
+
+
+def test_cascade_keeps_answers_of_the_small_model(tmp_path):
+    class FirstSourceLLMEndpoint(LLMEndpoint):
+        def hit(self, input_text):
+            return "A1: Paris" if "source 0" in input_text else "A1: UNDEFINED"
+
+    corpus = make_corpus(
+        CAPITAL_TEXTS[:3],
+        str(tmp_path),
+        llm_endpoint=StubLLMEndpoint("Paris"),
+        extraction_endpoint=FirstSourceLLMEndpoint(),
+        escalation_endpoint=StubLLMEndpoint("A1: Paris (escalated)"),
+    )
+    result = corpus.query("What is the capital of France?", topk=3)
+    answers = {answer.document_id: answer.answer for answer in result.chunk_answers}
+    assert answers == {0: "Paris", 1: "Paris (escalated)", 2: "Paris (escalated)"}
+    assert corpus.call_counts() == {"extract": 3, "escalate": 2, "synthesize": 1}
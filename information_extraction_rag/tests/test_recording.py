@@ -0,0 +1,43 @@
+import concurrent.futures
+import multiprocessing
+
+from info_extract.endpoints import LLMEndpoint
+from info_extract.recording import get_recording_writer, load_recording, RecordingLLMEndpoint, ReplayLLMEndpoint
+
+
+class EchoLLMEndpoint(LLMEndpoint):
+    def hit(self, input_text):
+        return input_text.upper()
+
+
+def record_prompts(path, prefix, num_prompts):
+    endpoints = [RecordingLLMEndpoint(EchoLLMEndpoint(), path, flush_every=7) for _ in range(3)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: endpoints[i % 3].hit(f"{prefix} {i}"), range(num_prompts)))
+    endpoints[0].close()
+
+
+def test_endpoints_share_one_writer(tmp_path):
+    path = str(tmp_path / "traffic.jsonl.gz")
+    first = RecordingLLMEndpoint(EchoLLMEndpoint(), path)
+    second = RecordingLLMEndpoint(EchoLLMEndpoint(), path)
+    assert first.writer is second.writer is get_recording_writer(path)
+
+
+def test_concurrent_recording(tmp_path):
+    path = str(tmp_path / "traffic.jsonl.gz")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=record_prompts, args=(path, f"process {i}", 50)) for i in range(3)]
+    for process in processes:
+        process.start()
+    record_prompts(path, "main", 50)
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    records = load_recording(path)
+    assert len(records) == 200
+    assert all(record["response"] == record["prompt"].upper() for record in records)
+
+    replay = ReplayLLMEndpoint(path, latency_scale=0.0)
+    assert replay.hit("process 2 49") == "PROCESS 2 49"
@@ -0,0 +1,115 @@
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from info_extract.info_extract import Corpus
+from info_extract.registry import CorpusRegistry
+from info_extract.retrieval import LocalRetriever
+
+
+def embed(texts):
+    embeddings = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in text.lower().split():
+            embeddings[i, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 64] += 1
+    return embeddings
+
+
+class AnswerLLMEndpoint:
+    def hit(self, input_text):
+        return "A1: yes" if "Q1" in input_text else "yes"
+
+
+def make_corpus(name, cache_dir):
+    rng = np.random.default_rng(len(name))
+    text = " ".join(f"word{i}" for i in rng.integers(0, 10000, size=5000))
+    documents = pd.DataFrame({"document_id": [0], "document_name": [name], "document_text": [text]})
+    retriever = LocalRetriever(index_name=name, cache_dir=cache_dir, embed_fn=embed)
+    corpus = Corpus(documents, name=name, llm_endpoint=AnswerLLMEndpoint(), retriever=retriever)
+    corpus.chunk(256)
+    corpus.index()
+    return corpus
+
+
+def test_memory_usage_includes_index(tmp_path):
+    corpus = make_corpus("a", str(tmp_path))
+    num_bytes = corpus.memory_usage()
+    index_bytes = corpus.retriever.memory_usage()
+    assert index_bytes >= corpus.retriever.embedding_index.nbytes > 0
+
+    corpus.retriever.unload_index()
+    assert corpus.retriever.memory_usage() == 0
+    assert corpus.memory_usage() == num_bytes - index_bytes
+
+
+def test_corpus_in_use_is_not_evicted(tmp_path):
+    registry = CorpusRegistry(max_bytes=1, cache_dir=str(tmp_path / "corpora"))
+    registry.register("a", corpus=make_corpus("a", str(tmp_path)))
+
+    with registry.using("a") as corpus:
+        registry.evict("a")
+        assert registry.stats()["a"]["in_memory"]
+        registry.register("b", corpus=make_corpus("b", str(tmp_path)))
+        assert registry.stats()["a"]["in_memory"]
+        assert corpus.query("word1?", topk=2).answer == "yes"
+        assert corpus.retriever.embedding_index is not None
+    assert not registry.stats()["a"]["in_memory"]
+    assert corpus.retriever.embedding_index is None
+
+
+def test_unload_during_queries(tmp_path):
+    corpus = make_corpus("a", str(tmp_path))
+    errors = []
+
+    def query():
+        try:
+            for _ in range(20):
+                corpus.retriever.retrieve("word1 word2", k=3)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(50):
+        corpus.retriever.unload_index()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_building_a_corpus_doesnt_block_other_keys(tmp_path):
+    registry = CorpusRegistry(cache_dir=str(tmp_path / "corpora"))
+    registry.register("a", corpus=make_corpus("a", str(tmp_path)))
+
+    building, release = threading.Event(), threading.Event()
+    num_builds = []
+
+    def slow_builder():
+        num_builds.append(1)
+        building.set()
+        assert release.wait(timeout=5.0)
+        return make_corpus("b", str(tmp_path))
+
+    registry.register("b", builder=slow_builder, llm_endpoint=AnswerLLMEndpoint())
+    corpora = []
+    threads = [threading.Thread(target=lambda: corpora.append(registry.get("b"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert building.wait(timeout=5.0)
+
+    # "b" is being built: other keys are still served, and the registry still answers.
+    with registry.using("a") as corpus:
+        assert corpus.query("word1?", topk=2).answer == "yes"
+    assert not registry.stats()["b"]["in_memory"]
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    # the second caller waited for the first build.
+    assert len(num_builds) == 1
+    assert corpora[0] is corpora[1]
+    assert registry.stats()["b"]["in_memory"]
+    assert registry.has_snapshot("b")
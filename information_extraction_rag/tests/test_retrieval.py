@@ -0,0 +1,90 @@
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from info_extract.info_extract import Corpus
+from info_extract.retrieval import EmbeddingIndex, PredibaseRetriever, SEARCH_BLOCK_SIZE
+from info_extract.testing import FakePredibaseClient
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_reduced_precision_search_matches_float32(dtype):
+    rng = np.random.default_rng(0)
+    items = rng.standard_normal((3 * SEARCH_BLOCK_SIZE + 17, 64)).astype(np.float32)
+    queries = items[rng.integers(len(items), size=5)] + 0.1 * rng.standard_normal((5, 64)).astype(np.float32)
+
+    exact = EmbeddingIndex(dtype="float32")
+    exact.build(items)
+    index = EmbeddingIndex(dtype=dtype)
+    index.build(items)
+
+    assert np.allclose(index.scores(queries), exact.scores(queries), atol=0.05)
+    assert np.array_equal(index.search(queries, k=1)[1], exact.search(queries, k=1)[1])
+
+
+class AnswerLLMEndpoint:
+    def hit(self, input_text):
+        return "A1: yes" if "Q1" in input_text else "yes"
+
+
+def make_predibase_corpus(client, index_ttl):
+    documents = pd.DataFrame(
+        {
+            "document_id": [0, 1],
+            "document_name": ["a", "b"],
+            "document_text": ["apples grow on trees " * 20, "bananas are yellow " * 20],
+        }
+    )
+    retriever = PredibaseRetriever(client, index_name="fruits", index_ttl=index_ttl)
+    corpus = Corpus(documents, name="fruits", llm_endpoint=AnswerLLMEndpoint(), retriever=retriever)
+    corpus.chunk(64)
+    corpus.index()
+    return corpus
+
+
+def test_predibase_index_handle_is_reused_within_ttl():
+    client = FakePredibaseClient()
+    corpus = make_predibase_corpus(client, index_ttl=300.0)
+    assert client.calls["create_dataset_from_df"] == 1
+    num_lookups = client.calls["get_dataset"]
+
+    results = corpus.query_batch(["where do apples grow?", "what color are bananas?"], topk=2)
+    assert [result.answer for result in results] == ["yes", "yes"]
+    assert {answer.document_id for answer in results[0].chunk_answers} == {0}
+    assert {answer.document_id for answer in results[1].chunk_answers} == {1}
+    corpus.query("where do apples grow?", topk=2)
+    assert client.calls["get_dataset"] == num_lookups
+
+    # an expired handle is looked up again, once per batch.
+    corpus.retriever.index_ttl = -1.0
+    corpus.query_batch(["where do apples grow?", "what color are bananas?", "apples?"], topk=2)
+    assert client.calls["get_dataset"] == num_lookups + 1
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.num_submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+def test_query_uses_given_executor(monkeypatch):
+    corpus = make_predibase_corpus(FakePredibaseClient(), index_ttl=300.0)
+    with CountingExecutor(max_workers=4) as executor:
+
+        def no_new_pool(*args, **kwargs):
+            raise AssertionError("A thread pool was created for the query.")
+
+        monkeypatch.setattr(concurrent.futures, "ThreadPoolExecutor", no_new_pool)
+        result = corpus.query("where do apples grow?", topk=2, executor=executor)
+        extraction = corpus.extract(["what color are bananas?"], executor=executor)
+
+    assert result.answer == "yes"
+    assert len(extraction.extractions) == 2
+    # retrieval, 2 extractions and synthesis for the query, then one extraction per chunk.
+    assert executor.num_submitted == 4 + len(corpus.chunks.df)
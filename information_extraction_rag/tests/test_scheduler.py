@@ -0,0 +1,120 @@
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from info_extract.scheduler import (
+    BATCH,
+    current_request_class,
+    INTERACTIVE,
+    request_class,
+    RequestScheduler,
+    submit_in_context,
+)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out."
+        time.sleep(0.005)
+
+
+def start_acquire(scheduler, name, admitted):
+    def run():
+        scheduler.acquire(name)
+        admitted.append(name)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_reserved_slots_hold_back_other_classes():
+    scheduler = RequestScheduler(max_concurrency=4, reserved_shares={INTERACTIVE: 0.5})
+    assert scheduler.reserved_slots == {INTERACTIVE: 2}
+    scheduler.acquire(BATCH)
+    scheduler.acquire(BATCH)
+
+    admitted = []
+    start_acquire(scheduler, BATCH, admitted)
+    wait_for(lambda: scheduler.stats()[BATCH]["queue_depth"] == 1)
+    time.sleep(0.05)
+    assert admitted == []
+
+    # the reserved slots are still free for interactive requests.
+    scheduler.acquire(INTERACTIVE)
+    scheduler.acquire(INTERACTIVE)
+    assert admitted == []
+
+    scheduler.release(BATCH)
+    wait_for(lambda: admitted == [BATCH])
+
+
+def test_reservations_leave_a_slot_to_other_classes():
+    with pytest.raises(ValueError):
+        RequestScheduler(max_concurrency=4, reserved_shares={INTERACTIVE: 1.0})
+
+    # a share smaller than one slot reserves nothing, rather than the only slot.
+    scheduler = RequestScheduler(max_concurrency=1)
+    assert scheduler.reserved_slots == {INTERACTIVE: 0}
+    scheduler.acquire(BATCH)
+    scheduler.release(BATCH)
+
+
+def test_weighted_fair_ordering():
+    scheduler = RequestScheduler(max_concurrency=1, weights={INTERACTIVE: 4.0, BATCH: 1.0}, reserved_shares={})
+    scheduler.acquire(BATCH)
+
+    admitted = []
+
+    def run(name):
+        scheduler.acquire(name)
+        admitted.append(name)
+        scheduler.release(name)
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in [BATCH] * 4 + [INTERACTIVE] * 3]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: sum(stats["queue_depth"] for stats in scheduler.stats().values()) == len(threads))
+
+    scheduler.release(BATCH)
+    for thread in threads:
+        thread.join()
+    # interactive requests advance 4 times faster than the batch requests queued before them.
+    assert admitted == [INTERACTIVE] * 3 + [BATCH] * 4
+
+
+def test_request_class_follows_submitted_tasks():
+    assert current_request_class() == INTERACTIVE
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        with request_class(BATCH):
+            assert current_request_class() == BATCH
+            assert submit_in_context(executor, current_request_class).result() == BATCH
+            # a plain submit doesn't carry the context.
+            assert executor.submit(current_request_class).result() == INTERACTIVE
+    assert current_request_class() == INTERACTIVE
+
+
+def test_stats():
+    scheduler = RequestScheduler(max_concurrency=2, reserved_shares={})
+    with scheduler.slot(BATCH):
+        scheduler.acquire(INTERACTIVE)
+        admitted = []
+        start_acquire(scheduler, BATCH, admitted)
+        wait_for(lambda: scheduler.stats()[BATCH]["queue_depth"] == 1)
+        stats = scheduler.stats()
+        assert stats[INTERACTIVE]["running"] == 1 and stats[INTERACTIVE]["admitted"] == 1
+        assert stats[BATCH]["running"] == 1 and stats[BATCH]["admitted"] == 1
+
+        time.sleep(0.05)
+        scheduler.release(INTERACTIVE)
+        wait_for(lambda: admitted == [BATCH])
+
+    stats = scheduler.stats()
+    assert stats[BATCH]["queue_depth"] == 0
+    assert stats[BATCH]["running"] == 1
+    assert stats[BATCH]["admitted"] == 2
+    assert stats[BATCH]["max_wait"] >= 0.05
+    assert stats[BATCH]["mean_wait"] == pytest.approx(stats[BATCH]["max_wait"] / 2, abs=0.01)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+
+import pandas as pd
+import pytest
+
+from info_extract.info_extract import Corpus
+from info_extract.retrieval import PredibaseRetriever
+from info_extract.server import CorpusService, create_app, ServerConfig
+from info_extract.testing import FakePredibaseClient
+
+test_utils = pytest.importorskip("aiohttp.test_utils")
+
+
+def respond(text):
+    return "A1: yes" if "Q1" in text else "yes"
+
+
+def make_corpus(name, client, llm_endpoint):
+    documents = pd.DataFrame(
+        {
+            "document_id": [0, 1],
+            "document_name": ["a", "b"],
+            "document_text": ["apples grow on trees " * 20, "bananas are yellow " * 20],
+        }
+    )
+    retriever = PredibaseRetriever(client, index_name=name)
+    corpus = Corpus(documents, name=name, llm_endpoint=llm_endpoint, retriever=retriever)
+    corpus.chunk(64)
+    corpus.index()
+    return corpus
+
+
+@pytest.fixture
+def service(tmp_path):
+    client = FakePredibaseClient(respond=respond)
+    config = ServerConfig(registry_dir=str(tmp_path), max_threads=1, max_pending=1, max_call_threads=8)
+    service = CorpusService(config, predibase_client=client)
+    # a snapshot saved by another process, and a corpus registered in memory only.
+    make_corpus("fruits", client, service.llm_endpoint).save(os.path.join(config.registry_dir, "fruits"))
+    service.register_snapshots()
+    service.registry.register("draft", corpus=make_corpus("draft", client, service.llm_endpoint))
+    yield service
+    service.close()
+
+
+def serve(service, requests):
+    """Run `requests(client)` against the app of `service`, and return its result."""
+
+    async def run():
+        async with test_utils.TestClient(test_utils.TestServer(create_app(service))) as client:
+            return await requests(client)
+
+    return asyncio.run(run())
+
+
+async def fetch(client, method, path, **kwargs):
+    response = await client.request(method, path, **kwargs)
+    return response.status, await response.json()
+
+
+def test_query(service):
+    async def requests(client):
+        return await fetch(client, "POST", "/corpora/fruits/query", json={"query": "where do apples grow?", "topk": 2})
+
+    status, result = serve(service, requests)
+    assert status == 200
+    assert result["answer"] == "yes"
+    assert not result["is_partial"]
+    assert {answer["document_id"] for answer in result["chunk_answers"]} == {0}
+    assert all(isinstance(answer["chunk_text"], str) for answer in result["chunk_answers"])
+
+
+def test_query_batch(service):
+    async def requests(client):
+        body = {"queries": ["where do apples grow?", "what color are bananas?"], "topk": 2, "timeout": None}
+        return await fetch(client, "POST", "/corpora/fruits/query_batch", json=body)
+
+    status, results = serve(service, requests)
+    assert status == 200
+    assert [result["answer"] for result in results] == ["yes", "yes"]
+    assert {answer["document_id"] for answer in results[1]["chunk_answers"]} == {1}
+
+
+def test_status(service):
+    async def requests(client):
+        return [
+            await fetch(client, "GET", "/corpora/fruits"),
+            await fetch(client, "GET", "/corpora/draft"),
+            await fetch(client, "GET", "/corpora"),
+        ]
+
+    (status, fruits), (draft_status, draft), (list_status, corpora) = serve(service, requests)
+    assert status == 200
+    assert fruits["name"] == "fruits" and fruits["is_indexed"]
+    # registered, but not saved yet.
+    assert draft_status == 404
+    assert "draft" in draft["error"]
+    assert list_status == 200
+    assert corpora["fruits"] == fruits
+    assert corpora["draft"]["in_memory"] and "name" not in corpora["draft"]
+
+
+@pytest.mark.parametrize(
+    "method,path,body,expected_status",
+    [
+        ("GET", "/corpora/missing", None, 404),
+        ("POST", "/corpora/missing/query", {"query": "apples?"}, 404),
+        ("POST", "/corpora/fruits/query", {"topk": 2}, 400),
+        ("POST", "/corpora/fruits/query", ["apples?"], 400),
+        ("POST", "/corpora/fruits/query", {"query": "apples?", "topk": "2"}, 400),
+        ("POST", "/corpora/fruits/query", {"query": "apples?", "topk": True}, 400),
+        ("POST", "/corpora/fruits/query", {"query": "apples?", "timeout": "soon"}, 400),
+        ("POST", "/corpora/fruits/query_batch", {"queries": "apples?"}, 400),
+        ("POST", "/corpora/fruits/query_batch", {"queries": ["apples?"], "max_parallel": 1.5}, 400),
+        ("POST", "/corpora/fruits/extract", {"queries": [1]}, 400),
+    ],
+)
+def test_errors(service, method, path, body, expected_status):
+    async def requests(client):
+        return await fetch(client, method, path, json=body)
+
+    status, result = serve(service, requests)
+    assert status == expected_status
+    assert "error" in result
+
+
+def test_overloaded(service):
+    # one running and one pending call are admitted, a batch of three isn't.
+    async def requests(client):
+        return await fetch(client, "POST", "/corpora/fruits/query_batch", json={"queries": ["apples?"] * 3})
+
+    status, result = serve(service, requests)
+    assert status == 503
+    assert result == {"error": "Too many pending requests."}
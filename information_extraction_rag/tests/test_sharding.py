@@ -0,0 +1,40 @@
+import concurrent.futures
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from info_extract.retrieval import LocalRetriever
+from info_extract.sharding import ShardedRetriever
+
+
+def embed(texts):
+    embeddings = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in text.lower().split():
+            embeddings[i, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 64] += 1
+    return embeddings
+
+
+def test_concurrent_queries_get_their_own_results(tmp_path):
+    rng = np.random.default_rng(0)
+    chunks = pd.DataFrame(
+        {
+            "document_id": np.arange(200),
+            "chunk_id": np.zeros(200, dtype=int),
+            "chunk_text": [" ".join(f"word{i}" for i in rng.integers(0, 300, size=20)) for _ in range(200)],
+        }
+    )
+    queries = [f"word{i} word{i + 1}" for i in range(40)]
+    local = LocalRetriever(index_name="local", cache_dir=str(tmp_path), embed_fn=embed)
+    local.index(chunks)
+    # scores rather than chunks, since chunks with equal scores may be returned in any order.
+    expected = [local.retrieve(query, k=3)["score"].tolist() for query in queries]
+
+    with ShardedRetriever(index_name="sharded", cache_dir=str(tmp_path), num_shards=2, embed_fn=embed) as retriever:
+        retriever.index(chunks)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda query: retriever.retrieve(query, k=3), queries))
+        assert retriever.memory_usage() > 0
+
+    assert np.allclose([result["score"].tolist() for result in results], expected)
@@ -0,0 +1,85 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from info_extract.info_extract import Corpus
+from info_extract.storage import chunk_spans, DocumentTextStore
+
+TEXTS = ["héllo wörld " * 50, "", "foo bar baz " * 30]
+
+
+@pytest.mark.parametrize("dtype", [object, pd.ArrowDtype(pa.string()), pd.ArrowDtype(pa.large_string())])
+def test_store_views_document_text(dtype):
+    documents = pd.DataFrame({"document_id": [3, 1, 2], "document_text": pd.Series(TEXTS, dtype=dtype)})
+    store = DocumentTextStore.from_documents(documents)
+    assert {document_id: bytes(buffer) for document_id, buffer in store.buffers.items()} == {
+        3: TEXTS[0].encode("utf-8"),
+        1: b"",
+        2: TEXTS[2].encode("utf-8"),
+    }
+    assert str(store.span(3, 0, 6)) == "héllo"
+    assert store.document_texts(documents.index).tolist() == TEXTS
+
+
+def test_store_multiple_arrow_chunks():
+    chunked = pd.arrays.ArrowExtensionArray(pa.chunked_array([["a b", "c"], ["déf"]]))
+    store = DocumentTextStore.from_documents(pd.DataFrame({"document_id": [0, 1, 2], "document_text": chunked}))
+    assert [bytes(store.buffer(i)) for i in range(3)] == [b"a b", b"c", "déf".encode("utf-8")]
+
+
+def test_offsets_hold_text_once():
+    documents = pd.DataFrame(
+        {"document_id": [0, 1, 2], "document_name": ["a", "b", "c"], "document_text": pd.Series(TEXTS, dtype=object)}
+    )
+    corpus = Corpus(documents, name="test", llm_endpoint=None)
+    chunks = corpus.chunk(chunk_size=40, storage="offsets")
+
+    data = corpus.documents["document_text"].array.__arrow_array__().chunk(0).buffers()[2]
+    assert chunks.text_store.buffer(0).obj.address == data.address
+    assert [str(chunk.chunk_text) for chunk in chunks.chunk_list()][:2] == [
+        "héllo wörld héllo wörld héllo",
+        "wörld héllo wörld héllo wörld",
+    ]
+    assert chunk_spans(memoryview("a b".encode("utf-8")), chunk_size=1) == [(0, 1), (2, 3)]
+
+
+@pytest.mark.parametrize("storage", ["copy", "offsets"])
+def test_snapshot_is_memory_mapped(tmp_path, storage):
+    texts = TEXTS + ["lorem ipsum " * 10000]
+    documents = pd.DataFrame(
+        {"document_id": [0, 1, 2, 3], "document_name": ["a", "b", "c", "d"], "document_text": pd.Series(texts)}
+    )
+    corpus = Corpus(documents, name="test", llm_endpoint=None)
+    corpus.chunk(chunk_size=40, storage=storage)
+    corpus.save(str(tmp_path))
+
+    allocated_bytes = pa.total_allocated_bytes()
+    loaded = Corpus.load(str(tmp_path), llm_endpoint=None)
+    assert pa.total_allocated_bytes() - allocated_bytes < len(texts[-1]) // 10
+    assert isinstance(loaded.documents["document_text"].dtype, pd.ArrowDtype)
+    assert loaded.documents["document_text"].tolist() == texts
+    assert [str(chunk.chunk_text) for chunk in loaded.chunks.chunk_list()] == [
+        str(chunk.chunk_text) for chunk in corpus.chunks.chunk_list()
+    ]
+
+    # overwriting the snapshot leaves the loaded tables valid.
+    loaded.save(str(tmp_path))
+    assert loaded.documents["document_text"].tolist() == texts
+
+
+class EchoLLMEndpoint:
+    def hit(self, input_text):
+        return "A1: hello"
+
+
+def test_extracted_frames_hold_strings():
+    documents = pd.DataFrame({"document_id": [0], "document_name": ["a"], "document_text": [TEXTS[0]]})
+    corpus = Corpus(documents, name="test", llm_endpoint=EchoLLMEndpoint())
+    corpus.chunk(chunk_size=40, storage="offsets")
+    extraction = corpus.extract(["what does it say?"])
+
+    chunk_texts = corpus.chunks.most_recent_extracted_df["chunk_text"].tolist()
+    assert len(chunk_texts) == len(corpus.chunks.df)
+    assert all(isinstance(chunk_text, str) for chunk_text in chunk_texts)
+    assert sorted(chunk_texts) == sorted(str(chunk.chunk_text) for chunk in corpus.chunks.chunk_list())
+    assert extraction.extractions["document_id"].tolist() == [0]
@@ -0,0 +1,89 @@
+import hashlib
+import threading
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from info_extract.endpoints import LLMEndpoint
+from info_extract.info_extract import Corpus
+from info_extract.tuning import answer_matches, recommend, tune, TuningResult
+
+
+def embed(texts):
+    embeddings = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in text.lower().split():
+            embeddings[i, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 64] += 1
+    return embeddings
+
+
+class RecordingLLMEndpoint(LLMEndpoint):
+    """Answers every prompt with Paris, and counts the prompts it receives."""
+
+    def __init__(self):
+        self.prompts = Counter()
+        self._lock = threading.Lock()
+
+    def hit(self, input_text):
+        with self._lock:
+            self.prompts[input_text] += 1
+        return "A1: Paris"
+
+
+def test_tune_sends_each_prompt_once(tmp_path):
+    documents = pd.DataFrame(
+        {
+            "document_id": [0, 1, 2],
+            "document_name": ["a", "b", "c"],
+            "document_text": [
+                "The capital of France is Paris.",
+                "Berlin is the capital of Germany.",
+                "Rome is the capital of Italy.",
+            ],
+        }
+    )
+    endpoint = RecordingLLMEndpoint()
+    corpus = Corpus(documents, name="capitals", llm_endpoint=endpoint)
+    qa_pairs = [("What is the capital of France?", "Paris"), ("Which city is the capital of France?", "Paris")]
+
+    # every document fits in one chunk of either size, so both chunk sizes prompt the same chunks.
+    report = tune(
+        corpus,
+        qa_pairs,
+        chunk_sizes=(1024, 2048),
+        overlaps=(False,),
+        topks=(1, 2),
+        embed_fn=embed,
+        replay_latency=False,
+        cache_dir=str(tmp_path),
+    )
+
+    assert [(result.chunk_size, result.topk) for result in report.results] == [
+        (1024, 1),
+        (1024, 2),
+        (2048, 1),
+        (2048, 2),
+    ]
+    assert all(result.match_rate == 1.0 for result in report.results)
+    assert report.recommended in report.results
+
+    # the configurations made more calls than the endpoint received: the cached prompts weren't re-sent.
+    assert len(endpoint.prompts) > 0
+    assert max(endpoint.prompts.values()) == 1
+    num_calls = sum(result.llm_calls * len(qa_pairs) for result in report.results)
+    assert sum(endpoint.prompts.values()) < num_calls
+    # the corpus being tuned is left as is.
+    assert corpus.chunks is None
+
+
+def test_recommend_fastest_within_budget():
+    def result(topk, latency, match_rate):
+        return TuningResult(2048, False, topk, 10, 2.0, 100.0, 10.0, latency, latency, match_rate)
+
+    results = [result(3, 1.0, 0.5), result(5, 2.0, 0.9), result(10, 3.0, 1.0)]
+    assert recommend(results, min_match_rate=0.8) == results[1]
+    # no configuration meets both budgets: the best match rate is recommended.
+    assert recommend(results, min_match_rate=0.8, max_latency=1.5) == results[2]
+    assert answer_matches("It is Paris.", "paris")
+    assert not answer_matches("It is Paris.", "")
@@ -1,8 +1,7 @@
 import random
 import time
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import os
-import tempfile
 
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -15,10 +14,19 @@ from langchain.embeddings import HuggingFaceInstructEmbeddings, OpenAIEmbeddings
 from langchain.llms import OpenAI
 from langchain.chat_models import ChatOpenAI
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import FAISS
 from langchain.docstore.document import Document
-from langchain.document_loaders import UnstructuredPDFLoader
+from embedding_store import (
+    DEFAULT_EMBEDDING_STORE_PATH,
+    DEFAULT_INDEX_DIR,
+    DEFAULT_MAX_INDICES,
+    CachedEmbeddings,
+    EmbeddingStore,
+    LocalHashingEmbeddings,
+    load_or_build_faiss,
+)
 from html_templates import bot_template, css
+from ingest import iter_pdf_documents
+from pdf_utils import get_pdf_cache
 
 st.session_state.settings = {
     "chunk_size": 1000,
@@ -34,20 +42,32 @@ st.session_state.settings = {
 }
 
 
-def get_pdf_text(pdf_docs) -> List[Document]:
-    documents = []
-    for pdf_doc in pdf_docs:
-        # Write the doc to disk.
-        with tempfile.TemporaryDirectory() as temp_dir:
-            with open(os.path.join(temp_dir, pdf_doc.name), "wb") as f:
-                f.write(pdf_doc.read())
-
-            # data = loader.load()
-            loader = UnstructuredPDFLoader(os.path.join(temp_dir, pdf_doc.name))
-
-            data = loader.load()
-            documents.extend(data)
-    return documents
+def get_pdf_text_and_chunks(
+    pdf_docs, chunk_size: int, chunk_overlap: int
+) -> Tuple[List[Document], List[Document]]:
+    """Parses the uploaded files concurrently and chunks each file as soon as it is
+    parsed, reporting progress per file. Files parsed before, by any process of the
+    app, are read from the disk cache. Returns the documents and their chunks, in
+    upload order."""
+    file_documents_list = [[] for _ in pdf_docs]
+    file_chunks_list = [[] for _ in pdf_docs]
+    progress = st.progress(0.0, text=f"Parsing {len(pdf_docs)} files")
+    for num_done, (position, name, file_documents) in enumerate(
+        iter_pdf_documents(pdf_docs, cache=get_pdf_cache()), start=1
+    ):
+        file_documents_list[position] = file_documents
+        file_chunks_list[position] = get_document_chunks(
+            file_documents, chunk_size, chunk_overlap
+        )
+        progress.progress(
+            num_done / len(pdf_docs), text=f"Parsed {name} ({num_done}/{len(pdf_docs)})"
+        )
+    progress.empty()
+    documents = [
+        document for documents in file_documents_list for document in documents
+    ]
+    document_chunks = [chunk for chunks in file_chunks_list for chunk in chunks]
+    return documents, document_chunks
 
 
 def get_document_chunks(
@@ -75,6 +95,24 @@ def get_llm(llm_name: str, temperature: float):
     return ChatOpenAI(temperature=temperature)
 
 
+@st.cache_resource
+def get_embedding_store() -> EmbeddingStore:
+    """Returns the store of chunk embeddings, shared by every process of the app. Its
+    location is set by PDF_QA_EMBEDDING_STORE_PATH."""
+    return EmbeddingStore(
+        os.environ.get("PDF_QA_EMBEDDING_STORE_PATH", DEFAULT_EMBEDDING_STORE_PATH)
+    )
+
+
+def get_embeddings(embedding_provider: str, embedding_model: str):
+    """Returns the embeddings of the provider, from advanced settings."""
+    if embedding_provider == "openai":
+        return OpenAIEmbeddings(model=embedding_model)
+    if embedding_provider == "local":
+        return LocalHashingEmbeddings()
+    return HuggingFaceInstructEmbeddings(model_name=embedding_model)
+
+
 def get_vectorstore(
     chunks: List[Document],
     embedding_provider: str,
@@ -83,25 +121,31 @@ def get_vectorstore(
     hyde_llm: Optional[str] = None,
     hyde_llm_temperature: Optional[float] = None,
 ):
-    """Returns a FAISS vector store for the given text chunks."""
-    if embedding_provider == "openai":
-        base_embeddings = OpenAIEmbeddings(model=embedding_model)
-    else:
-        base_embeddings = HuggingFaceInstructEmbeddings(model_name=embedding_model)
+    """Returns a FAISS vector store for the given text chunks.
+
+    Chunk embeddings are stored by (embedding model, chunk text), so that only new
+    chunks are embedded, and the index of a set of chunks is saved and reloaded when
+    the same documents are processed again with the same settings.
+    """
+    base_embeddings = CachedEmbeddings(
+        get_embeddings(embedding_provider, embedding_model),
+        f"{embedding_provider}/{embedding_model}",
+        get_embedding_store(),
+    )
 
+    query_embeddings = None
     if use_hyde:
-        embeddings = HypotheticalDocumentEmbedder.from_llm(
+        # HyDE only changes how queries are embedded; chunks use the base embeddings.
+        query_embeddings = HypotheticalDocumentEmbedder.from_llm(
             get_llm(hyde_llm, hyde_llm_temperature), base_embeddings, "web_search"
         )
-        return FAISS.from_texts(
-            texts=[chunk.page_content for chunk in chunks],
-            embedding=embeddings,
-            metadatas=[chunk.metadata for chunk in chunks],
-        )
-    return FAISS.from_texts(
+    return load_or_build_faiss(
         texts=[chunk.page_content for chunk in chunks],
-        embedding=base_embeddings,
         metadatas=[chunk.metadata for chunk in chunks],
+        document_embeddings=base_embeddings,
+        query_embeddings=query_embeddings,
+        index_dir=os.environ.get("PDF_QA_INDEX_DIR", DEFAULT_INDEX_DIR),
+        max_indices=int(os.environ.get("PDF_QA_MAX_INDICES", DEFAULT_MAX_INDICES)),
     )
 
 
@@ -156,9 +200,12 @@ def get_advanced_settings():
 
     embedding_provider = st.radio(
         "Embedding provider",
-        options=["openai", "huggingface"],
+        options=["openai", "huggingface", "local"],
         key="embedding_provider",
-        help="Choose which provider should be used for embedding document chunks.",
+        help=(
+            "Choose which provider should be used for embedding document chunks. "
+            "`local` hashes words offline, without a model or API key."
+        ),
     )
 
     embedding_model_options = []
@@ -169,6 +216,8 @@ def get_advanced_settings():
             "hkunlp/instructor-large",
             "intfloat/e5-base-v2",
         ]
+    elif embedding_provider == "local":
+        embedding_model_options = ["hashing-384"]
     else:
         embedding_model_options = ["text-embedding-ada-002"]
     embedding_model = st.selectbox(
@@ -354,12 +403,12 @@ def main():
             with st.spinner("Processing"):
                 start_time = time.time()
 
-                # Get pdf text.
-                st.session_state.documents = get_pdf_text(docs)
-
-                # Get the text chunks.
-                st.session_state.document_chunks: List[Document] = get_document_chunks(
+                # Get pdf text, and chunk each file as soon as it is parsed.
+                (
                     st.session_state.documents,
+                    st.session_state.document_chunks,
+                ) = get_pdf_text_and_chunks(
+                    docs,
                     st.session_state.settings["chunk_size"],
                     st.session_state.settings["chunk_overlap"],
                 )
@@ -0,0 +1,229 @@
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import FAISS
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pdf_qa")
+DEFAULT_EMBEDDING_STORE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+DEFAULT_INDEX_DIR = os.path.join(CACHE_DIR, "faiss")
+DEFAULT_MAX_INDICES = 16
+# Temp directories of index saves older than this were left by a killed process.
+STALE_TEMP_SECONDS = 3600
+TEMP_PREFIX = ".tmp-"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, text_hash)
+);
+"""
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Embeddings stored as float32 vectors in a SQLite database, keyed by
+    (embedding model, hash of the text). Shared by every process of the app, as the
+    PDF text cache."""
+
+    def __init__(self, path: str = DEFAULT_EMBEDDING_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def get(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """Returns the stored vectors of the given text hashes, by hash."""
+        vectors = {}
+        with self._connect() as connection:
+            # SQLite limits the number of parameters of a query.
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start : start + 500]
+                rows = connection.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE model = ? AND "
+                    f"text_hash IN ({', '.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                for hash_, vector in rows:
+                    vectors[hash_] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return vectors
+
+    def put(self, model: str, vectors: Dict[str, List[float]]):
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [
+                    (model, hash_, np.asarray(vector, dtype=np.float32).tobytes())
+                    for hash_, vector in vectors.items()
+                ],
+            )
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeds documents with `embeddings`, reusing the vectors of `store` for texts
+    already embedded by the same model. Queries aren't cached."""
+
+    def __init__(self, embeddings: Embeddings, model: str, store: EmbeddingStore):
+        self.embeddings = embeddings
+        self.model = model
+        self.store = store
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.store.get(self.model, list(set(hashes)))
+        missing = {
+            hash_: text for hash_, text in zip(hashes, texts) if hash_ not in vectors
+        }
+        if missing:
+            embedded = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), embedded))
+            self.store.put(self.model, new_vectors)
+            vectors.update(new_vectors)
+        print(f"Embedded {len(missing)} new chunks out of {len(texts)} ({self.model}).")
+        return [vectors[hash_] for hash_ in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+class LocalHashingEmbeddings(Embeddings):
+    """Offline embedding stand-in: hashes the words of a text into a fixed number of
+    signed buckets, and normalizes the counts. Needs no model nor API key, so that the
+    app can be run and tested without network access."""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def document_set_key(model: str, texts: List[str], metadatas: List[dict]) -> str:
+    """Returns the key of a set of chunks embedded by `model`, from their text and
+    metadata. The order of the chunks doesn't matter."""
+    entries = []
+    for text, metadata in zip(texts, metadatas):
+        # Uploads are parsed from temp directories, so only the file name of the
+        # source identifies a document.
+        metadata = dict(metadata)
+        if "source" in metadata:
+            metadata["source"] = os.path.basename(metadata["source"])
+        entries.append((text_hash(text), repr(sorted(metadata.items()))))
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for hash_, metadata in sorted(entries):
+        digest.update(hash_.encode("utf-8"))
+        digest.update(metadata.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def prune_indices(index_dir: str, max_indices: int, keep: str):
+    """Deletes the least recently used saved indices of `index_dir` beyond
+    `max_indices`, except `keep`, and the stale temp directories of saves."""
+    now = time.time()
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if name.startswith(TEMP_PREFIX) and now - _mtime(path) > STALE_TEMP_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
+
+    paths = [
+        os.path.join(index_dir, name)
+        for name in os.listdir(index_dir)
+        if re.fullmatch(r"[0-9a-f]{64}", name) and name != keep
+    ]
+    paths.sort(key=_mtime, reverse=True)
+    for path in paths[max(max_indices - 1, 0) :]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        # Deleted concurrently.
+        return 0.0
+
+
+def load_or_build_faiss(
+    texts: List[str],
+    metadatas: List[dict],
+    document_embeddings: CachedEmbeddings,
+    query_embeddings: Optional[Embeddings] = None,
+    index_dir: str = DEFAULT_INDEX_DIR,
+    max_indices: int = DEFAULT_MAX_INDICES,
+) -> FAISS:
+    """Returns the FAISS index of the chunks, loaded from `index_dir` if the same
+    chunks were already indexed with the same model. Otherwise the index is built from
+    the stored embeddings (embedding only the new chunks) and saved.
+
+    At most `max_indices` indices are kept in `index_dir`, the least recently used are
+    deleted first.
+
+    `query_embeddings`, e.g. HyDE, embeds the queries of the index. It defaults to
+    `document_embeddings`.
+    """
+    query_embeddings = query_embeddings or document_embeddings
+    key = document_set_key(document_embeddings.model, texts, metadatas)
+    path = os.path.join(index_dir, key)
+    if os.path.isdir(path):
+        try:
+            os.utime(path)
+            print(f"Loading the FAISS index from {path}.")
+            return FAISS.load_local(path, query_embeddings)
+        except (OSError, RuntimeError):
+            # Pruned concurrently by another process.
+            print(f"Failed to load the FAISS index from {path}, rebuilding it.")
+
+    vectors = document_embeddings.embed_documents(texts)
+    vectorstore = FAISS.from_embeddings(
+        list(zip(texts, vectors)), query_embeddings, metadatas=metadatas
+    )
+    # Saved to a temp directory first, so that other processes never load a partial
+    # index.
+    os.makedirs(index_dir, exist_ok=True)
+    temp_path = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=index_dir)
+    try:
+        vectorstore.save_local(temp_path)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Saved concurrently by another process.
+            pass
+    finally:
+        # Still there if the save failed or the index was saved concurrently.
+        shutil.rmtree(temp_path, ignore_errors=True)
+    prune_indices(index_dir, max_indices, keep=key)
+    return vectorstore
@@ -0,0 +1,115 @@
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.document_loaders import UnstructuredPDFLoader
+
+from pdf_cache import PDFTextCache, cache_key
+
+# Extraction mode of the cache keys of documents parsed by UnstructuredPDFLoader.
+UNSTRUCTURED_MODE = "unstructured"
+
+
+def load_pdf_documents(name: str, data: bytes) -> List[Document]:
+    """Parses one uploaded PDF, written to a temp directory under its file name."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return UnstructuredPDFLoader(path).load()
+
+
+def load_pdf_texts(name: str, data: bytes) -> List[str]:
+    return [document.page_content for document in load_pdf_documents(name, data)]
+
+
+def to_documents(name: str, texts: List[str]) -> List[Document]:
+    return [Document(page_content=text, metadata={"source": name}) for text in texts]
+
+
+def iter_pdf_documents(
+    pdf_docs, workers: Optional[int] = None, cache: Optional[PDFTextCache] = None
+) -> Iterator[Tuple[int, str, List[Document]]]:
+    """Yields (position in `pdf_docs`, file name, documents) for every uploaded PDF, as
+    soon as it is parsed. The source of each document is the file name.
+
+    Uploads with the same content are parsed once, and files already in `cache` aren't
+    parsed again: they are yielded first. The other files are parsed concurrently by a
+    pool of `workers` processes (one per core by default), stored in `cache`, and
+    yielded in the order they finish: use the positions to restore the upload order.
+    At most two files per worker are in flight, so memory stays bounded for large
+    uploads.
+    """
+    # Positions and uploads of each distinct file, by cache key.
+    uploads: Dict[str, List[Tuple[int, object]]] = {}
+    for position, pdf_doc in enumerate(pdf_docs):
+        key = cache_key(pdf_doc.getvalue(), UNSTRUCTURED_MODE)
+        uploads.setdefault(key, []).append((position, pdf_doc))
+
+    to_parse = []
+    for key, files in uploads.items():
+        texts = cache.get(key) if cache is not None else None
+        if texts is None:
+            to_parse.append(key)
+        else:
+            yield from _file_documents(files, texts)
+
+    workers = min(workers or os.cpu_count() or 1, len(to_parse))
+    if workers <= 1:
+        for key in to_parse:
+            _, pdf_doc = uploads[key][0]
+            texts = load_pdf_texts(pdf_doc.name, pdf_doc.getvalue())
+            yield from _parsed_file_documents(uploads[key], key, texts, cache)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = {}
+    try:
+        for key in to_parse:
+            _, pdf_doc = uploads[key][0]
+            future = executor.submit(load_pdf_texts, pdf_doc.name, pdf_doc.getvalue())
+            pending[future] = key
+            if len(pending) == 2 * workers:
+                yield from _completed_files(pending, uploads, cache)
+        while pending:
+            yield from _completed_files(pending, uploads, cache)
+    finally:
+        # the consumer may stop early, e.g. on an error.
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def _file_documents(
+    files: List[Tuple[int, object]], texts: List[str]
+) -> Iterator[Tuple[int, str, List[Document]]]:
+    for position, pdf_doc in files:
+        yield position, pdf_doc.name, to_documents(pdf_doc.name, texts)
+
+
+def _parsed_file_documents(
+    files: List[Tuple[int, object]],
+    key: str,
+    texts: List[str],
+    cache: Optional[PDFTextCache],
+) -> Iterator[Tuple[int, str, List[Document]]]:
+    if cache is not None:
+        cache.put(key, texts)
+    yield from _file_documents(files, texts)
+
+
+def _completed_files(
+    pending: dict, uploads: dict, cache: Optional[PDFTextCache]
+) -> Iterator[Tuple[int, str, List[Document]]]:
+    """Waits for at least one file, and yields the files that are parsed."""
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        key = pending.pop(future)
+        try:
+            texts = future.result()
+        except Exception as exc:
+            _, pdf_doc = uploads[key][0]
+            raise RuntimeError(f"Failed to parse `{pdf_doc.name}`.") from exc
+        yield from _parsed_file_documents(uploads[key], key, texts, cache)
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "pdf_qa", "pdf_text.sqlite3"
+)
+DEFAULT_MAX_BYTES = 1024**3
+TOUCH_INTERVAL_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    key TEXT PRIMARY KEY,
+    num_pages INTEGER NOT NULL,
+    num_bytes INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_last_access ON documents (last_access);
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    text BLOB NOT NULL,
+    PRIMARY KEY (key, page_number)
+);
+"""
+
+
+def cache_key(
+    pdf_bytes: bytes,
+    mode: str,
+    language: Optional[str] = None,
+    dpi: Optional[int] = None,
+) -> str:
+    """Returns the cache key of the pages of a PDF extracted with the given settings.
+    The language and DPI only matter when pages may be OCR'd by the app."""
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    if mode == "text" or language is None:
+        return f"{digest}:{mode}"
+    return f"{digest}:{mode}:{language}:{dpi}"
+
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"))
+
+
+def decompress_text(blob: bytes) -> str:
+    return zlib.decompress(blob).decode("utf-8")
+
+
+class PDFTextCache:
+    """Per-page text of parsed PDFs, stored zlib-compressed in a SQLite database.
+
+    The database runs in WAL mode, so that the Streamlit workers and restarts of the app
+    can share it. Whole documents are evicted, least recently used first, when the
+    stored text exceeds `max_bytes`.
+    """
+
+    def __init__(
+        self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One connection per operation, so that the cache can be used from any thread.
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Returns the page texts stored under `key`, or None."""
+        with self._connect() as connection:
+            # A read transaction sees one snapshot of the database, so that a
+            # concurrent eviction can't remove the pages after the document is found.
+            connection.execute("BEGIN")
+            document = connection.execute(
+                "SELECT last_access FROM documents WHERE key = ?", (key,)
+            ).fetchone()
+            rows = connection.execute(
+                "SELECT text FROM pages WHERE key = ? ORDER BY page_number", (key,)
+            ).fetchall()
+            connection.execute("COMMIT")
+            if document is None:
+                return None
+
+            # The access time is only for eviction: it is updated at most once per
+            # interval, so that most reads don't write.
+            now = time.time()
+            if now - document[0] > TOUCH_INTERVAL_SECONDS:
+                connection.execute(
+                    "UPDATE documents SET last_access = ? WHERE key = ?", (now, key)
+                )
+        return [decompress_text(blob) for (blob,) in rows]
+
+    def put(self, key: str, texts: List[str]):
+        """Stores the page texts of a document under `key`, and evicts the least
+        recently used documents beyond `max_bytes`."""
+        self._put_compressed(key, [compress_text(text) for text in texts])
+
+    def _put_compressed(self, key: str, blobs: List[bytes]):
+        num_bytes = sum(len(blob) for blob in blobs)
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM pages WHERE key = ?", (key,))
+                connection.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                    (key, len(blobs), num_bytes, time.time()),
+                )
+                connection.executemany(
+                    "INSERT INTO pages VALUES (?, ?, ?)",
+                    [(key, number, blob) for number, blob in enumerate(blobs)],
+                )
+                self._evict(connection, keep=key)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self, connection: sqlite3.Connection, keep: str):
+        (total_bytes,) = connection.execute(
+            "SELECT COALESCE(SUM(num_bytes), 0) FROM documents"
+        ).fetchone()
+        if total_bytes <= self.max_bytes:
+            return
+        for key, num_bytes in connection.execute(
+            "SELECT key, num_bytes FROM documents WHERE key != ? ORDER BY last_access",
+            (keep,),
+        ).fetchall():
+            connection.execute("DELETE FROM pages WHERE key = ?", (key,))
+            connection.execute("DELETE FROM documents WHERE key = ?", (key,))
+            total_bytes -= num_bytes
+            if total_bytes <= self.max_bytes:
+                break
+
+    def iter_pages(
+        self, key: str, extract_pages: Callable[[], Iterator[Tuple[int, str]]]
+    ) -> Iterator[Tuple[int, str]]:
+        """Yields the (page_number, text) stored under `key`, or the pages of
+        `extract_pages()` as they are extracted. Extracted pages are stored once the
+        document is complete."""
+        texts = self.get(key)
+        if texts is not None:
+            yield from enumerate(texts)
+            return
+
+        blobs = []
+        for page_number, text in extract_pages():
+            blobs.append(compress_text(text))
+            yield page_number, text
+        self._put_compressed(key, blobs)
+
+    def stats(self) -> dict:
+        with self._connect() as connection:
+            num_documents, num_bytes = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(num_bytes), 0) FROM documents"
+            ).fetchone()
+        return {"num_documents": num_documents, "num_bytes": num_bytes}
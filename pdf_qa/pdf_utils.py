@@ -1,94 +1,399 @@
+import os
+import re
 import streamlit as st
-from zipfile import ZipFile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+from zipfile import ZIP_DEFLATED, ZipFile
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.converter import TextConverter
 from pdfminer.layout import LAParams
+from pdfminer.pdfdocument import PDFDocument
 from pdfminer.pdfpage import PDFPage
-from io import StringIO
+from pdfminer.pdfparser import PDFParser
+from io import BytesIO, StringIO
 import base64
+from pdf_cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, PDFTextCache, cache_key
 
 # ------- OCR ------------
 import pdf2image
 import pytesseract
 
 
+# Resolution pages are rasterized at, and number of pages rasterized at once per task.
+OCR_DPI = 200
+OCR_PAGES_PER_TASK = 4
+
+# PDF bytes held once per OCR worker process, by the pool initializer.
+_worker_pdf_bytes = None
+
+
+def ocr_page_range(
+    pdf_bytes: bytes, first_page: int, last_page: int, language, dpi: int = OCR_DPI
+) -> List[str]:
+    """Returns the OCR'd text of pages [first_page, last_page). Each page image is
+    released as soon as it is OCR'd."""
+    images = pdf2image.convert_from_bytes(
+        pdf_bytes, dpi=dpi, first_page=first_page + 1, last_page=last_page
+    )
+    texts = []
+    while images:
+        image = images.pop(0)
+        texts.append(pytesseract.image_to_string(image, lang=language))
+        image.close()
+    return texts
+
+
+def _init_ocr_worker(pdf_bytes: bytes):
+    global _worker_pdf_bytes
+    _worker_pdf_bytes = pdf_bytes
+    # One Tesseract thread per process, the pool provides the parallelism.
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _ocr_page_range_in_worker(first_page: int, last_page: int, language, dpi: int):
+    return ocr_page_range(_worker_pdf_bytes, first_page, last_page, language, dpi)
+
+
+def iter_images_txt(
+    pdf_file,
+    language,
+    dpi: int = OCR_DPI,
+    workers: Optional[int] = None,
+    pages_per_task: int = OCR_PAGES_PER_TASK,
+) -> Iterator[Tuple[int, str]]:
+    """Yields (page_number, text) for every page of a PDF, in order, as soon as the
+    page is OCR'd. Page numbers start at 0.
+
+    Pages are rasterized at `dpi` in batches of `pages_per_task` pages and OCR'd by a
+    pool of `workers` processes (one per core by default), so at most
+    `2 * workers * pages_per_task` page images exist at any time.
+    """
+    pdf_bytes = read_pdf_bytes(pdf_file)
+    num_pages = pdf2image.pdfinfo_from_bytes(pdf_bytes)["Pages"]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or num_pages <= pages_per_task:
+        for first_page, last_page in page_ranges(num_pages, pages_per_task):
+            texts = ocr_page_range(pdf_bytes, first_page, last_page, language, dpi)
+            yield from enumerate(texts, start=first_page)
+        return
+
+    yield from iter_pool_pages(
+        partial(_ocr_page_range_in_worker, language=language, dpi=dpi),
+        page_ranges(num_pages, pages_per_task),
+        workers,
+        initializer=_init_ocr_worker,
+        initargs=(pdf_bytes,),
+    )
+
+
 @st.cache_data
 def images_to_txt(path, language):
-    images = pdf2image.convert_from_bytes(path)
-    all_text = []
-    for i in images:
-        pil_im = i
-        text = pytesseract.image_to_string(pil_im, lang=language)
-        all_text.append(text)
+    all_text = [text for _, text in iter_cached_pages(path, "ocr", language)]
     return all_text, len(all_text)
 
 
-@st.cache_data
-def convert_pdf_to_txt_pages(path):
-    texts = []
+# Number of pages extracted per task by the process pool.
+PAGES_PER_TASK = 16
+
+# PDF document parsed once per worker process, by the pool initializer.
+_worker_document = None
+
+
+def read_pdf_bytes(pdf_file) -> bytes:
+    """Returns the bytes of a PDF given as bytes, a path or a file-like object."""
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return bytes(pdf_file)
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as f:
+            return f.read()
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+
+def page_ranges(num_pages: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    return [
+        (first_page, min(first_page + pages_per_task, num_pages))
+        for first_page in range(0, num_pages, pages_per_task)
+    ]
+
+
+def iter_pool_pages(
+    fn, ranges: List[Tuple[int, int]], workers: int, initializer, initargs
+) -> Iterator[Tuple[int, str]]:
+    """Runs `fn(first_page, last_page)`, which returns the text of each page of the
+    range, over page ranges in a process pool, and yields (page_number, text) in page
+    order. At most two ranges per worker are in flight, so memory doesn't grow with
+    the document when the consumer is slow."""
+    workers = min(workers, len(ranges))
+    executor = ProcessPoolExecutor(
+        max_workers=workers, initializer=initializer, initargs=initargs
+    )
+    pending = deque()
+    try:
+        for first_page, last_page in ranges:
+            pending.append((first_page, executor.submit(fn, first_page, last_page)))
+            if len(pending) == 2 * workers:
+                yield from _completed_range(*pending.popleft())
+        while pending:
+            yield from _completed_range(*pending.popleft())
+    finally:
+        # the consumer may stop early, e.g. on an error.
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def _completed_range(first_page: int, future) -> Iterator[Tuple[int, str]]:
+    return enumerate(future.result(), start=first_page)
+
+
+def open_pdf_document(pdf_bytes: bytes) -> PDFDocument:
+    return PDFDocument(PDFParser(BytesIO(pdf_bytes)))
+
+
+def count_pdf_pages(document: PDFDocument) -> int:
+    """Returns the number of pages of a PDF, without parsing the page contents."""
+    return sum(1 for _ in PDFPage.create_pages(document))
+
+
+def iter_page_range(
+    document: PDFDocument, first_page: int = 0, last_page: Optional[int] = None
+) -> Iterator[str]:
+    """Yields the text of pages [first_page, last_page), one buffer per page."""
     rsrcmgr = PDFResourceManager()
-    retstr = StringIO()
     laparams = LAParams()
-    device = TextConverter(rsrcmgr, retstr, laparams=laparams)
-    # fp = open(path, 'rb')
-    interpreter = PDFPageInterpreter(rsrcmgr, device)
-    size = 0
-    c = 0
-    file_pages = PDFPage.get_pages(path)
-    num_pages = len(list(file_pages))
-    for page in PDFPage.get_pages(path):
-        interpreter.process_page(page)
-        t = retstr.getvalue()
-        if c == 0:
-            texts.append(t)
-        else:
-            texts.append(t[size:])
-        c = c + 1
-        size = len(t)
-    # text = retstr.getvalue()
-
-    # fp.close()
-    device.close()
-    retstr.close()
-    return texts, num_pages
+    for page in islice(PDFPage.create_pages(document), first_page, last_page):
+        page_buffer = StringIO()
+        device = TextConverter(rsrcmgr, page_buffer, laparams=laparams)
+        PDFPageInterpreter(rsrcmgr, device).process_page(page)
+        device.close()
+        yield page_buffer.getvalue()
+
+
+def extract_page_range(
+    document: PDFDocument, first_page: int = 0, last_page: Optional[int] = None
+) -> List[str]:
+    """Returns the text of pages [first_page, last_page), one buffer per page."""
+    return list(iter_page_range(document, first_page, last_page))
+
+
+def _init_page_worker(pdf_bytes: bytes):
+    global _worker_document
+    _worker_document = open_pdf_document(pdf_bytes)
+
+
+def _extract_page_range_in_worker(first_page: int, last_page: int) -> List[str]:
+    return extract_page_range(_worker_document, first_page, last_page)
+
+
+def iter_pdf_pages(
+    pdf_file, workers: Optional[int] = None, pages_per_task: int = PAGES_PER_TASK
+) -> Iterator[Tuple[int, str]]:
+    """Yields (page_number, text) for every page of a PDF, in order, as soon as the
+    page is extracted. Page numbers start at 0.
+
+    Documents longer than `pages_per_task` pages are split into page ranges extracted
+    by a pool of `workers` processes (one per core by default). Each worker parses the
+    PDF once, from the bytes it receives when it starts.
+    """
+    pdf_bytes = read_pdf_bytes(pdf_file)
+    document = open_pdf_document(pdf_bytes)
+    workers = workers or os.cpu_count() or 1
+    num_pages = count_pdf_pages(document) if workers > 1 else 0
+    if num_pages <= pages_per_task:
+        yield from enumerate(iter_page_range(document))
+        return
+
+    yield from iter_pool_pages(
+        _extract_page_range_in_worker,
+        page_ranges(num_pages, pages_per_task),
+        workers,
+        initializer=_init_page_worker,
+        initargs=(pdf_bytes,),
+    )
+
+
+def extract_pdf_pages(
+    pdf_file, workers: Optional[int] = None, pages_per_task: int = PAGES_PER_TASK
+) -> List[str]:
+    """Returns the text of every page of a PDF, see `iter_pdf_pages`."""
+    return [text for _, text in iter_pdf_pages(pdf_file, workers, pages_per_task)]
+
+
+@st.cache_data
+def convert_pdf_to_txt_pages(path):
+    texts = [text for _, text in iter_cached_pages(path, "text")]
+    return texts, len(texts)
 
 
 @st.cache_data
 def convert_pdf_to_txt_file(pdf_file):
     """Adapted from https://discuss.streamlit.io/t/text-data-extractor-pdf-to-text/25210."""
-    rsrcmgr = PDFResourceManager()
-    return_string = StringIO()
-    laparams = LAParams()
-    device = TextConverter(rsrcmgr, return_string, laparams=laparams)
-    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    texts = [text for _, text in iter_cached_pages(pdf_file, "text")]
+    return "".join(texts), len(texts)
+
+
+# ------- Hybrid text layer / OCR ------------
+EXTRACTION_MODES = ("text", "ocr", "auto")
 
-    file_pages = PDFPage.get_pages(pdf_file)
-    num_pages = len(list(file_pages))
-    for page in PDFPage.get_pages(pdf_file):
-        text = return_string.getvalue()
-        interpreter.process_page(page)
+# A text layer with fewer visible characters, or a lower share of letters and digits
+# among them, is considered missing or garbage and its page is OCR'd.
+MIN_TEXT_LAYER_CHARS = 20
+MIN_TEXT_LAYER_ALNUM_RATIO = 0.5
+# Glyphs pdfminer couldn't map to characters.
+CID_PATTERN = re.compile(r"\(cid:\d+\)")
 
-    device.close()
-    return_string.close()
-    return text, num_pages
+
+def needs_ocr(text: str) -> bool:
+    """Whether the text layer of a page is empty or garbage, e.g. unmapped glyphs."""
+    visible = "".join(CID_PATTERN.sub("\ufffd", text).split())
+    if len(visible) < MIN_TEXT_LAYER_CHARS:
+        return True
+    return sum(c.isalnum() for c in visible) / len(visible) < MIN_TEXT_LAYER_ALNUM_RATIO
+
+
+def iter_hybrid_pages(
+    pdf_file, language, dpi: int = OCR_DPI, workers: Optional[int] = None
+) -> Iterator[Tuple[int, str]]:
+    """Yields (page_number, text) for every page of a PDF, in order, taking the text
+    layer of each page and OCR'ing only the pages whose text layer is empty or garbage.
+    Page numbers start at 0.
+
+    The `workers` processes (one per core by default) are split between the two
+    pools, so that together they don't oversubscribe the cores. Text layers are
+    extracted as in `iter_pdf_pages`, by half of them. Pages needing OCR are sent to a
+    separate pool of the other half as soon as they are found, which is only started
+    if the document has such pages.
+    """
+    pdf_bytes = read_pdf_bytes(pdf_file)
+    workers = workers or os.cpu_count() or 1
+    text_workers = max(workers // 2, 1)
+    ocr_workers = max(workers - text_workers, 1)
+    ocr_executor = None
+    # (page_number, text or future of its OCR), in page order.
+    pending = deque()
+    try:
+        for page_number, text in iter_pdf_pages(pdf_bytes, workers=text_workers):
+            if needs_ocr(text):
+                if workers == 1:
+                    text = ocr_page_range(
+                        pdf_bytes, page_number, page_number + 1, language, dpi
+                    )[0]
+                else:
+                    if ocr_executor is None:
+                        ocr_executor = ProcessPoolExecutor(
+                            max_workers=ocr_workers,
+                            initializer=_init_ocr_worker,
+                            initargs=(pdf_bytes,),
+                        )
+                    text = ocr_executor.submit(
+                        _ocr_page_range_in_worker,
+                        page_number,
+                        page_number + 1,
+                        language,
+                        dpi,
+                    )
+            pending.append((page_number, text))
+
+            # Yield the pages that are ready, and wait for the oldest page when too
+            # many are being OCR'd.
+            while pending and (
+                _is_ready(pending[0][1])
+                or sum(not isinstance(item, str) for _, item in pending)
+                > 2 * ocr_workers
+            ):
+                yield _resolved_page(*pending.popleft())
+        while pending:
+            yield _resolved_page(*pending.popleft())
+    finally:
+        for _, item in pending:
+            if not isinstance(item, str):
+                item.cancel()
+        if ocr_executor is not None:
+            ocr_executor.shutdown()
+
+
+def _is_ready(item) -> bool:
+    return isinstance(item, str) or item.done()
+
+
+def _resolved_page(page_number: int, item) -> Tuple[int, str]:
+    return page_number, item if isinstance(item, str) else item.result()[0]
+
+
+def iter_pages(
+    pdf_file,
+    mode: str = "auto",
+    language="eng",
+    dpi: int = OCR_DPI,
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, str]]:
+    """Yields (page_number, text) for every page of a PDF, with the text layer ("text"),
+    OCR ("ocr"), or the text layer and OCR for the pages without one ("auto")."""
+    if mode == "text":
+        return iter_pdf_pages(pdf_file, workers=workers)
+    if mode == "ocr":
+        return iter_images_txt(pdf_file, language, dpi=dpi, workers=workers)
+    if mode == "auto":
+        return iter_hybrid_pages(pdf_file, language, dpi=dpi, workers=workers)
+    raise ValueError(
+        f"Invalid extraction mode `{mode}`, expected one of {EXTRACTION_MODES}."
+    )
+
+
+@st.cache_resource
+def get_pdf_cache() -> PDFTextCache:
+    """Returns the disk cache of extracted pages, shared by every process of the app.
+    Its location and size are set by PDF_QA_CACHE_PATH and PDF_QA_CACHE_MAX_BYTES."""
+    return PDFTextCache(
+        path=os.environ.get("PDF_QA_CACHE_PATH", DEFAULT_CACHE_PATH),
+        max_bytes=int(os.environ.get("PDF_QA_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+    )
+
+
+def iter_cached_pages(
+    pdf_file,
+    mode: str = "auto",
+    language="eng",
+    dpi: int = OCR_DPI,
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, str]]:
+    """Same as `iter_pages`, but serves the pages from the disk cache when the same
+    PDF was already extracted with the same settings, by any process."""
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(
+            f"Invalid extraction mode `{mode}`, expected one of {EXTRACTION_MODES}."
+        )
+    pdf_bytes = read_pdf_bytes(pdf_file)
+    return get_pdf_cache().iter_pages(
+        cache_key(pdf_bytes, mode, language, dpi),
+        lambda: iter_pages(pdf_bytes, mode, language, dpi=dpi, workers=workers),
+    )
 
 
 @st.cache_data
-def save_pages(pages):
-    files = []
-    for page in range(len(pages)):
-        filename = "page_" + str(page) + ".txt"
-        with open("./file_pages/" + filename, "w", encoding="utf-8") as file:
-            file.write(pages[page])
-            files.append(file.name)
-
-    # create zipfile object
-    zip_path = "./file_pages/pdf_to_txt.zip"
-    zip_obj = ZipFile(zip_path, "w")
-    for f in files:
-        zip_obj.write(f)
-    zip_obj.close()
+def convert_pdf_to_txt_pages_auto(path, language):
+    texts = [text for _, text in iter_cached_pages(path, "auto", language)]
+    return texts, len(texts)
+
+
+def save_pages(pages, zip_path: str = "./file_pages/pdf_to_txt.zip") -> str:
+    """Writes pages to a ZIP archive, one "file_pages/page_<n>.txt" entry per page.
 
+    `pages` is either a list of page texts, or an iterable of (page_number, text) such
+    as `iter_pdf_pages`, whose pages are written as they are produced.
+    """
+    os.makedirs(os.path.dirname(zip_path) or ".", exist_ok=True)
+    with ZipFile(zip_path, "w", compression=ZIP_DEFLATED) as zip_obj:
+        for page_number, page in enumerate(pages):
+            if not isinstance(page, str):
+                page_number, page = page
+            zip_obj.writestr(f"file_pages/page_{page_number}.txt", page)
     return zip_path
 
 
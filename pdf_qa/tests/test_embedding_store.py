@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pytest
+
+from embedding_store import (
+    TEMP_PREFIX,
+    CachedEmbeddings,
+    EmbeddingStore,
+    LocalHashingEmbeddings,
+    load_or_build_faiss,
+    prune_indices,
+)
+
+
+class CountingEmbeddings(LocalHashingEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def embeddings(tmp_path):
+    inner = CountingEmbeddings()
+    store = EmbeddingStore(str(tmp_path / "embeddings.sqlite3"))
+    return CachedEmbeddings(inner, "local-hashing", store)
+
+
+TEXTS = ["revenue was $10M in 2022", "the CEO is Jane Doe", "the company is in Paris"]
+METADATAS = [{"source": "a.pdf"}, {"source": "a.pdf"}, {"source": "b.pdf"}]
+
+
+def test_cached_embeddings_only_embed_new_texts(embeddings):
+    vectors = embeddings.embed_documents(TEXTS[:2])
+    assert embeddings.embeddings.embedded == TEXTS[:2]
+
+    np.testing.assert_allclose(embeddings.embed_documents(TEXTS[:2]), vectors)
+    assert embeddings.embeddings.embedded == TEXTS[:2]
+
+    embeddings.embed_documents(TEXTS)
+    assert embeddings.embeddings.embedded == TEXTS
+
+
+def test_load_or_build_faiss_reuses_the_index_of_the_same_chunks(tmp_path, embeddings):
+    index_dir = str(tmp_path / "faiss")
+    load_or_build_faiss(TEXTS, METADATAS, embeddings, index_dir=index_dir)
+    assert len(os.listdir(index_dir)) == 1
+    embedded = list(embeddings.embeddings.embedded)
+
+    # a loaded index neither embeds the chunks nor reads the embedding store.
+    embeddings.store = None
+    vectorstore = load_or_build_faiss(TEXTS, METADATAS, embeddings, index_dir=index_dir)
+    assert embeddings.embeddings.embedded == embedded
+    assert len(os.listdir(index_dir)) == 1
+    document = vectorstore.similarity_search("who is the CEO", k=1)[0]
+    assert document.page_content == "the CEO is Jane Doe"
+
+
+def test_load_or_build_faiss_rebuilds_when_the_chunks_change(tmp_path, embeddings):
+    index_dir = str(tmp_path / "faiss")
+    load_or_build_faiss(TEXTS[:2], METADATAS[:2], embeddings, index_dir=index_dir)
+    (first,) = os.listdir(index_dir)
+
+    vectorstore = load_or_build_faiss(TEXTS, METADATAS, embeddings, index_dir=index_dir)
+    # only the new chunk is embedded, the others are read from the embedding store.
+    assert embeddings.embeddings.embedded == TEXTS
+    assert len(vectorstore.index_to_docstore_id) == 3
+    assert set(os.listdir(index_dir)) - {first} != set()
+
+    # the same chunks with other metadata are another index.
+    metadatas = [{"source": "c.pdf"}] * 3
+    load_or_build_faiss(TEXTS, metadatas, embeddings, index_dir=index_dir)
+    assert len(os.listdir(index_dir)) == 3
+
+
+def test_failed_save_leaves_no_temp_directory(tmp_path, embeddings, monkeypatch):
+    index_dir = str(tmp_path / "faiss")
+
+    def save_local(self, path):
+        open(os.path.join(path, "index.faiss"), "w").close()
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr("embedding_store.FAISS.save_local", save_local)
+    with pytest.raises(OSError):
+        load_or_build_faiss(TEXTS, METADATAS, embeddings, index_dir=index_dir)
+    assert os.listdir(index_dir) == []
+
+
+def test_prune_indices_removes_stale_temp_directories(tmp_path):
+    stale = tmp_path / f"{TEMP_PREFIX}stale"
+    recent = tmp_path / f"{TEMP_PREFIX}recent"
+    stale.mkdir()
+    recent.mkdir()
+    os.utime(stale, (0, 0))
+
+    prune_indices(str(tmp_path), max_indices=4, keep="")
+    assert os.listdir(tmp_path) == [recent.name]
@@ -0,0 +1,69 @@
+import ingest
+from ingest import iter_pdf_documents
+from pdf_cache import PDFTextCache
+
+
+class Upload:
+    """Stand-in for the files of `st.file_uploader`."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    def getvalue(self):
+        return self.data
+
+
+def fake_load_pdf_texts(name, data):
+    return [f"{data.decode()}, page {i}" for i in range(2)]
+
+
+def test_parses_each_distinct_file_once(tmp_path, monkeypatch):
+    parsed = []
+
+    def load_pdf_texts(name, data):
+        parsed.append(name)
+        return fake_load_pdf_texts(name, data)
+
+    monkeypatch.setattr(ingest, "load_pdf_texts", load_pdf_texts)
+    cache = PDFTextCache(str(tmp_path / "pdf_text.sqlite3"))
+    uploads = [Upload("a.pdf", b"A"), Upload("b.pdf", b"B"), Upload("copy.pdf", b"A")]
+
+    files = sorted(iter_pdf_documents(uploads, workers=1, cache=cache))
+    assert parsed == ["a.pdf", "b.pdf"]
+    assert [(position, name) for position, name, _ in files] == [
+        (0, "a.pdf"),
+        (1, "b.pdf"),
+        (2, "copy.pdf"),
+    ]
+    assert [document.page_content for document in files[2][2]] == [
+        "A, page 0",
+        "A, page 1",
+    ]
+    assert files[2][2][0].metadata == {"source": "copy.pdf"}
+
+    # files already cached, e.g. by another process of the app, aren't parsed again.
+    uploads.append(Upload("c.pdf", b"C"))
+    files = sorted(iter_pdf_documents(uploads, workers=1, cache=cache))
+    assert parsed == ["a.pdf", "b.pdf", "c.pdf"]
+    assert [name for _, name, _ in files] == ["a.pdf", "b.pdf", "copy.pdf", "c.pdf"]
+    assert [document.page_content for document in files[3][2]] == [
+        "C, page 0",
+        "C, page 1",
+    ]
+
+
+def test_parallel_parsing_fills_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "load_pdf_texts", fake_load_pdf_texts)
+    cache = PDFTextCache(str(tmp_path / "pdf_text.sqlite3"))
+    uploads = [Upload(f"{i}.pdf", b"%d" % i) for i in range(6)]
+
+    files = sorted(iter_pdf_documents(uploads, workers=3, cache=cache))
+    assert [name for _, name, _ in files] == [f"{i}.pdf" for i in range(6)]
+    assert cache.stats()["num_documents"] == 6
+
+    def fail(name, data):
+        raise AssertionError(f"{name} was parsed again.")
+
+    monkeypatch.setattr(ingest, "load_pdf_texts", fail)
+    assert sorted(iter_pdf_documents(uploads, workers=3, cache=cache)) == files
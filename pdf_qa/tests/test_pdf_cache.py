@@ -0,0 +1,70 @@
+import pdf_cache
+from pdf_cache import PDFTextCache, cache_key
+
+
+def extract(texts, extracted):
+    def extract_pages():
+        for page_number, text in enumerate(texts):
+            extracted.append(page_number)
+            yield page_number, text
+
+    return extract_pages
+
+
+def test_round_trip(tmp_path):
+    cache = PDFTextCache(str(tmp_path / "pdf_text.sqlite3"))
+    key = cache_key(b"%PDF-1.4 first", "auto", "eng", 200)
+    assert cache.get(key) is None
+
+    cache.put(key, ["page one", "", "page three"])
+    assert cache.get(key) == ["page one", "", "page three"]
+    # shared with the other processes through the database file.
+    assert PDFTextCache(cache.path).get(key) == ["page one", "", "page three"]
+    assert cache.stats()["num_documents"] == 1
+
+
+def test_key_changes_with_the_pdf_and_the_settings():
+    key = cache_key(b"%PDF-1.4 first", "auto", "eng", 200)
+    assert cache_key(b"%PDF-1.4 first", "auto", "eng", 200) == key
+    assert cache_key(b"%PDF-1.4 second", "auto", "eng", 200) != key
+    assert cache_key(b"%PDF-1.4 first", "ocr", "eng", 200) != key
+    assert cache_key(b"%PDF-1.4 first", "auto", "fra", 200) != key
+    # the text layer doesn't depend on the OCR settings.
+    assert cache_key(b"%PDF-1.4 first", "text", "eng", 200) == cache_key(
+        b"%PDF-1.4 first", "text", "fra", 300
+    )
+
+
+def test_iter_pages_extracts_a_changed_pdf_again(tmp_path):
+    cache = PDFTextCache(str(tmp_path / "pdf_text.sqlite3"))
+    extracted = []
+    key = cache_key(b"%PDF-1.4 first", "text", "eng", 200)
+    pages = list(cache.iter_pages(key, extract(["a", "b"], extracted)))
+    assert pages == [(0, "a"), (1, "b")]
+    assert extracted == [0, 1]
+
+    assert list(cache.iter_pages(key, extract(["a", "b"], extracted))) == pages
+    assert extracted == [0, 1]
+
+    # the file was edited: its hash, and so its key, changed.
+    key = cache_key(b"%PDF-1.4 edited", "text", "eng", 200)
+    pages = list(cache.iter_pages(key, extract(["a", "c"], extracted)))
+    assert pages == [(0, "a"), (1, "c")]
+    assert extracted == [0, 1, 0, 1]
+
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache = PDFTextCache(str(tmp_path / "pdf_text.sqlite3"))
+    text = "the same page text"
+    cache.put("first", [text])
+    # room for two documents.
+    cache.max_bytes = cache.stats()["num_bytes"] * 2
+    cache.put("second", [text])
+
+    # reading refreshes the access time of `first`, so `second` is evicted.
+    monkeypatch.setattr(pdf_cache, "TOUCH_INTERVAL_SECONDS", -1)
+    assert cache.get("first") == [text]
+    cache.put("third", [text])
+    assert cache.get("second") is None
+    assert cache.get("first") == [text]
+    assert cache.get("third") == [text]
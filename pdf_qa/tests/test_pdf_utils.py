@@ -0,0 +1,94 @@
+from concurrent.futures import Future
+
+import pdf_utils
+from pdf_utils import extract_pdf_pages, iter_hybrid_pages, iter_pdf_pages
+
+
+def make_pdf(texts):
+    """Returns a PDF with one page per text, each written in Helvetica."""
+    num_pages = len(texts)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids ["
+        + b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(num_pages))
+        + b"] /Count %d >>" % num_pages,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(texts):
+        stream = b"BT /F1 12 Tf 72 720 Td (%s) Tj ET" % text.encode("latin-1")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % (5 + 2 * i)
+        )
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\n" % (len(objects) + 1)
+    pdf += b"startxref\n%d\n%%%%EOF\n" % xref
+    return pdf
+
+
+def test_parallel_extraction_keeps_page_order():
+    texts = [f"This is page number {i} of the document" for i in range(11)]
+    pdf = make_pdf(texts)
+
+    serial = extract_pdf_pages(pdf, workers=1)
+    assert [text.strip() for text in serial] == texts
+
+    pages = list(iter_pdf_pages(pdf, workers=4, pages_per_task=2))
+    assert [page_number for page_number, _ in pages] == list(range(11))
+    assert [text for _, text in pages] == serial
+
+
+class RecordingExecutor:
+    """Runs the OCR tasks in the calling process, and records the pool size."""
+
+    instances = []
+
+    def __init__(self, max_workers, initializer, initargs):
+        self.max_workers = max_workers
+        initializer(*initargs)
+        RecordingExecutor.instances.append(self)
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def test_hybrid_pools_split_the_workers(monkeypatch):
+    text_workers = []
+    text_layers = ["", "A text layer long enough not to be OCR'd", ""]
+
+    def fake_iter_pdf_pages(pdf_file, workers):
+        text_workers.append(workers)
+        return enumerate(text_layers)
+
+    def fake_ocr(first_page, last_page, language, dpi):
+        return [f"OCR of page {first_page}"]
+
+    monkeypatch.setattr(pdf_utils, "iter_pdf_pages", fake_iter_pdf_pages)
+    monkeypatch.setattr(pdf_utils, "ProcessPoolExecutor", RecordingExecutor)
+    monkeypatch.setattr(pdf_utils, "_ocr_page_range_in_worker", fake_ocr)
+    RecordingExecutor.instances = []
+
+    pages = list(iter_hybrid_pages(b"%PDF", "eng", workers=5))
+    assert pages == [
+        (0, "OCR of page 0"),
+        (1, text_layers[1]),
+        (2, "OCR of page 2"),
+    ]
+    assert text_workers == [2]
+    assert [executor.max_workers for executor in RecordingExecutor.instances] == [3]